@@ -0,0 +1,724 @@
+import argparse
+import asyncio
+import datetime
+import itertools
+import os
+import resource
+import threading
+import time
+import uuid
+
+# === Нагрузочный прогон бота без сети ===
+# Настоящий dp из bot.py со всеми middleware получает синтетические апдейты:
+# каждый пользователь проходит "Добавить встречу", "Мои встречи" и приглашение.
+# Встречи и письма создают задачи outbox, воркеры которого работают тут же.
+# Telegram Bot API, Supabase, Google Calendar и SMTP заменены локальными
+# заглушками с настраиваемой задержкой. В конце печатаются пропускная
+# способность, p50/p95/p99 по обработчикам и пиковый RSS.
+#
+#   python benchmark.py --users 1000 --concurrency 200 --supabase-latency 0.02
+#
+# Ограничители частоты (throttling, SMTP) по умолчанию подняты, чтобы мерить
+# сам бот; реальные лимиты можно вернуть через USER_RATE, TELEGRAM_RATE и
+# SMTP_RATE_LIMIT в окружении.
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Нагрузочный прогон бота на заглушках")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=200, help="пользователей одновременно")
+    parser.add_argument("--telegram-latency", type=float, default=0.05)
+    parser.add_argument("--supabase-latency", type=float, default=0.02)
+    parser.add_argument("--google-latency", type=float, default=0.1)
+    parser.add_argument("--smtp-latency", type=float, default=0.2)
+    parser.add_argument("--mail-timeout", type=float, default=60, help="сколько ждать отправки приглашений")
+    parser.add_argument("--cold-start-budget", type=float, help="по умолчанию COLD_START_BUDGET из bot.py")
+    parser.add_argument("--fsm-storage", default="memory", choices=["memory", "sqlite", "redis"])
+    return parser.parse_args()
+
+
+# === Заглушка Supabase ===
+# Понимает ровно те запросы postgrest, что строит repository.py: фильтры,
+# or_ с and(...), встраивание связанных таблиц, сортировку и RPC из migrations/.
+
+RELATIONS = {
+    # (таблица, встраиваемая таблица) -> (вид связи, внешний ключ)
+    ("appointments", "clients"): ("one", "client_id"),
+    ("appointments", "calendar_events"): ("many", "appointment_id"),
+    ("calendar_events", "appointments"): ("one", "appointment_id"),
+}
+PRIMARY_KEYS = {"user_profiles": "telegram_id", "calendar_sync": "calendar_id"}
+# Индексы, чтобы заглушка не сканировала таблицы целиком и не искажала замеры
+INDEXES = [
+    ("settings", "telegram_id"), ("clients", "telegram_id"), ("appointments", "client_id"),
+    ("calendar_events", "appointment_id"), ("calendar_events", "event_id"),
+]
+
+
+def _coerce(value):
+    if isinstance(value, str):
+        if value.isdigit():
+            return int(value)
+        if len(value) >= 19 and value[4] == "-" and "T" in value:
+            return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return value
+
+
+def _split(text: str) -> list:
+    # Разбиение по запятым верхнего уровня (без учёта скобок и кавычек)
+    parts, depth, quoted, current = [], 0, False, ""
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        if char == "," and depth == 0 and not quoted:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += char
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+OPERATORS = {
+    "eq": lambda a, b: a == b,
+    "gt": lambda a, b: a is not None and a > b,
+    "gte": lambda a, b: a is not None and a >= b,
+    "lt": lambda a, b: a is not None and a < b,
+    "lte": lambda a, b: a is not None and a <= b,
+    "is": lambda a, b: a is None if b in ("null", None) else a == b,
+    "in": lambda a, b: a in b,
+}
+
+
+def _parse_condition(text: str):
+    if text.startswith("and(") or text.startswith("or("):
+        kind, inner = text.split("(", 1)
+        conditions = [_parse_condition(part) for part in _split(inner[:-1])]
+        combine = all if kind == "and" else any
+        return lambda row: combine(condition(row) for condition in conditions)
+    column, op, value = text.split(".", 2)
+    value = _coerce(value.strip('"'))
+    return lambda row: OPERATORS[op](_coerce(_get(row, column)), value)
+
+
+def _get(row: dict, column: str):
+    value = row
+    for part in column.split("."):
+        if value is None:
+            return None
+        value = value.get(part)
+    return value
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+
+class FakeQuery:
+    def __init__(self, db, table: str):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.payload = None
+        self.embeds = []
+        self.filters = []
+        self.orders = []
+        self.slice = None
+        self.lookups = []
+
+    # --- построение запроса ---
+    def select(self, columns: str = "*"):
+        for part in _split(columns):
+            if "(" in part:
+                name, _ = part.split("(", 1)
+                name, _, hint = name.partition("!")
+                self.embeds.append((name, hint == "inner"))
+        return self
+
+    def _filter(self, column, op, value):
+        if op == "eq":
+            self.lookups.append((column, _coerce(value)))
+        self.filters.append(lambda row: OPERATORS[op](_coerce(_get(row, column)), _coerce(value)))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, "eq", value)
+
+    def gt(self, column, value):
+        return self._filter(column, "gt", value)
+
+    def gte(self, column, value):
+        return self._filter(column, "gte", value)
+
+    def lt(self, column, value):
+        return self._filter(column, "lt", value)
+
+    def lte(self, column, value):
+        return self._filter(column, "lte", value)
+
+    def is_(self, column, value):
+        return self._filter(column, "is", value)
+
+    def in_(self, column, values):
+        values = [_coerce(v) for v in values]
+        self.filters.append(lambda row: _coerce(_get(row, column)) in values)
+        return self
+
+    def match(self, query: dict):
+        for column, value in query.items():
+            self.eq(column, value)
+        return self
+
+    def or_(self, text: str):
+        self.filters.append(_parse_condition(f"or({text})"))
+        return self
+
+    def order(self, column, desc: bool = False):
+        self.orders.append((column, desc))
+        return self
+
+    def limit(self, count: int):
+        self.slice = (0, count)
+        return self
+
+    def range(self, start: int, end: int):
+        self.slice = (start, end + 1)
+        return self
+
+    def insert(self, payload):
+        self.action, self.payload = "insert", payload
+        return self
+
+    def upsert(self, payload, on_conflict: str = "", ignore_duplicates: bool = False):
+        self.action, self.payload = "upsert", payload
+        self.on_conflict, self.ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, payload):
+        self.action, self.payload = "update", payload
+        return self
+
+    def delete(self):
+        self.action = "delete"
+        return self
+
+    # --- выполнение ---
+    def execute(self):
+        self.db.requests += 1
+        time.sleep(self.db.latency)
+        with self.db.lock:
+            return FakeResponse(getattr(self, f"_{self.action}")())
+
+    def _rows(self) -> list:
+        rows = []
+        for row in self.db.candidates(self.table, self.lookups):
+            row = dict(row)
+            skip = False
+            for name, inner in self.embeds:
+                row[name] = self.db.embed(self.table, name, row)
+                if inner and not row[name]:
+                    skip = True
+            if not skip and all(f(row) for f in self.filters):
+                rows.append(row)
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda r: _coerce(r[column]), reverse=desc)
+        if self.slice:
+            rows = rows[self.slice[0]:self.slice[1]]
+        return rows
+
+    def _select(self):
+        return self._rows()
+
+    def _insert(self):
+        payload = self.payload if isinstance(self.payload, list) else [self.payload]
+        return [self.db.insert(self.table, row) for row in payload]
+
+    def _upsert(self):
+        key = PRIMARY_KEYS.get(self.table, "id")
+        table = self.db.tables[self.table]
+        if self.on_conflict:
+            existing = [row for row in table.values() if row.get(self.on_conflict) == self.payload[self.on_conflict]]
+            if existing:
+                if self.ignore_duplicates:
+                    return []
+                existing[0].update(self.payload)
+                return [dict(existing[0])]
+        if self.payload.get(key) in table:
+            table[self.payload[key]].update(self.payload)
+            return [dict(table[self.payload[key]])]
+        return [self.db.insert(self.table, self.payload)]
+
+    def _update(self):
+        rows = self._rows()
+        key = PRIMARY_KEYS.get(self.table, "id")
+        for row in rows:
+            self.db.tables[self.table][row[key]].update(self.payload)
+        return rows
+
+    def _delete(self):
+        rows = self._rows()
+        key = PRIMARY_KEYS.get(self.table, "id")
+        for row in rows:
+            self.db.delete(self.table, row[key])
+        return rows
+
+
+class FakeRpc:
+    def __init__(self, db, name: str, params: dict):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.db.requests += 1
+        time.sleep(self.db.latency)
+        with self.db.lock:
+            return FakeResponse(getattr(self.db, f"rpc_{self.name}")(**self.params))
+
+
+class FakeSupabase:
+    DEFAULTS = {
+        "user_profiles": {"timezone": "Europe/Moscow", "meeting_duration_minutes": 60, "locale": "ru"},
+        "appointments": {"reminder_sent_at": None},
+        "outbox": {"status": "pending", "attempts": 0, "locked_until": None, "last_error": None},
+    }
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.tables = {name: {} for name in (
+            "settings", "clients", "appointments", "calendar_events", "user_profiles", "calendar_sync", "outbox"
+        )}
+        self._ids = itertools.count(1)
+        self.indexes = {index: {} for index in INDEXES}
+
+    def table(self, name: str) -> FakeQuery:
+        return FakeQuery(self, name)
+
+    def rpc(self, name: str, params: dict) -> FakeRpc:
+        return FakeRpc(self, name, params)
+
+    def insert(self, table: str, row: dict) -> dict:
+        key = PRIMARY_KEYS.get(table, "id")
+        row = {**self.DEFAULTS.get(table, {}), **row}
+        if key == "id" and "id" not in row:
+            row["id"] = next(self._ids)
+        if table == "appointments":
+            row["meeting_date_time"] = _coerce(row["meeting_date_time"]).astimezone(datetime.timezone.utc).isoformat()
+        self.tables[table][row[key]] = row
+        for (index_table, column), index in self.indexes.items():
+            if index_table == table:
+                index.setdefault(row.get(column), set()).add(row[key])
+        return dict(row)
+
+    def candidates(self, table: str, lookups: list) -> list:
+        rows = self.tables[table]
+        for column, value in lookups:
+            if column == PRIMARY_KEYS.get(table, "id"):
+                return [rows[value]] if value in rows else []
+            if (table, column) in self.indexes:
+                return [rows[key] for key in self.indexes[(table, column)].get(value, ())]
+            if table == "appointments" and column == "clients.telegram_id":
+                client_ids = self.indexes[("clients", "telegram_id")].get(value, ())
+                by_client = self.indexes[("appointments", "client_id")]
+                return [rows[key] for client_id in client_ids for key in by_client.get(client_id, ())]
+        return list(rows.values())
+
+    def delete(self, table: str, key):
+        row = self.tables[table].pop(key, None)
+        if row is None:
+            return
+        for (index_table, column), index in self.indexes.items():
+            if index_table == table:
+                index.get(row.get(column), set()).discard(key)
+        if table == "appointments":
+            # ON DELETE CASCADE (migrations/003_cascade_calendar_events.sql)
+            for event_key in list(self.indexes[("calendar_events", "appointment_id")].get(key, ())):
+                self.delete("calendar_events", event_key)
+
+    def embed(self, table: str, name: str, row: dict):
+        kind, foreign_key = RELATIONS[(table, name)]
+        if kind == "one":
+            target = self.tables[name].get(row.get(foreign_key))
+            if target and name == "appointments" and "clients" not in target:
+                target = {**target, "clients": self.embed("appointments", "clients", target)}
+            return dict(target) if target else None
+        return [dict(r) for r in self.candidates(name, [(foreign_key, row["id"])])]
+
+    def _client(self, telegram_id: int, name: str, phone: str) -> dict:
+        for client in self.candidates("clients", [("telegram_id", telegram_id)]):
+            return client
+        return self.insert("clients", {"name": name, "telegram_id": telegram_id, "phone_number": phone})
+
+    def rpc_create_meeting(self, p_telegram_id, p_name, p_phone, p_title, p_meeting_date_time,
+                           p_calendar_id, p_event_id):
+        client = self._client(p_telegram_id, p_name, p_phone)
+        for event in self.candidates("calendar_events", [("event_id", p_event_id)]):
+            # Повтор задачи outbox (migrations/009_outbox.sql)
+            appointment = dict(self.tables["appointments"][event["appointment_id"]])
+            return {"client": dict(client), "appointment": appointment, "event_id": p_event_id}
+        appointment = self.insert("appointments", {
+            "client_id": client["id"], "client_name": p_name, "meeting_date_time": p_meeting_date_time,
+            "phone_number": p_phone, "title": p_title, "calendar_id": p_calendar_id
+        })
+        self.insert("calendar_events", {"appointment_id": appointment["id"], "event_id": p_event_id})
+        return {"client": dict(client), "appointment": appointment, "event_id": p_event_id}
+
+    def rpc_import_meetings(self, p_telegram_id, p_name, p_phone, p_meetings):
+        return [
+            self.rpc_create_meeting(p_telegram_id, m.get("client_name", p_name), p_phone, m["title"], m["meeting_date_time"],
+                                    m["calendar_id"], m["event_id"])["appointment"]
+            for m in p_meetings
+        ]
+
+    def rpc_claim_outbox(self, p_limit, p_lease_seconds):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        jobs = sorted(
+            (job for job in self.tables["outbox"].values()
+             if job["status"] == "pending" and _coerce(job.get("next_attempt_at") or now.isoformat()) <= now
+             and (job["locked_until"] is None or _coerce(job["locked_until"]) < now)),
+            key=lambda job: job["id"]
+        )[:p_limit]
+        for job in jobs:
+            job["attempts"] += 1
+            job["locked_until"] = (now + datetime.timedelta(seconds=p_lease_seconds)).isoformat()
+        return [dict(job) for job in jobs]
+
+    def appointments_of(self, telegram_id: int) -> list:
+        with self.lock:
+            return self.candidates("appointments", [("clients.telegram_id", telegram_id)])
+
+
+# === Заглушка Google Calendar ===
+class FakeHttpError(Exception):
+    # Как googleapiclient.errors.HttpError: статус в resp.status
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.resp = type("Response", (), {"status": status})()
+
+
+class FakeRequest:
+    def __init__(self, google, fn):
+        self.google = google
+        self.fn = fn
+
+    def execute(self):
+        self.google.requests += 1
+        time.sleep(self.google.latency)
+        return self.fn()
+
+
+class FakeBatch:
+    def __init__(self, google, callback):
+        self.google = google
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request: FakeRequest, request_id: str):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        # Один HTTP-запрос на весь batch
+        self.google.requests += 1
+        time.sleep(self.google.latency)
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.fn(), None)
+            except Exception as e:
+                self.callback(request_id, None, e)
+
+
+class FakeGoogle:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+        self.calendars = {}  # calendar_id -> {event_id: тело события}
+
+    def events(self):
+        return self
+
+    def freebusy(self):
+        return self
+
+    def insert(self, calendarId, body):
+        def run():
+            event_id = body.get("id") or uuid.uuid4().hex
+            events = self.calendars.setdefault(calendarId, {})
+            if event_id in events:
+                raise FakeHttpError(409, "The requested identifier already exists.")
+            events[event_id] = body
+            return {"id": event_id, "htmlLink": f"https://calendar.google.com/event?eid={event_id}"}
+        return FakeRequest(self, run)
+
+    def get(self, calendarId, eventId):
+        def run():
+            if eventId not in self.calendars.get(calendarId, {}):
+                raise FakeHttpError(404, "Not Found")
+            return {"id": eventId, "htmlLink": f"https://calendar.google.com/event?eid={eventId}"}
+        return FakeRequest(self, run)
+
+    def delete(self, calendarId, eventId):
+        def run():
+            self.calendars.get(calendarId, {}).pop(eventId, None)
+            return ""
+        return FakeRequest(self, run)
+
+    def query(self, body):
+        def run():
+            return {"calendars": {
+                item["id"]: {"busy": [
+                    {"start": event["start"]["dateTime"], "end": event["end"]["dateTime"]}
+                    for event in self.calendars.get(item["id"], {}).values()
+                ]}
+                for item in body["items"]
+            }}
+        return FakeRequest(self, run)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+# === Заглушки SMTP и сервисного аккаунта Google ===
+class FakeSMTP:
+    def __init__(self, counter: dict, latency: float):
+        self.counter = counter
+        self.latency = latency
+        self.is_connected = True
+
+    async def send_message(self, message, recipients=None):
+        await asyncio.sleep(self.latency)
+        self.counter["sent"] += 1
+        return {}, "OK"
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+class FakeCredentials:
+    service_account_email = "benchmark@example.iam.gserviceaccount.com"
+
+
+# === Заглушка Telegram Bot API ===
+class FakeTelegram:
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = {}
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        from aiogram.types import Chat, Message
+        name = type(method).__name__
+        self.requests[name] = self.requests.get(name, 0) + 1
+        await asyncio.sleep(self.latency)
+        if method.__returning__ is Message:
+            chat_id = getattr(method, "chat_id", 0)
+            return Message(
+                message_id=next(self._message_ids),
+                date=datetime.datetime.now(datetime.timezone.utc),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None)
+            ).as_(bot)
+        return True
+
+
+def load_bot(args):
+    # Окружение нужно до импорта: bot.py читает настройки при загрузке
+    for name, value in {
+        "TOKEN_TELEGRAM": "123456:BENCHMARK",
+        "SUPABASE_URL": "http://supabase.benchmark",
+        "SUPABASE_KEY": "benchmark",
+        "SERVICE_ACCOUNT_FILE": "benchmark.json",
+        "SMTP_EMAIL": "bot@example.com",
+        "FSM_STORAGE": args.fsm_storage,
+        "FSM_SQLITE_PATH": "benchmark_fsm.sqlite3",
+        "USER_RATE": "1000000",
+        "USER_BURST": "1000000",
+        "TELEGRAM_RATE": "1000000",
+        "TELEGRAM_BURST": "1000000",
+        "SMTP_RATE_LIMIT": "1000000",
+        "CALENDAR_SYNC_INTERVAL": "0",
+    }.items():
+        os.environ.setdefault(name, value)
+    import bot
+    return bot
+
+
+# === Сценарий ===
+class Recorder:
+    def __init__(self):
+        self.handlers = {}
+        self.flows = []
+
+    async def __call__(self, handler, event, data):
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            name = data["handler"].callback.__name__
+            self.handlers.setdefault(name, []).append(time.perf_counter() - start)
+
+
+def percentile(values: list, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Simulator:
+    def __init__(self, bot_module, db: FakeSupabase):
+        self.bot_module = bot_module
+        self.bot = bot_module.bot
+        self.dp = bot_module.dp
+        self.db = db
+        self.updates = 0
+        self._update_ids = itertools.count(1)
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User {user_id}"}
+
+    async def _feed(self, payload: dict):
+        from aiogram.types import Update
+        update = Update.model_validate({"update_id": next(self._update_ids), **payload}, context={"bot": self.bot})
+        self.updates += 1
+        await self.dp.feed_update(self.bot, update)
+
+    async def message(self, user_id: int, text: str):
+        await self._feed({"message": {
+            "message_id": next(self._update_ids),
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text
+        }})
+
+    async def callback(self, user_id: int, data: str):
+        await self._feed({"callback_query": {
+            "id": str(next(self._update_ids)),
+            "from": self._user(user_id),
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": 1,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "..."
+            }
+        }})
+
+    async def run_user(self, user_id: int, number: int):
+        meeting_at = datetime.datetime.now() + datetime.timedelta(days=1, minutes=number)
+        for text in (
+            "Добавить встречу", "Рабочий", "Встреча из бенчмарка", f"Клиент {number}",
+            meeting_at.strftime("%Y-%m-%d %H:%M"), f"+7999{number:07d}", "Комментарий"
+        ):
+            await self.message(user_id, text)
+        # Встречу создаёт задача outbox в фоне — ждём её, как ждал бы пользователь ссылку
+        appointments = []
+        for _ in range(200):
+            appointments = self.db.appointments_of(user_id)
+            if appointments:
+                break
+            await asyncio.sleep(0.05)
+        await self.message(user_id, "Мои встречи")
+        if appointments:
+            await self.callback(user_id, f"invite:{appointments[0]['id']}")
+            await self.message(user_id, f"guest{number}@example.com")
+
+
+async def run(args):
+    db = FakeSupabase(args.supabase_latency)
+    google = FakeGoogle(args.google_latency)
+    telegram = FakeTelegram(args.telegram_latency)
+    smtp_counter = {"sent": 0}
+    import_started = time.perf_counter()
+    bot_module = load_bot(args)
+    import_seconds = time.perf_counter() - import_started
+
+    # Клиенты в bot.py ленивые, поэтому заглушки подставляются уже после импорта
+    import calendar_gateway
+    import mailer
+    import repository
+    repository.setup(lambda: db)
+    calendar_gateway._service = lambda: google
+    calendar_gateway._credentials = FakeCredentials()
+    bot_module.bot.session.make_request = telegram.make_request
+
+    async def connect(pool):
+        await asyncio.sleep(args.smtp_latency)
+        return FakeSMTP(smtp_counter, args.smtp_latency)
+    mailer.SMTPPool._connect = connect
+
+    recorder = Recorder()
+    bot_module.dp.message.middleware(recorder)
+    bot_module.dp.callback_query.middleware(recorder)
+
+    users = [1_000_000 + i for i in range(args.users)]
+    for user_id in users:
+        db.insert("settings", {
+            "telegram_id": user_id, "calendar_id": f"calendar-{user_id}@group.calendar.google.com",
+            "calendar_name": "Рабочий"
+        })
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user_flow(number: int, user_id: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await simulator.run_user(user_id, number)
+            recorder.flows.append(time.perf_counter() - start)
+
+    simulator = Simulator(bot_module, db)
+    first_started = time.perf_counter()
+    await simulator.message(1, "/start")
+    first_update = time.perf_counter() - first_started
+    cold_start = import_seconds + first_update
+    budget = args.cold_start_budget if args.cold_start_budget is not None else bot_module.COLD_START_BUDGET
+
+    outbox_task = asyncio.create_task(bot_module.outbox_worker.run())
+    started = time.perf_counter()
+    await asyncio.gather(*(user_flow(number, user_id) for number, user_id in enumerate(users)))
+    handled = time.perf_counter() - started
+
+    # Приглашения уходят в фоне — дожидаемся их и сообщений с итогом
+    deadline = time.perf_counter() + args.mail_timeout
+    while smtp_counter["sent"] < args.users and time.perf_counter() < deadline:
+        await asyncio.sleep(0.05)
+    await asyncio.gather(*list(bot_module.background_tasks), return_exceptions=True)
+    total = time.perf_counter() - started
+    outbox_task.cancel()
+    await bot_module.email_sender.stop()
+    await bot_module.dp.storage.close()
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Холодный старт: импорт bot.py {import_seconds:.2f}s + первый апдейт {first_update * 1000:.0f} мс "
+          f"= {cold_start:.2f}s ({'в бюджете' if cold_start <= budget else 'больше бюджета'} {budget:.1f}s)")
+    print(f"Пользователей: {args.users}, одновременно: {args.concurrency}")
+    print(f"Задержки: telegram {args.telegram_latency}s, supabase {args.supabase_latency}s, "
+          f"google {args.google_latency}s, smtp {args.smtp_latency}s")
+    print(f"Апдейтов: {simulator.updates} за {handled:.2f}s — {simulator.updates / handled:.1f} апд/с, "
+          f"{args.users / handled:.1f} сценариев/с")
+    print(f"Сценарий пользователя: p50 {percentile(recorder.flows, 0.5):.3f}s, "
+          f"p95 {percentile(recorder.flows, 0.95):.3f}s, p99 {percentile(recorder.flows, 0.99):.3f}s")
+    print(f"Писем отправлено: {smtp_counter['sent']} из {args.users} за {total:.2f}s")
+    print(f"Задачи outbox: {bot_module.outbox_worker.stats}")
+    print(f"Внешние запросы: supabase {db.requests}, google {google.requests}, "
+          f"telegram {sum(telegram.requests.values())} {dict(sorted(telegram.requests.items()))}")
+    print(f"Пиковый RSS: {peak_rss:.1f} МБ")
+    print()
+    print(f"{'обработчик':<28}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for name, values in sorted(recorder.handlers.items()):
+        print(f"{name:<28}{len(values):>7}{percentile(values, 0.5) * 1000:>10.1f}"
+              f"{percentile(values, 0.95) * 1000:>10.1f}{percentile(values, 0.99) * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
@@ -1,28 +1,39 @@
+import time
+STARTED_AT = time.perf_counter()  # до тяжёлых импортов: отсюда считается холодный старт
+
 import asyncio
 import logging
 import datetime
+import html
+import tempfile
 import urllib
 
-import pytz
 import re
 from aiogram import Bot, Dispatcher, types, F
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
-from aiogram.fsm.storage.memory import MemoryStorage
-from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
-from google.oauth2.service_account import Credentials
-from googleapiclient.discovery import build
-from supabase import create_client
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton, BufferedInputFile
 from dotenv import load_dotenv
 import os
-import ssl
-import certifi
-import aiosmtplib
-from email.message import EmailMessage
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
+
+import calendar_gateway
+import calendar_sync
+import digest
+import exporter
+import importer
+import mailer
+import outbox
+import meetings
+import metrics
+import profiles
+import reminders
+import repository
+import search
+import slots
+import storage
+import throttling
+import webhook
 
 # Загружаем данные из .env
 load_dotenv()
@@ -32,22 +43,38 @@ TOKEN_TELEGRAM = os.getenv("TOKEN_TELEGRAM")
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 SERVICE_ACCOUNT_FILE = os.getenv("SERVICE_ACCOUNT_FILE")
-smtp_email = os.getenv("SMTP_EMAIL")
-smtp_password = os.getenv("SMTP_PASSWORD")
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # polling | webhook
+COLD_START_BUDGET = float(os.getenv("COLD_START_BUDGET", "5"))  # секунд от запуска процесса до приёма апдейтов
 
 if not all([TOKEN_TELEGRAM, SUPABASE_URL, SUPABASE_KEY, SERVICE_ACCOUNT_FILE]):
     raise ValueError("Проверьте, что все переменные окружения указаны в .env!")
 
-CALENDAR_ID = {}
-
 bot = Bot(token=TOKEN_TELEGRAM)
-dp = Dispatcher(storage=MemoryStorage())
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+fsm_storage = storage.create_storage()
+dp = Dispatcher(storage=fsm_storage, events_isolation=storage.create_events_isolation(fsm_storage))
+search.setup(fsm_storage, bot.id)
 
-creds = Credentials.from_service_account_file(
-    SERVICE_ACCOUNT_FILE, scopes=["https://www.googleapis.com/auth/calendar"]
-)
-calendar_service = build("calendar", "v3", credentials=creds)
+def create_supabase():
+    # Клиент supabase (и его зависимости) загружается не при импорте, а при первом запросе
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+repository.setup(create_supabase)
+calendar_gateway.setup(SERVICE_ACCOUNT_FILE)
+reminder_scheduler = reminders.ReminderScheduler(bot)
+email_sender = mailer.Mailer()
+calendar_synchronizer = calendar_sync.CalendarSync(on_moved=reminder_scheduler.schedule)
+digest_sender = digest.DigestSender(bot)
+outbox_worker = outbox.Outbox()
+# Ограничители ставим первыми, чтобы время ожидания не попадало в метрики запросов к Telegram
+throttling.setup(dp, bot)
+metrics.setup(dp, bot)
+metrics.register_collector(lambda: {
+    f"bot_calendar_cache_{name}": value for name, value in repository.calendar_cache_stats().items()
+})
+metrics.register_collector(lambda: {f"bot_outbox_{name}": value for name, value in outbox_worker.stats.items()})
+background_tasks = set()
+background_runners = []
 
 # === FSM ===
 class AddMeeting(StatesGroup):
@@ -70,6 +97,14 @@ class EditCalendarName(StatesGroup):
     new_name = State()
     delete_choose = State()
 
+class ImportMeetings(StatesGroup):
+    calendar_choice = State()
+    waiting_for_file = State()
+
+class EditProfile(StatesGroup):
+    timezone = State()
+    duration = State()
+
 # === Клавиатуры ===
 main_menu = ReplyKeyboardMarkup(keyboard=[
     [KeyboardButton(text="Добавить встречу")],
@@ -89,16 +124,20 @@ edit_menu = ReplyKeyboardMarkup(keyboard=[
     [KeyboardButton(text="Главное меню / Отмена")]
 ], resize_keyboard=True)
 
-appointments_menu = ReplyKeyboardMarkup(keyboard=[
-    [KeyboardButton(text="Главное меню")]
-], resize_keyboard=True)
-
 # === Мои календари ===
+# В состоянии FSM храним только calendar_id, сам список берём из кэша repository
+async def find_calendar_by_name(user_id: int, name: str):
+    name = name.strip().lower()
+    for c in await repository.get_calendars(user_id):
+        if c["calendar_name"].lower() == name:
+            return c
+    return None
+
 @dp.message(F.text.lower() == "мои календари")
 async def list_calendars(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    result = supabase.table("settings").select("*").eq("telegram_id", user_id).execute()
-    if not result.data:
+    calendars = await repository.get_calendars(user_id)
+    if not calendars:
         # Если нет календарей, предлагаем добавить
         keyboard = ReplyKeyboardMarkup(keyboard=[
             [KeyboardButton(text="Установить календарь")],
@@ -109,34 +148,30 @@ async def list_calendars(message: types.Message, state: FSMContext):
             reply_markup=keyboard
         )
     # Если календари есть – отображаем список
-    await state.update_data(calendar_list=result.data)
     text = "📅 Ваши календари:\n\n"
-    for i, c in enumerate(result.data, 1):
+    for i, c in enumerate(calendars, 1):
         text += f"{i}) *{c['calendar_name']}*\n`{c['calendar_id']}`\n\n"
     await message.answer(text, parse_mode="Markdown", reply_markup=edit_menu)
 
 @dp.message(F.text.lower() == "изменить название календаря")
 async def start_rename_calendar(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    result = supabase.table("settings").select("*").eq("telegram_id", user_id).execute()
-    if not result.data:
+    calendars = await repository.get_calendars(user_id)
+    if not calendars:
         return await message.answer("У вас нет календарей для изменения.", reply_markup=main_menu)
-    await state.update_data(calendar_list=result.data)
     await state.set_state(EditCalendarName.choose)
-    buttons = [[KeyboardButton(text=c["calendar_name"])] for c in result.data]
+    buttons = [[KeyboardButton(text=c["calendar_name"])] for c in calendars]
     keyboard = ReplyKeyboardMarkup(keyboard=buttons + [[KeyboardButton(text="Главное меню / Отмена")]], resize_keyboard=True)
     await message.answer("Выберите календарь, который хотите переименовать:", reply_markup=keyboard)
 
 @dp.message(EditCalendarName.choose)
 async def choose_calendar_to_rename(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    selected_name = message.text.strip()
-    for c in data.get("calendar_list", []):
-        if c["calendar_name"].lower() == selected_name.lower():
-            await state.update_data(calendar_id=c["calendar_id"])
-            await state.set_state(EditCalendarName.new_name)
-            await message.answer("Введите новое название календаря:", reply_markup=cancel_menu)
-            return
+    c = await find_calendar_by_name(message.from_user.id, message.text)
+    if c:
+        await state.update_data(calendar_id=c["calendar_id"])
+        await state.set_state(EditCalendarName.new_name)
+        await message.answer("Введите новое название календаря:", reply_markup=cancel_menu)
+        return
     await message.answer("Пожалуйста, выберите календарь из предложенных кнопок.")
 
 @dp.message(EditCalendarName.new_name)
@@ -146,10 +181,7 @@ async def rename_calendar(message: types.Message, state: FSMContext):
     new_name = message.text.strip()
     calendar_id = data.get("calendar_id")
     try:
-        supabase.table("settings").update({"calendar_name": new_name}).match({
-            "telegram_id": user_id,
-            "calendar_id": calendar_id
-        }).execute()
+        await repository.rename_calendar(user_id, calendar_id, new_name)
         await message.answer("✅ Название календаря обновлено!", reply_markup=main_menu)
     except Exception as e:
         await message.answer(f"❌ Ошибка при переименовании: {e}", reply_markup=main_menu)
@@ -158,11 +190,10 @@ async def rename_calendar(message: types.Message, state: FSMContext):
 @dp.message(F.text.lower() == "удалить календарь")
 async def start_calendar_delete(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    calendars = supabase.table("settings").select("*").eq("telegram_id", user_id).execute().data
+    calendars = await repository.get_calendars(user_id)
     if not calendars:
         return await message.answer("У вас нет календарей для удаления.", reply_markup=main_menu)
     await state.set_state(EditCalendarName.delete_choose)
-    await state.update_data(calendar_list=calendars)
     buttons = [[KeyboardButton(text=c["calendar_name"])] for c in calendars]
     keyboard = ReplyKeyboardMarkup(keyboard=buttons + [[KeyboardButton(text="Главное меню / Отмена")]], resize_keyboard=True)
     await message.answer("Выберите календарь, который хотите удалить:", reply_markup=keyboard)
@@ -171,23 +202,19 @@ async def start_calendar_delete(message: types.Message, state: FSMContext):
 async def delete_selected_calendar(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
     selected_name = message.text.strip()
-    data = await state.get_data()
-    for calendar in data.get("calendar_list", []):
-        if calendar["calendar_name"].lower() == selected_name.lower():
-            supabase.table("settings").delete().match({
-                "telegram_id": user_id,
-                "calendar_id": calendar["calendar_id"]
-            }).execute()
-            await message.answer(f"✅ Календарь '{selected_name}' удалён.", reply_markup=main_menu)
-            await state.clear()
-            return
+    calendar = await find_calendar_by_name(user_id, selected_name)
+    if calendar:
+        await repository.delete_calendar(user_id, calendar["calendar_id"])
+        await message.answer(f"✅ Календарь '{selected_name}' удалён.", reply_markup=main_menu)
+        await state.clear()
+        return
     await message.answer("❌ Не удалось найти календарь. Пожалуйста, выберите из списка.")
 
 # === Добавление встречи ===
 @dp.message(F.text.lower() == "добавить встречу")
 async def add_meeting_start(message: types.Message, state: FSMContext):
     user_id = message.from_user.id
-    calendars = supabase.table("settings").select("*").eq("telegram_id", user_id).execute().data
+    calendars = await repository.get_calendars(user_id)
     if not calendars:
         keyboard = ReplyKeyboardMarkup(keyboard=[
             [KeyboardButton(text="Установить календарь")],
@@ -195,20 +222,17 @@ async def add_meeting_start(message: types.Message, state: FSMContext):
         ], resize_keyboard=True)
         return await message.answer("Сначала добавьте хотя бы один календарь.", reply_markup=keyboard)
     buttons = [[KeyboardButton(text=c["calendar_name"])] for c in calendars]
-    await state.update_data(calendar_list=calendars)
     await state.set_state(AddMeeting.calendar_choice)
     await message.answer("Выберите календарь для встречи:", reply_markup=ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True))
 
 @dp.message(AddMeeting.calendar_choice)
 async def select_calendar(message: types.Message, state: FSMContext):
-    data = await state.get_data()
-    selected = message.text.strip()
-    for c in data.get("calendar_list", []):
-        if c["calendar_name"].lower() == selected.lower():
-            await state.update_data(calendar_id=c["calendar_id"])
-            await state.set_state(AddMeeting.title)
-            await message.answer("Введите название встречи:", reply_markup=cancel_menu)
-            return
+    c = await find_calendar_by_name(message.from_user.id, message.text)
+    if c:
+        await state.update_data(calendar_id=c["calendar_id"])
+        await state.set_state(AddMeeting.title)
+        await message.answer("Введите название встречи:", reply_markup=cancel_menu)
+        return
     await message.answer("Пожалуйста, выберите календарь из списка кнопок.")
 
 @dp.message(AddMeeting.title)
@@ -221,22 +245,35 @@ async def get_title(message: types.Message, state: FSMContext):
 async def get_name(message: types.Message, state: FSMContext):
     await state.update_data(name=message.text)
     await state.set_state(AddMeeting.datetime)
-    await message.answer("Введите дату и время (YYYY-MM-DD HH:MM):")
+    data = await state.get_data()
+    try:
+        free = await slots.get_free_slots([data["calendar_id"]], await profiles.get_profile(message.from_user.id))
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось получить свободное время календаря: {e}")
+        free = []
+    if not free:
+        return await message.answer("Введите дату и время (YYYY-MM-DD HH:MM):")
+    labels = [slot.strftime(meetings.DATETIME_FORMAT) for slot in free]
+    buttons = [[KeyboardButton(text=label) for label in labels[i:i + 2]] for i in range(0, len(labels), 2)]
+    await message.answer(
+        "Выберите свободное время или введите дату и время вручную (YYYY-MM-DD HH:MM):",
+        reply_markup=ReplyKeyboardMarkup(keyboard=buttons + [[KeyboardButton(text="Главное меню / Отмена")]], resize_keyboard=True)
+    )
 
 @dp.message(AddMeeting.datetime)
 async def get_datetime(message: types.Message, state: FSMContext):
     try:
-        datetime.datetime.strptime(message.text, "%Y-%m-%d %H:%M")
-        await state.update_data(datetime=message.text)
+        meetings.parse_datetime(message.text)
+        await state.update_data(datetime=message.text.strip())
         await state.set_state(AddMeeting.phone)
-        await message.answer("Введите номер телефона клиента в формате: +7XXXXXXXXXX")
+        await message.answer("Введите номер телефона клиента в формате: +7XXXXXXXXXX", reply_markup=cancel_menu)
     except ValueError:
         await message.answer("Неверный формат. Пример: 2025-03-30 14:00")
 
 @dp.message(AddMeeting.phone)
 async def get_phone(message: types.Message, state: FSMContext):
     phone = message.text.strip()
-    if not re.fullmatch(r"\+7\d{10}", phone):
+    if not meetings.is_valid_phone(phone):
         return await message.answer("⚠️ Номер должен быть в формате +7XXXXXXXXXX.\n\nПожалуйста, введите корректный номер:")
     await state.update_data(phone=phone)
     await state.set_state(AddMeeting.comment)
@@ -249,198 +286,463 @@ async def get_comment(message: types.Message, state: FSMContext):
     data = await state.get_data()
     await state.clear()
     try:
-        dt = pytz.timezone("Europe/Moscow").localize(datetime.datetime.strptime(data["datetime"], "%Y-%m-%d %H:%M"))
-        client_result = supabase.table("clients").select("*").eq("telegram_id", user_id).execute().data
-        if client_result:
-            client = client_result[0]
+        profile = await profiles.get_profile(user_id)
+        dt = profile.localize(meetings.parse_datetime(data["datetime"]))
+        # Повторная доставка того же сообщения даёт тот же ключ и не создаёт вторую задачу
+        key = f"meeting:{user_id}:{message.message_id}"
+        await outbox_worker.enqueue("create_meeting", key, {
+            "user_id": user_id,
+            "chat_id": message.chat.id,
+            "calendar_id": data["calendar_id"],
+            "title": data["title"],
+            "name": data["name"],
+            "phone": data["phone"],
+            "comment": data["comment"],
+            "datetime": dt.isoformat(),
+            "timezone": profile.timezone,
+            "duration_minutes": profile.duration_minutes,
+            "event_id": calendar_gateway.event_id_for(key)
+        })
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось записать встречу пользователя {user_id}: {e}")
+        return await message.answer("❌ Не удалось сохранить встречу, попробуйте ещё раз.", reply_markup=main_menu)
+    await message.answer(
+        "⏳ Встреча принята, добавляем её в Google Календарь. Пришлю ссылку, как только событие появится.",
+        reply_markup=main_menu
+    )
+
+async def perform_create_meeting(payload: dict):
+    # Задача outbox: каждый шаг идемпотентен, повтор после сбоя не создаёт дублей
+    user_id, calendar_id, event_id = payload["user_id"], payload["calendar_id"], payload["event_id"]
+    dt = datetime.datetime.fromisoformat(payload["datetime"])
+    duration = datetime.timedelta(minutes=payload["duration_minutes"])
+    event = meetings.build_event(
+        payload["title"], payload["name"], payload["phone"], payload["comment"], dt, duration, payload["timezone"]
+    )
+    event["id"] = event_id
+    try:
+        created_event = await calendar_gateway.insert_event(calendar_id, event)
+    except calendar_gateway.CalendarError as e:
+        if e.status == 409:
+            # Событие создала предыдущая попытка
+            created_event = await calendar_gateway.get_event(calendar_id, event_id)
+        elif e.status in (400, 404) or e.permission_denied:
+            # Остальные 403 — лимит запросов Google, их outbox повторит
+            raise outbox.PermanentError(str(e)) from e
+        else:
+            raise
+    meeting = await repository.create_meeting(
+        user_id, payload["name"], payload["phone"], payload["title"], dt.isoformat(), calendar_id, event_id
+    )
+    appointment = meeting["appointment"]
+    slots.add_busy(calendar_id, dt, duration)
+    search.invalidate(user_id)
+    reminder_scheduler.schedule(appointment, user_id)
+    await notify_meeting_created(payload["chat_id"], created_event.get("htmlLink"), appointment["id"])
+
+async def notify_meeting_created(chat_id: int, event_link: str, appointment_id: int):
+    # Ошибка отправки не повторяет задачу: встреча уже создана
+    try:
+        if event_link:
+            await bot.send_message(
+                chat_id,
+                f"✅ Встреча добавлена!\n\n"
+                f"📅 [Открыть событие в Google Календаре]({event_link})",
+                parse_mode="Markdown"
+            )
         else:
-            client = supabase.table("clients").insert({
-                "name": data["name"],
-                "telegram_id": user_id,
-                "phone_number": data["phone"]
-            }).execute().data[0]
-        event = {
-            "summary": data["title"],
-            "description": (
-                f"👤 Клиент: {data['name']}\n"
-                f"📞 Телефон: {data['phone']}\n"
-                f"📝 Комментарий: {data['comment'] or '—'}"
-            ),
-            "start": {"dateTime": dt.isoformat(), "timeZone": "Europe/Moscow"},
-            "end": {"dateTime": (dt + datetime.timedelta(hours=1)).isoformat(), "timeZone": "Europe/Moscow"}
-        }
-        from googleapiclient.errors import HttpError
-
-        SERVICE_EMAIL = creds.service_account_email  # e.g. don-t-forget-crm-bot@...
-
-        try:
-            created_event = calendar_service.events().insert(calendarId=data["calendar_id"], body=event).execute()
-            appointment = supabase.table("appointments").insert({
-                "client_id": client["id"],
-                "meeting_date_time": dt.isoformat(),
-                "phone_number": data["phone"],
-                "title": data["title"],
-                "calendar_id": data["calendar_id"]
-            }).execute().data[0]
-            event_id = created_event["id"]
-            supabase.table("calendar_events").insert({
-                "appointment_id": appointment["id"],
-                "event_id": event_id
-            }).execute()
-            event_link = created_event.get("htmlLink")
-            if event_link:
-                await message.answer(
-                    f"✅ Встреча добавлена!\n\n"
-                    f"📅 [Открыть событие в Google Календаре]({event_link})",
-                    parse_mode="Markdown",
-                    reply_markup=main_menu
-                )
-            else:
-                await message.answer("✅ Встреча добавлена, но ссылка на событие не получена.", reply_markup=main_menu)
-
-            # Предложить отправить приглашение:
-            invite_keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(
-                    text="📨 Отправить приглашение другому участнику",
-                    callback_data=f"invite:{appointment['id']}"
-                )]
-            ])
-            await message.answer("Хотите отправить приглашение другому участнику?", reply_markup=invite_keyboard)
-
-        except HttpError as http_err:
-            if http_err.resp.status == 403 and "writer access" in str(http_err):
-                await message.answer(
-                    f"❗️ Наш бот не может добавить встречу, так как сервисному аккаунту не даны нужные права.\n\n"
-                    f"🛠 Откройте настройки календаря и добавьте сервисный аккаунт:\n"
-                    f"`{SERVICE_EMAIL}`\n\n"
-                    f"Выберите доступ: *Внесение изменений и предоставление доступа* (Editor).\n"
-                    f"После этого повторите попытку.",
-                    parse_mode="Markdown",
-                    reply_markup=main_menu
-                )
-            elif http_err.resp.status == 404:
-                await message.answer(
-                    f"❗️ Календарь не найден или бот не имеет к нему доступа.\n\n"
-                    f"Проверьте, добавлен ли аккаунт:\n"
-                    f"`{SERVICE_EMAIL}` с правами *Редактор*.",
-                    parse_mode="Markdown",
-                    reply_markup=main_menu
-                )
-            else:
-                await message.answer(f"❌ Ошибка при добавлении встречи: {http_err}", reply_markup=main_menu)
-        # Предложение отправить приглашение участнику
+            await bot.send_message(chat_id, "✅ Встреча добавлена, но ссылка на событие не получена.")
         invite_keyboard = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(
                 text="📨 Отправить приглашение другому участнику",
-                callback_data=f"invite:{appointment['id']}"
+                callback_data=f"invite:{appointment_id}"
             )]
         ])
+        await bot.send_message(chat_id, "Хотите отправить приглашение другому участнику?", reply_markup=invite_keyboard)
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось сообщить о созданной встрече {appointment_id}: {e}")
+
+async def report_meeting_failed(payload: dict, error: Exception):
+    calendar_id, event_id = payload["calendar_id"], payload["event_id"]
+    try:
+        if (await repository.get_appointments_by_event_ids([event_id])).get(event_id) is None:
+            # Встреча в базу так и не записалась — убираем событие, если оно успело появиться
+            await calendar_gateway.delete_event(calendar_id, event_id)
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось убрать событие {event_id} после неудачной задачи: {e}")
+    cause = error.__cause__ if isinstance(error.__cause__, calendar_gateway.CalendarError) else error
+    status = getattr(cause, "status", None)
+    title = html.escape(payload["title"])
+    if status == 404 or getattr(cause, "permission_denied", False):
+        service_email = calendar_gateway.service_account_email()  # e.g. don-t-forget-crm-bot@...
+        text = (
+            f"❗️ Не удалось добавить встречу «{title}»: "
+            + ("сервисному аккаунту не даны нужные права.\n\n" if status == 403
+               else "календарь не найден или бот не имеет к нему доступа.\n\n")
+            + f"🛠 Откройте настройки календаря и добавьте сервисный аккаунт:\n"
+            f"<code>{html.escape(service_email)}</code>\n\n"
+            f"Выберите доступ: <b>Внесение изменений и предоставление доступа</b> (Editor).\n"
+            f"После этого добавьте встречу ещё раз."
+        )
+    else:
+        text = f"❌ Не удалось добавить встречу «{title}». Попробуйте добавить её ещё раз позже."
+    try:
+        await bot.send_message(payload["chat_id"], text, parse_mode="HTML")
     except Exception as e:
-        await message.answer(f"❌ Ошибка при добавлении встречи: {e}", reply_markup=main_menu)
+        logging.warning(f"⚠️ Не удалось сообщить о неудачной встрече: {e}")
+
+outbox_worker.register("create_meeting", perform_create_meeting, on_dead=report_meeting_failed)
 
 @dp.callback_query(F.data.startswith("invite:"))
 async def handle_invite_start(callback: types.CallbackQuery, state: FSMContext):
     appointment_id = int(callback.data.split(":")[1])
     await state.set_state(InviteParticipant.waiting_for_email)
     await state.update_data(appointment_id=appointment_id)
-    await callback.message.answer("Введите email участника, которому нужно отправить приглашение:")
+    await callback.message.answer("Введите email участника, которому нужно отправить приглашение.\nМожно указать несколько адресов через запятую или пробел:")
     await callback.answer()
 
+def parse_emails(text: str) -> tuple:
+    valid, invalid = [], []
+    for email in re.split(r"[\s,;]+", text.strip()):
+        if not email:
+            continue
+        if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
+            invalid.append(email)
+        elif email.lower() not in (e.lower() for e in valid):
+            valid.append(email)
+    return valid, invalid
+
 @dp.message(InviteParticipant.waiting_for_email)
 async def handle_email_input(message: types.Message, state: FSMContext, description=None):
-    email = message.text.strip()
-    if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
+    emails, invalid = parse_emails(message.text or "")
+    if not emails:
         return await message.answer("⚠️ Пожалуйста, введите корректный email.")
     data = await state.get_data()
     appointment_id = data.get("appointment_id")
     try:
-        appointment = supabase.table("appointments").select("*").eq("id", appointment_id).execute().data[0]
-        dt_utc = datetime.datetime.fromisoformat(appointment["meeting_date_time"].replace("Z", "+00:00"))
+        appointment = await repository.get_appointment(appointment_id)
+        if not appointment:
+            await state.clear()
+            return await message.answer("❌ Встреча не найдена.", reply_markup=main_menu)
+        profile = await profiles.get_profile(message.from_user.id)
+        local_dt = profile.to_local(appointment["meeting_date_time"])
         title = appointment.get("title", "Встреча")
         description = f"Встреча по теме: {title}"
 
-        moscow_tz = pytz.timezone("Europe/Moscow")
-        moscow_dt = dt_utc.astimezone(moscow_tz)
-        start = moscow_dt.strftime("%Y%m%dT%H%M%S")
+        start = local_dt.strftime("%Y%m%dT%H%M%S")
+        end = (local_dt + profile.duration).strftime("%Y%m%dT%H%M%S")
 
         gcal_link = (
             "https://calendar.google.com/calendar/render?action=TEMPLATE"
             f"&text={urllib.parse.quote(title)}"
             f"&details={urllib.parse.quote(description)}"
-            f"&dates={start}/{start}"
-            f"&ctz=Europe/Moscow"
+            f"&dates={start}/{end}"
+            f"&ctz={urllib.parse.quote(profile.timezone)}"
         )
 
-        await send_email_invite_with_image(
-            to_email=email,
-            subject=f"Приглашение на встречу: {title}",
-            body_text=(
-                f"<p>📅 <b>Дата и время:</b> {moscow_dt.strftime('%Y-%m-%d %H:%M')}<br>"
+        # Письма отправляет задача outbox: при сбое SMTP она повторится позже
+        await outbox_worker.enqueue("send_invite", f"invite:{message.chat.id}:{message.message_id}", {
+            "chat_id": message.chat.id,
+            "emails": emails,
+            "subject": f"Приглашение на встречу: {title}",
+            "body_text": (
+                f"<p>📅 <b>Дата и время:</b> {local_dt.strftime(meetings.DATETIME_FORMAT)}<br>"
                 f"📝 <b>Тема:</b> {title}</p>"
                 f"<p>👉 <a href='{gcal_link}'>Добавить в Google Календарь</a></p>"
-            ),
-            image_path="invite_email.jpg"
+            )
+        })
+        text = (
+            "✅ Приглашение поставлено в очередь на отправку!" if len(emails) == 1
+            else f"✅ Приглашения для {len(emails)} участников поставлены в очередь на отправку!"
         )
-        await message.answer("✅ Приглашение отправлено по email!", reply_markup=main_menu)
+        if invalid:
+            text += "\n\n⚠️ Пропущены некорректные адреса: " + ", ".join(invalid)
+        await message.answer(text, reply_markup=main_menu)
         await state.clear()
     except Exception as e:
-        await message.answer(f"❌ Ошибка при отправке приглашения: {e}", reply_markup=main_menu)
+        logging.warning(f"⚠️ Не удалось поставить приглашение в очередь: {e}")
+        await message.answer("❌ Не удалось отправить приглашение, попробуйте ещё раз.", reply_markup=main_menu)
         await state.clear()
 
+async def perform_send_invite(payload: dict):
+    emails = payload["emails"]
+    # Письмо собирается один раз; при нескольких адресах они передаются
+    # только в конверте SMTP и не видны друг другу
+    invite = mailer.build_invite(
+        to_email=emails[0] if len(emails) == 1 else "undisclosed-recipients:;",
+        subject=payload["subject"],
+        body_text=payload["body_text"],
+        image_path="invite_email.jpg"
+    )
+    # Повторяет outbox, а не mailer; после каждой пачки итог записывается в задачу
+    # (адрес -> причина отказа, "" — доставлено), и повтор отправит только остальным
+    results = payload.setdefault("results", {})
+    pending = [email for email in emails if email not in results]
+    for i in range(0, len(pending), mailer.SMTP_MAX_RECIPIENTS):
+        batch = pending[i:i + mailer.SMTP_MAX_RECIPIENTS]
+        batch_refused = await email_sender.send(invite, batch, retries=0)
+        results.update({email: batch_refused.get(email, "") for email in batch})
+        await outbox.checkpoint(payload)
+    refused = {email: reason for email, reason in results.items() if reason}
+    # Об успешной отправке одного письма отдельно не сообщаем
+    if len(emails) == 1 and not refused:
+        return
+    lines = [
+        f"❌ {email}: {refused[email]}" if email in refused else f"✅ {email}"
+        for email in emails
+    ]
+    try:
+        await bot.send_message(payload["chat_id"], "📨 Результат отправки приглашений:\n\n" + "\n".join(lines))
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось сообщить о результате отправки приглашений: {e}")
+
+async def report_invite_failed(payload: dict, error: Exception):
+    results = payload.get("results", {})
+    failed = [email for email in payload["emails"] if results.get(email) != ""]
+    try:
+        await bot.send_message(payload["chat_id"], f"❌ Не удалось отправить приглашения: {', '.join(failed)}")
+    except Exception as e:
+        logging.warning(f"⚠️ Не удалось сообщить о неотправленных приглашениях: {e}")
+
+outbox_worker.register("send_invite", perform_send_invite, on_dead=report_invite_failed)
+
 # === Мои встречи ===
-@dp.message(F.text.lower() == "мои встречи")
-async def show_appointments(message: types.Message):
-    user_id = message.from_user.id
-    client_result = supabase.table("clients").select("id").eq("telegram_id", user_id).execute()
-    if not client_result.data:
-        return await message.answer("У вас нет встреч.", reply_markup=appointments_menu)
-    client_id = client_result.data[0]["id"]
-    appointments = supabase.table("appointments").select("*").eq("client_id", client_id).execute().data
+delete_past_button = [InlineKeyboardButton(text="🗑 Удалить прошедшие встречи", callback_data="delete_past")]
+
+def appointment_cursor(app: dict) -> str:
+    dt = meetings.parse_timestamp(app["meeting_date_time"])
+    return f"{int(dt.timestamp())}:{app['id']}"
+
+def parse_appointment_cursor(epoch: str, appointment_id: str) -> tuple:
+    dt = datetime.datetime.fromtimestamp(int(epoch), tz=datetime.timezone.utc)
+    return dt.isoformat(), int(appointment_id)
+
+async def render_appointments_page(user_id: int, cursor: tuple = None, direction: str = "gt"):
+    appointments, has_more = await repository.get_upcoming_appointments_page(user_id, cursor, direction)
     if not appointments:
-        return await message.answer("У вас нет встреч.", reply_markup=appointments_menu)
-    for app in appointments:
-        from_zone = pytz.utc
-        to_zone = pytz.timezone("Europe/Moscow")
-        raw_time = app["meeting_date_time"]
-        utc_dt = datetime.datetime.fromisoformat(raw_time.replace("Z", "+00:00"))
-        moscow_dt = utc_dt.astimezone(to_zone)
-        formatted_time = moscow_dt.strftime("%Y-%m-%d %H:%M")
-        text = (
-            f"📅 <b>{formatted_time}</b>\n"
-            f"📌 <b>Название:</b> {app.get('title', '—')}\n"
-            f"📞 <b>Телефон:</b> {app['phone_number']}"
+        return None, None
+    profile = await profiles.get_profile(user_id)
+    times = profile.format_many([app["meeting_date_time"] for app in appointments])
+    page_start = appointment_cursor(appointments[0])
+    lines = ["📅 <b>Ваши ближайшие встречи:</b>\n"]
+    buttons = []
+    for i, (app, formatted_time) in enumerate(zip(appointments, times), 1):
+        lines.append(
+            f"{i}) <b>{formatted_time}</b>\n"
+            f"📌 <b>Название:</b> {html.escape(app.get('title') or '—')}\n"
+            f"📞 <b>Телефон:</b> {html.escape(app['phone_number'] or '—')}\n"
         )
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="📨 Отправить приглашение", callback_data=f"invite:{app['id']}")],
-            [InlineKeyboardButton(text="❌ Удалить встречу", callback_data=f"delete_meeting:{app['id']}")]
+        buttons.append([
+            InlineKeyboardButton(text=f"📨 {i}", callback_data=f"invite:{app['id']}"),
+            InlineKeyboardButton(text=f"❌ {i}", callback_data=f"delete_meeting:{app['id']}:{page_start}")
         ])
-        await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
-    await message.answer("Выберите действие 👆", reply_markup=appointments_menu)
+    # При движении назад has_more означает наличие предыдущей страницы, вперёд — следующей
+    if direction == "lt":
+        has_prev = has_more
+    elif direction == "ge" and cursor:
+        # Перерисовка с первой строки страницы (после удаления): предыдущая
+        # страница есть, только если перед ней остались встречи
+        previous, _ = await repository.get_upcoming_appointments_page(user_id, cursor, "lt", limit=1)
+        has_prev = bool(previous)
+    else:
+        has_prev = cursor is not None
+    has_next = has_more if direction != "lt" else True
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"appointments:lt:{page_start}"))
+    if has_next:
+        navigation.append(InlineKeyboardButton(
+            text="▶️", callback_data=f"appointments:gt:{appointment_cursor(appointments[-1])}"
+        ))
+    if navigation:
+        buttons.append(navigation)
+    buttons.append(delete_past_button)
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@dp.message(F.text.lower() == "мои встречи")
+async def show_appointments(message: types.Message):
+    text, keyboard = await render_appointments_page(message.from_user.id)
+    if not text:
+        return await message.answer(
+            "У вас нет предстоящих встреч.",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[delete_past_button])
+        )
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@dp.callback_query(F.data.startswith("appointments:"))
+async def appointments_page_callback(callback: types.CallbackQuery):
+    _, direction, epoch, appointment_id = callback.data.split(":")
+    cursor = parse_appointment_cursor(epoch, appointment_id)
+    text, keyboard = await render_appointments_page(callback.from_user.id, cursor, direction)
+    if not text:
+        return await callback.answer("Больше встреч нет.")
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
 
 @dp.callback_query(F.data.startswith("delete_meeting:"))
 async def delete_meeting_callback(callback: types.CallbackQuery):
-    meeting_id = int(callback.data.split(":")[1])
+    parts = callback.data.split(":")
+    meeting_id = int(parts[1])
     user_message = ""
     try:
-        event_data = supabase.table("calendar_events").select("*").eq("appointment_id", meeting_id).execute().data
-        appointment_data = supabase.table("appointments").select("calendar_id").eq("id", meeting_id).execute().data
-        if event_data and appointment_data:
-            event_id = event_data[0]["event_id"]
-            calendar_id = appointment_data[0]["calendar_id"]
-            try:
-                calendar_service.events().delete(calendarId=calendar_id, eventId=event_id).execute()
-            except Exception as e:
-                logging.warning(f"⚠️ Событие не найдено в Google Calendar: {e}")
-                user_message += "⚠️ Событие уже было удалено из Google Календаря.\n"
-        # Удаляем из Supabase
-        supabase.table("calendar_events").delete().eq("appointment_id", meeting_id).execute()
-        supabase.table("appointments").delete().eq("id", meeting_id).execute()
+        appointment = await repository.get_appointment_with_event(meeting_id, callback.from_user.id)
+        if appointment:
+            # Удаление из Google и из Supabase (calendar_events — каскадом) идут параллельно
+            google_deletes = [
+                calendar_gateway.delete_event(appointment["calendar_id"], event["event_id"])
+                for event in appointment["calendar_events"]
+            ]
+            db_result, *google_results = await asyncio.gather(
+                repository.delete_appointments([meeting_id]), *google_deletes, return_exceptions=True
+            )
+            if isinstance(db_result, Exception):
+                raise db_result
+            search.invalidate(callback.from_user.id)
+            profile = await profiles.get_profile(callback.from_user.id)
+            slots.remove_busy(
+                appointment["calendar_id"], profile.to_local(appointment["meeting_date_time"]), profile.duration
+            )
+            for result in google_results:
+                if isinstance(result, Exception):
+                    logging.warning(f"⚠️ Событие не найдено в Google Calendar: {result}")
+                    user_message += "⚠️ Событие уже было удалено из Google Календаря.\n"
         user_message += "❌ Встреча удалена из базы данных."
-        await callback.message.edit_text(user_message)
-        await callback.answer("Удалено.")
+        if len(parts) < 4:
+            # Сообщение старого формата: одна встреча на сообщение
+            await callback.message.edit_text(user_message)
+            return await callback.answer("Удалено.")
+        # Перерисовываем текущую страницу списка с её первой встречи
+        cursor = parse_appointment_cursor(parts[2], parts[3])
+        text, keyboard = await render_appointments_page(callback.from_user.id, cursor, "ge")
+        if not text:
+            text, keyboard = await render_appointments_page(callback.from_user.id)
+        if text:
+            await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+        else:
+            await callback.message.edit_text("У вас нет встреч.")
+        await callback.answer(user_message, show_alert=True)
     except Exception as e:
         await callback.answer(f"Ошибка при удалении: {e}")
 
+@dp.callback_query(F.data == "delete_past")
+async def delete_past_confirm(callback: types.CallbackQuery):
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Да, удалить", callback_data="delete_past:confirm"),
+        InlineKeyboardButton(text="Отмена", callback_data="delete_past:cancel")
+    ]])
+    await callback.message.answer("Удалить все прошедшие встречи? Это действие нельзя отменить.", reply_markup=keyboard)
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("delete_past:"))
+async def delete_past_callback(callback: types.CallbackQuery):
+    if callback.data == "delete_past:cancel":
+        await callback.message.edit_text("Удаление отменено.")
+        return await callback.answer()
+    await callback.answer()
+    await callback.message.edit_text("⏳ Удаляем прошедшие встречи...")
+    deleted, google_failed, after_id = 0, 0, 0
+    try:
+        while True:
+            # Пачками по 500: одно удаление в базе на пачку, события Google
+            # одновременно уходят в gateway и объединяются в batch-запросы
+            appointments = await repository.get_past_appointments(callback.from_user.id, after_id)
+            if not appointments:
+                break
+            after_id = appointments[-1]["id"]
+            google_deletes = [
+                calendar_gateway.delete_event(app["calendar_id"], event["event_id"])
+                for app in appointments for event in app["calendar_events"]
+            ]
+            db_result, *google_results = await asyncio.gather(
+                repository.delete_appointments([app["id"] for app in appointments]),
+                *google_deletes, return_exceptions=True
+            )
+            if isinstance(db_result, Exception):
+                raise db_result
+            deleted += len(appointments)
+            search.invalidate(callback.from_user.id)
+            google_failed += sum(isinstance(result, Exception) for result in google_results)
+    except Exception as e:
+        return await callback.message.edit_text(f"❌ Ошибка при удалении (удалено {deleted}): {e}")
+    if not deleted:
+        return await callback.message.edit_text("Прошедших встреч нет.")
+    text = f"❌ Удалено прошедших встреч: {deleted}."
+    if google_failed:
+        text += f"\n⚠️ {google_failed} событий уже не было в Google Календаре."
+    await callback.message.edit_text(text)
+
+# === Поиск встреч ===
+SEARCH_HELP = (
+    "🔎 *Поиск встреч*\n\n"
+    "Напишите после /search слова из названия или имени клиента и, если нужно, фильтры:\n"
+    "• `имя:Иванов`, `название:звонок`, `тел:9161234567`\n"
+    "• `календарь:Работа`\n"
+    "• `с:01.06.2025`, `по:30.06.2025`\n"
+    "• `сегодня`, `завтра`, `неделя`, `след.неделя`, `месяц`, `всё`\n\n"
+    "Значение с пробелами берите в кавычки: `имя:\"Иван Петров\"`.\n"
+    "Без периода ищутся встречи начиная с сегодняшнего дня.\n\n"
+    "Пример: `/search звонок Иванов след.неделя`"
+)
+
+async def render_search_page(user_id: int, token: str, page: int):
+    result = await search.get_page(user_id, token, page)
+    if result is None:
+        return None, None
+    query_text, appointments, has_more = result
+    if not appointments:
+        return f"🔎 По запросу «{html.escape(query_text)}» ничего не найдено.", None
+    profile = await profiles.get_profile(user_id)
+    times = profile.format_many([app["meeting_date_time"] for app in appointments])
+    first = page * repository.APPOINTMENTS_PAGE_SIZE
+    lines = [f"🔎 <b>Найдено по запросу «{html.escape(query_text)}»:</b>\n"]
+    for i, (app, formatted_time) in enumerate(zip(appointments, times), first + 1):
+        lines.append(
+            f"{i}) <b>{formatted_time}</b>\n"
+            f"📌 <b>Название:</b> {html.escape(app.get('title') or '—')}\n"
+            f"👤 <b>Клиент:</b> {html.escape(app.get('client_name') or '—')}\n"
+            f"📞 <b>Телефон:</b> {html.escape(app.get('phone_number') or '—')}\n"
+        )
+    invites = [
+        InlineKeyboardButton(text=f"📨 {i}", callback_data=f"invite:{app['id']}")
+        for i, app in enumerate(appointments, first + 1)
+    ]
+    buttons = [invites[i:i + 5] for i in range(0, len(invites), 5)]
+    navigation = []
+    if page > 0:
+        navigation.append(InlineKeyboardButton(text="◀️", callback_data=f"search:{token}:{page - 1}"))
+    if has_more:
+        navigation.append(InlineKeyboardButton(text="▶️", callback_data=f"search:{token}:{page + 1}"))
+    if navigation:
+        buttons.append(navigation)
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=buttons)
+
+@dp.message(Command("search"))
+async def search_start(message: types.Message, command: CommandObject):
+    if not command.args:
+        return await message.answer(SEARCH_HELP, parse_mode="Markdown")
+    user_id = message.from_user.id
+    profile = await profiles.get_profile(user_id)
+    calendars = await repository.get_calendars(user_id)
+    try:
+        filters = search.parse_query(command.args, profile, calendars)
+    except ValueError as e:
+        return await message.answer(f"⚠️ {e}\n\nПодсказка по запросам: /search")
+    try:
+        token = await search.create(user_id, command.args, filters)
+        text, keyboard = await render_search_page(user_id, token, 0)
+    except Exception as e:
+        return await message.answer(f"❌ Ошибка при поиске: {e}")
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboard)
+
+@dp.callback_query(F.data.startswith("search:"))
+async def search_page_callback(callback: types.CallbackQuery):
+    _, token, page = callback.data.split(":")
+    text, keyboard = await render_search_page(callback.from_user.id, token, int(page))
+    if not text:
+        return await callback.answer("Результаты поиска устарели, повторите /search.", show_alert=True)
+    await callback.message.edit_text(text, parse_mode="HTML", reply_markup=keyboard)
+    await callback.answer()
+
 # === Информация о боте ===
 @dp.message(F.text.lower() == "информация о боте")
 async def bot_info(message: types.Message):
@@ -450,8 +752,11 @@ async def bot_info(message: types.Message):
         "📌 *Как это работает?*\n"
         "1. Сначала добавьте свой Google Calendar через раздел *Мои календари*.\n"
         "2. Затем используйте кнопку *Добавить встречу*, чтобы запланировать событие.\n"
-        "3. Просматривайте и удаляйте встречи через *Мои встречи*.\n"
-        "4. При необходимости отправьте приглашение участникам по email.\n\n"
+        "3. Просматривайте и удаляйте встречи через *Мои встречи*, ищите нужные — командой /search.\n"
+        "4. При необходимости отправьте приглашение участникам по email.\n"
+        "5. Много встреч сразу можно загрузить из файла .csv или .ics командой /import,\n"
+        "а выгрузить все свои встречи — командой /export.\n"
+        "6. Часовой пояс, длительность встреч и утренний дайджест настраиваются командой /settings.\n\n"
         "🔹 В любой момент вы можете отменить действие, нажав *Главное меню / Отмена*.\n\n"
         "Приятного использования!",
         parse_mode="Markdown",
@@ -509,11 +814,7 @@ async def receive_calendar_url(message: types.Message, state: FSMContext):
     calendar_id = match.group(1) if match else raw_input
     calendar_id = calendar_id.replace('%2540', '@').replace('%40', '@')
     try:
-        exists = supabase.table("settings").select("*").match({
-            "telegram_id": user_id,
-            "calendar_id": calendar_id
-        }).execute().data
-        if exists:
+        if await repository.calendar_exists(user_id, calendar_id):
             await state.clear()
             return await message.answer("⚠️ Этот календарь уже добавлен.", reply_markup=main_menu)
         await state.update_data(calendar_id=calendar_id)
@@ -530,54 +831,269 @@ async def receive_calendar_name(message: types.Message, state: FSMContext):
     calendar_id = data.get("calendar_id")
     calendar_name = message.text.strip()
     try:
-        supabase.table("settings").insert({
-            "telegram_id": user_id,
-            "calendar_id": calendar_id,
-            "calendar_name": calendar_name
-        }).execute()
+        await repository.add_calendar(user_id, calendar_id, calendar_name)
         await message.answer(f"✅ Календарь *{calendar_name}* добавлен!", parse_mode="Markdown", reply_markup=main_menu)
     except Exception as e:
         await message.answer(f"❌ Ошибка: {e}", reply_markup=main_menu)
     await state.clear()
 
-async def send_email_invite_with_image(to_email: str, subject: str, body_text: str, image_path: str):
-    smtp_email = os.getenv("SMTP_EMAIL")
-    smtp_password = os.getenv("SMTP_PASSWORD")
-    # Основной контейнер письма
-    msg = MIMEMultipart("related")
-    msg["From"] = smtp_email
-    msg["To"] = to_email
-    msg["Subject"] = subject
-    # HTML-версия письма
-    formatted_body = body_text.replace('\n', '<br>')
-    html = f"""<html><body><p>{formatted_body}</p><img src="cid:image1" width="400"/></body></html>"""
-    # Добавляем HTML как альтернативную часть
-    alternative = MIMEMultipart("alternative")
-    alternative.attach(MIMEText(html, "html"))
-    msg.attach(alternative)
-    # Встраиваем изображение
-    with open(image_path, "rb") as f:
-        img = MIMEImage(f.read())
-        img.add_header("Content-ID", "<image1>")
-        img.add_header("Content-Disposition", "inline", filename="invite.jpg")
-        msg.attach(img)
-    # Отправка
-    context = ssl.create_default_context(cafile=certifi.where())
-    await aiosmtplib.send(
-        msg,
-        hostname="smtp.gmail.com",
-        port=587,
-        start_tls=True,
-        username=smtp_email,
-        password=smtp_password,
-        tls_context=context
+# === Импорт встреч ===
+@dp.message(Command("import"))
+async def import_start(message: types.Message, state: FSMContext):
+    calendars = await repository.get_calendars(message.from_user.id)
+    if not calendars:
+        return await message.answer("Сначала добавьте хотя бы один календарь.", reply_markup=main_menu)
+    buttons = [[KeyboardButton(text=c["calendar_name"])] for c in calendars]
+    await state.set_state(ImportMeetings.calendar_choice)
+    await message.answer(
+        "Выберите календарь, в который импортировать встречи:",
+        reply_markup=ReplyKeyboardMarkup(keyboard=buttons + [[KeyboardButton(text="Главное меню / Отмена")]], resize_keyboard=True)
+    )
+
+@dp.message(ImportMeetings.calendar_choice)
+async def import_select_calendar(message: types.Message, state: FSMContext):
+    c = await find_calendar_by_name(message.from_user.id, message.text or "")
+    if not c:
+        return await message.answer("Пожалуйста, выберите календарь из списка кнопок.")
+    await state.update_data(calendar_id=c["calendar_id"])
+    await state.set_state(ImportMeetings.waiting_for_file)
+    await message.answer(
+        "Пришлите файл *.csv* или *.ics*.\n\n"
+        "CSV: первая строка — заголовки `title,name,datetime,phone,comment`, "
+        "дата в формате `YYYY-MM-DD HH:MM`, телефон в формате `+7XXXXXXXXXX`.\n"
+        "ICS: название и время берутся из события, клиент и телефон — из описания "
+        "(`Клиент: ...`, `Телефон: ...`).",
+        parse_mode="Markdown",
+        reply_markup=cancel_menu
+    )
+
+@dp.message(ImportMeetings.waiting_for_file, F.document)
+async def import_receive_file(message: types.Message, state: FSMContext):
+    file_name = (message.document.file_name or "").lower()
+    kind = "csv" if file_name.endswith(".csv") else "ics" if file_name.endswith(".ics") else None
+    if not kind:
+        return await message.answer("⚠️ Поддерживаются только файлы .csv и .ics.")
+    data = await state.get_data()
+    await state.clear()
+    progress = await message.answer("⏳ Импорт: файл загружается...", reply_markup=main_menu)
+    last_edit = 0.0
+
+    async def on_progress(stats: importer.ImportStats):
+        nonlocal last_edit
+        # Не чаще раза в пару секунд, чтобы не упереться в лимиты Telegram
+        loop_time = asyncio.get_running_loop().time()
+        if loop_time - last_edit < 2:
+            return
+        last_edit = loop_time
+        await progress.edit_text(f"⏳ Импорт: обработано строк — {stats.processed}, добавлено встреч — {stats.imported}")
+
+    def on_imported(appointments: list):
+        search.invalidate(message.from_user.id)
+        # Импорт часто содержит историю — напоминания нужны только о будущих встречах
+        now = datetime.datetime.now(datetime.timezone.utc)
+        for appointment in appointments:
+            if meetings.parse_timestamp(appointment["meeting_date_time"]) > now:
+                reminder_scheduler.schedule(appointment, message.from_user.id)
+
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, f"import.{kind}")
+            await bot.download(message.document, destination=path)
+            stats = await importer.import_file(
+                path, kind, message.from_user.id, data["calendar_id"], on_progress, on_imported
+            )
+    except Exception as e:
+        return await progress.edit_text(f"❌ Ошибка при импорте: {e}")
+    text = (
+        f"✅ Импорт завершён.\n\n"
+        f"Добавлено встреч: {stats.imported}\n"
+        f"Пропущено строк с ошибками: {stats.invalid}\n"
+        f"Не удалось создать в Google Календаре: {stats.failed}"
+    )
+    if stats.errors:
+        text += "\n\n" + "\n".join(stats.errors)
+    await progress.edit_text(text)
+
+@dp.message(ImportMeetings.waiting_for_file)
+async def import_expect_file(message: types.Message):
+    await message.answer("Пришлите файл .csv или .ics или нажмите «Главное меню / Отмена».")
+
+# === Экспорт встреч ===
+@dp.message(Command("export"))
+async def export_start(message: types.Message):
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="CSV", callback_data="export:csv"),
+        InlineKeyboardButton(text="iCalendar (.ics)", callback_data="export:ics")
+    ]])
+    await message.answer("В каком формате выгрузить встречи?", reply_markup=keyboard)
+
+@dp.callback_query(F.data.in_({"export:csv", "export:ics"}))
+async def export_callback(callback: types.CallbackQuery):
+    kind = callback.data.split(":")[1]
+    await callback.answer()
+    await callback.message.edit_text("⏳ Готовим выгрузку...")
+    files = 0
+    try:
+        # Файлы уходят по мере готовности, большая история делится на несколько документов
+        async for file_name, data in exporter.export_files(callback.from_user.id, kind):
+            await bot.send_document(callback.message.chat.id, BufferedInputFile(data, filename=file_name))
+            files += 1
+    except Exception as e:
+        return await callback.message.edit_text(f"❌ Ошибка при выгрузке: {e}")
+    if not files:
+        return await callback.message.edit_text("У вас нет встреч для выгрузки.")
+    await callback.message.edit_text(f"✅ Выгрузка готова, файлов: {files}.")
+
+# === Настройки профиля ===
+TIMEZONE_CHOICES = [
+    "Europe/Kaliningrad", "Europe/Moscow", "Europe/Samara", "Asia/Yekaterinburg",
+    "Asia/Omsk", "Asia/Novosibirsk", "Asia/Krasnoyarsk", "Asia/Irkutsk",
+    "Asia/Yakutsk", "Asia/Vladivostok", "Asia/Magadan", "Asia/Kamchatka"
+]
+DURATION_CHOICES = ["30", "45", "60", "90", "120"]
+
+def render_settings(profile: profiles.Profile) -> tuple:
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🕒 Изменить часовой пояс", callback_data="profile:timezone")],
+        [InlineKeyboardButton(text="⏱ Изменить длительность встречи", callback_data="profile:duration")],
+        [InlineKeyboardButton(
+            text="🔕 Отключить утренний дайджест" if profile.digest_enabled else "🔔 Включить утренний дайджест",
+            callback_data="profile:digest"
+        )]
+    ])
+    text = (
+        f"⚙️ *Настройки*\n\n"
+        f"🕒 Часовой пояс: `{profile.timezone}`\n"
+        f"⏱ Длительность встречи: {profile.duration_minutes} мин.\n"
+        f"☀️ Утренний дайджест: {'включён' if profile.digest_enabled else 'выключен'}"
+    )
+    if profile.digest_enabled:
+        text += f"\n\nСписок встреч на день приходит в {digest.DIGEST_HOUR}:00 по вашему времени, если встречи есть."
+    return text, keyboard
+
+@dp.message(Command("settings"))
+async def show_settings(message: types.Message):
+    profile = await profiles.get_profile(message.from_user.id)
+    text, keyboard = render_settings(profile)
+    await message.answer(text, parse_mode="Markdown", reply_markup=keyboard)
+
+@dp.callback_query(F.data == "profile:digest")
+async def toggle_digest(callback: types.CallbackQuery):
+    profile = await profiles.get_profile(callback.from_user.id)
+    try:
+        profile = await profiles.update_profile(callback.from_user.id, digest_enabled=not profile.digest_enabled)
+    except Exception as e:
+        return await callback.answer(f"❌ Не удалось сохранить настройки: {e}", show_alert=True)
+    text, keyboard = render_settings(profile)
+    await callback.message.edit_text(text, parse_mode="Markdown", reply_markup=keyboard)
+    await callback.answer("Дайджест включён." if profile.digest_enabled else "Дайджест выключен.")
+
+@dp.callback_query(F.data == "profile:timezone")
+async def edit_timezone_start(callback: types.CallbackQuery, state: FSMContext):
+    buttons = [[KeyboardButton(text=name) for name in TIMEZONE_CHOICES[i:i + 2]] for i in range(0, len(TIMEZONE_CHOICES), 2)]
+    await state.set_state(EditProfile.timezone)
+    await callback.message.answer(
+        "Выберите часовой пояс или введите его название, например Asia/Almaty:",
+        reply_markup=ReplyKeyboardMarkup(keyboard=buttons + [[KeyboardButton(text="Главное меню / Отмена")]], resize_keyboard=True)
+    )
+    await callback.answer()
+
+@dp.message(EditProfile.timezone)
+async def edit_timezone(message: types.Message, state: FSMContext):
+    name = (message.text or "").strip()
+    if not profiles.is_valid_timezone(name):
+        return await message.answer("⚠️ Неизвестный часовой пояс. Пример: Europe/Moscow")
+    try:
+        await profiles.update_profile(message.from_user.id, timezone=name)
+    except Exception as e:
+        await state.clear()
+        return await message.answer(f"❌ Не удалось сохранить настройки: {e}", reply_markup=main_menu)
+    await state.clear()
+    await message.answer(f"✅ Часовой пояс изменён на {name}.", reply_markup=main_menu)
+
+@dp.callback_query(F.data == "profile:duration")
+async def edit_duration_start(callback: types.CallbackQuery, state: FSMContext):
+    await state.set_state(EditProfile.duration)
+    await callback.message.answer(
+        "Выберите длительность новых встреч в минутах или введите своё значение (от 5 до 480):",
+        reply_markup=ReplyKeyboardMarkup(keyboard=[
+            [KeyboardButton(text=value) for value in DURATION_CHOICES],
+            [KeyboardButton(text="Главное меню / Отмена")]
+        ], resize_keyboard=True)
     )
+    await callback.answer()
+
+@dp.message(EditProfile.duration)
+async def edit_duration(message: types.Message, state: FSMContext):
+    text = (message.text or "").strip()
+    if not text.isdigit() or not 5 <= int(text) <= 480:
+        return await message.answer("⚠️ Введите число минут от 5 до 480.")
+    try:
+        await profiles.update_profile(message.from_user.id, meeting_duration_minutes=int(text))
+    except Exception as e:
+        await state.clear()
+        return await message.answer(f"❌ Не удалось сохранить настройки: {e}", reply_markup=main_menu)
+    await state.clear()
+    await message.answer(f"✅ Новые встречи будут длиться {text} мин.", reply_markup=main_menu)
 
 # === Запуск бота ===
+async def warm_up():
+    # Тяжёлые клиенты создаются в фоне, пока бот уже принимает апдейты
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        repository.warm_up(), calendar_gateway.warm_up(), mailer.warm_up(), return_exceptions=True
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            logging.warning(f"⚠️ Не удалось заранее подготовить клиент: {result}")
+    logging.info(f"Клиенты Supabase, Google и SMTP готовы за {time.perf_counter() - started:.2f} с")
+
+@dp.startup()
+async def on_startup(primary: bool = True):
+    cold_start = time.perf_counter() - STARTED_AT
+    metrics.set_gauge("bot_cold_start_seconds", cold_start)
+    if cold_start > COLD_START_BUDGET:
+        logging.warning(f"⚠️ Холодный старт {cold_start:.2f} с — больше бюджета {COLD_START_BUDGET:.0f} с")
+    else:
+        logging.info(f"Холодный старт: {cold_start:.2f} с")
+    background_tasks.add(asyncio.create_task(warm_up()))
+    background_tasks.add(asyncio.create_task(storage.run_sweeper(dp.storage)))
+    # Задачи outbox выполняют все процессы: аренда в базе не даёт взять одну задачу дважды
+    background_tasks.add(asyncio.create_task(outbox_worker.run()))
+    # Напоминания тоже планирует каждый процесс: встречу, созданную или
+    # импортированную в нём, в уже загруженном окне знает только он.
+    # claim_reminder не даёт отправить одно напоминание дважды
+    background_tasks.add(asyncio.create_task(reminder_scheduler.run()))
+    # В webhook-режиме с несколькими процессами синхронизацию с Google и
+    # дайджест выполняет только основной
+    if primary:
+        if calendar_sync.SYNC_INTERVAL > 0:
+            background_tasks.add(asyncio.create_task(calendar_synchronizer.run()))
+        if digest.DIGEST_INTERVAL > 0:
+            background_tasks.add(asyncio.create_task(digest_sender.run()))
+    email_sender.start()
+    metrics.start_background(background_tasks)
+    if metrics.METRICS_PORT and primary:
+        background_runners.append(await metrics.start_server())
+
+@dp.shutdown()
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await email_sender.stop()
+    for runner in background_runners:
+        await runner.cleanup()
+    background_runners.clear()
+
 async def main():
     logging.basicConfig(level=logging.INFO)
-    await bot.delete_webhook(drop_pending_updates=True)
+    # Накопившиеся за время перезапуска апдейты не выбрасываем
+    await bot.delete_webhook(drop_pending_updates=False)
     await dp.start_polling(bot)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    if BOT_MODE == "webhook":
+        webhook.run(dp, bot)
+    else:
+        asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,193 @@
+import asyncio
+import functools
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+
+# === Асинхронный шлюз к Google Calendar ===
+# Клиент googleapiclient (httplib2) не потокобезопасен, поэтому у каждого
+# потока пула свой экземпляр сервиса. Вставки и удаления, пришедшие в течение
+# короткого окна, объединяются в один batch-запрос Google.
+# googleapiclient и ключ сервисного аккаунта загружаются при первом обращении
+# (или в warm_up после запуска бота), сервис собирается из discovery-документа,
+# который поставляется вместе с библиотекой, без запроса в сеть.
+
+CALENDAR_POOL_SIZE = int(os.getenv("CALENDAR_POOL_SIZE", "4"))
+CALENDAR_TIMEOUT = float(os.getenv("CALENDAR_TIMEOUT", "30"))
+BATCH_WINDOW = float(os.getenv("CALENDAR_BATCH_WINDOW", "0.05"))
+BATCH_MAX = 50  # Google рекомендует не больше 50 запросов в одном batch
+
+SCOPES = ["https://www.googleapis.com/auth/calendar"]
+# 403 означает и нехватку прав, и превышение лимита запросов (rateLimitExceeded,
+# userRateLimitExceeded); повторять бессмысленно только первое
+PERMISSION_REASONS = {"forbidden", "requiredAccessLevel", "forbiddenForNonOrganizer", "insufficientPermissions"}
+
+_executor = ThreadPoolExecutor(max_workers=CALENDAR_POOL_SIZE, thread_name_prefix="calendar")
+_local = threading.local()
+_service_account_file = None
+_credentials = None
+_credentials_lock = threading.Lock()
+
+_pending = []
+_flush_handle = None
+_tasks = set()
+
+
+class CalendarError(Exception):
+    # Ответ Google API с HTTP-статусом ошибки; вызывающему коду не нужен googleapiclient
+    def __init__(self, status: int, message: str, reason: str = None):
+        super().__init__(message)
+        self.status = status
+        self.reason = reason  # errors[].reason из ответа Google, например rateLimitExceeded
+
+    @property
+    def permission_denied(self) -> bool:
+        return self.status == 403 and (self.reason in PERMISSION_REASONS or "writer access" in str(self))
+
+
+def _wrap_error(error: Exception) -> Exception:
+    resp = getattr(error, "resp", None)  # googleapiclient.errors.HttpError
+    if resp is not None and getattr(resp, "status", None):
+        details = getattr(error, "error_details", None)
+        reason = details[0].get("reason") if isinstance(details, list) and details and isinstance(details[0], dict) else None
+        return CalendarError(int(resp.status), str(error), reason)
+    return error
+
+
+def setup(service_account_file: str):
+    global _service_account_file
+    _service_account_file = service_account_file
+
+
+def credentials():
+    global _credentials
+    if _credentials is None:
+        with _credentials_lock:
+            if _credentials is None:
+                from google.oauth2.service_account import Credentials
+                _credentials = Credentials.from_service_account_file(_service_account_file, scopes=SCOPES)
+    return _credentials
+
+
+def service_account_email() -> str:
+    return credentials().service_account_email
+
+
+@functools.lru_cache(maxsize=None)
+def _discovery_document() -> str:
+    from googleapiclient.discovery_cache import get_static_doc
+    return get_static_doc("calendar", "v3")
+
+
+def _service():
+    service = getattr(_local, "service", None)
+    if service is None:
+        from googleapiclient.discovery import build_from_document
+        service = build_from_document(_discovery_document(), credentials=credentials())
+        _local.service = service
+    return service
+
+
+async def warm_up():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _service)
+
+
+async def call(fn):
+    # Произвольный вызов API (list, watch, freebusy...) с сервисом текущего потока пула
+    loop = asyncio.get_running_loop()
+    async with metrics.track("google"):
+        try:
+            return await asyncio.wait_for(
+                loop.run_in_executor(_executor, lambda: fn(_service())), CALENDAR_TIMEOUT
+            )
+        except Exception as e:
+            error = _wrap_error(e)
+            if error is e:
+                raise
+            raise error from e
+
+
+def event_id_for(key: str) -> str:
+    # Детерминированный id события: повторная вставка с тем же ключом вернёт 409,
+    # а не создаст дубль. Google допускает base32hex (0-9, a-v), hex — его подмножество
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+async def insert_event(calendar_id: str, body: dict) -> dict:
+    return await _submit("insert", calendarId=calendar_id, body=body)
+
+
+async def get_event(calendar_id: str, event_id: str) -> dict:
+    return await _submit("get", calendarId=calendar_id, eventId=event_id)
+
+
+async def delete_event(calendar_id: str, event_id: str):
+    await _submit("delete", calendarId=calendar_id, eventId=event_id)
+
+
+async def _submit(method: str, **kwargs):
+    global _flush_handle
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    _pending.append((method, kwargs, future))
+    if len(_pending) >= BATCH_MAX:
+        _flush()
+    elif _flush_handle is None:
+        _flush_handle = loop.call_later(BATCH_WINDOW, _flush)
+    async with metrics.track("google"):
+        return await asyncio.wait_for(future, CALENDAR_TIMEOUT)
+
+
+def _flush():
+    global _flush_handle
+    if _flush_handle is not None:
+        _flush_handle.cancel()
+        _flush_handle = None
+    if not _pending:
+        return
+    batch = _pending[:]
+    _pending.clear()
+    task = asyncio.ensure_future(_dispatch(batch))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+async def _dispatch(batch: list):
+    loop = asyncio.get_running_loop()
+    try:
+        results = await loop.run_in_executor(_executor, _execute_batch, batch)
+    except Exception as e:
+        results = [(None, e)] * len(batch)
+    for (_, _, future), (response, error) in zip(batch, results):
+        if future.done():
+            continue
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(response)
+
+
+def _execute_batch(batch: list) -> list:
+    service = _service()
+    events = service.events()
+    if len(batch) == 1:
+        method, kwargs, _ = batch[0]
+        try:
+            return [(getattr(events, method)(**kwargs).execute(), None)]
+        except Exception as e:
+            return [(None, _wrap_error(e))]
+
+    results = [(None, None)] * len(batch)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, _wrap_error(exception) if exception else None)
+
+    http_batch = service.new_batch_http_request(callback=callback)
+    for i, (method, kwargs, _) in enumerate(batch):
+        http_batch.add(getattr(events, method)(**kwargs), request_id=str(i))
+    http_batch.execute()
+    return results
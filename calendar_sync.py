@@ -0,0 +1,191 @@
+import asyncio
+import datetime
+import logging
+import os
+import uuid
+
+from aiohttp import web
+
+import calendar_gateway
+import meetings
+import repository
+
+# === Синхронизация изменений из Google Calendar ===
+# Для каждого календаря из settings хранится syncToken (таблица calendar_sync),
+# и events().list возвращает только изменения с прошлого раза. Изменения
+# применяются лишь к встречам, созданным ботом (связь через calendar_events).
+# Push-уведомления (events().watch) необязательны: они только ускоряют
+# синхронизацию конкретного календаря, периодический проход остаётся.
+
+SYNC_INTERVAL = float(os.getenv("CALENDAR_SYNC_INTERVAL", "300"))  # 0 — синхронизация выключена
+SYNC_CONCURRENCY = int(os.getenv("CALENDAR_SYNC_CONCURRENCY", "4"))
+PUSH_URL = os.getenv("CALENDAR_PUSH_URL")  # публичный https-адрес для events().watch
+PUSH_HOST = os.getenv("CALENDAR_PUSH_HOST", "0.0.0.0")
+PUSH_PORT = int(os.getenv("CALENDAR_PUSH_PORT", "8081"))
+PUSH_TOKEN = os.getenv("CALENDAR_PUSH_TOKEN")
+CHANNEL_RENEW_BEFORE = datetime.timedelta(hours=1)
+
+
+def _list_changes(service, calendar_id: str, sync_token: str = None) -> tuple:
+    # Выполняется в потоке пула calendar_gateway
+    changes = []
+    page_token = None
+    while True:
+        params = {"calendarId": calendar_id, "pageToken": page_token, "maxResults": 250}
+        if sync_token:
+            params["syncToken"] = sync_token
+            params["showDeleted"] = True
+        else:
+            # Первичная синхронизация: нужен только токен, прошлое не интересно
+            params["timeMin"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        response = service.events().list(**params).execute()
+        changes.extend(response.get("items", []))
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return changes, response.get("nextSyncToken")
+
+
+class CalendarSync:
+    def __init__(self, on_moved=None):
+        # on_moved(appointment, telegram_id) вызывается, когда встречу перенесли в Google
+        self.on_moved = on_moved
+        self._requested = asyncio.Queue()
+        self._semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+        self._runner = None
+
+    def request(self, calendar_id: str):
+        self._requested.put_nowait(calendar_id)
+
+    async def sync_calendar(self, calendar_id: str) -> int:
+        async with self._semaphore:
+            state = await repository.get_sync_state(calendar_id)
+            sync_token = state["sync_token"] if state else None
+            try:
+                changes, next_token = await calendar_gateway.call(
+                    lambda service: _list_changes(service, calendar_id, sync_token)
+                )
+            except calendar_gateway.CalendarError as e:
+                if e.status != 410:
+                    raise
+                # Токен устарел: получаем новый. Изменения за пропущенный период
+                # берём из полного списка будущих событий
+                logging.info(f"Календарь {calendar_id}: syncToken устарел, пересинхронизация")
+                changes, next_token = await calendar_gateway.call(
+                    lambda service: _list_changes(service, calendar_id)
+                )
+                sync_token = "expired"
+            applied = await self.apply_changes(changes) if sync_token else 0
+            await repository.save_sync_state(calendar_id, {"sync_token": next_token})
+            return applied
+
+    async def apply_changes(self, changes: list) -> int:
+        if not changes:
+            return 0
+        appointments = {}
+        event_ids = [event["id"] for event in changes]
+        for i in range(0, len(event_ids), 200):
+            appointments.update(await repository.get_appointments_by_event_ids(event_ids[i:i + 200]))
+        deleted = []
+        updates = []
+        for event in changes:
+            appointment = appointments.get(event["id"])
+            if not appointment:
+                continue
+            if event.get("status") == "cancelled":
+                deleted.append(appointment["id"])
+                continue
+            fields = {}
+            start = event.get("start", {}).get("dateTime")
+            if start and meetings.parse_timestamp(start) != meetings.parse_timestamp(appointment["meeting_date_time"]):
+                fields["meeting_date_time"] = meetings.parse_timestamp(start).isoformat()
+            if event.get("summary") and event["summary"] != appointment.get("title"):
+                fields["title"] = event["summary"]
+            if fields:
+                updates.append((appointment, fields))
+        if deleted:
+            await repository.delete_appointments(deleted)
+        await asyncio.gather(*(
+            repository.update_appointment(appointment["id"], fields) for appointment, fields in updates
+        ))
+        for appointment, fields in updates:
+            if "meeting_date_time" in fields and self.on_moved and appointment.get("clients"):
+                self.on_moved({**appointment, **fields}, appointment["clients"]["telegram_id"])
+        if deleted or updates:
+            logging.info(f"Синхронизация Google: удалено {len(deleted)}, обновлено {len(updates)} встреч")
+        return len(deleted) + len(updates)
+
+    async def _sync_safely(self, calendar_id: str):
+        try:
+            await self.sync_calendar(calendar_id)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось синхронизировать календарь {calendar_id}: {e}")
+
+    async def _periodic(self):
+        while True:
+            try:
+                calendar_ids = await repository.list_synced_calendar_ids()
+                await asyncio.gather(*(self._sync_safely(calendar_id) for calendar_id in calendar_ids))
+                if PUSH_URL:
+                    await asyncio.gather(*(self._ensure_channel(calendar_id) for calendar_id in calendar_ids))
+            except Exception as e:
+                logging.warning(f"⚠️ Ошибка периодической синхронизации: {e}")
+            await asyncio.sleep(SYNC_INTERVAL)
+
+    async def _on_request(self):
+        while True:
+            calendar_id = await self._requested.get()
+            # Несколько уведомлений подряд по одному календарю — одна синхронизация
+            pending = {calendar_id}
+            while not self._requested.empty():
+                pending.add(self._requested.get_nowait())
+            await asyncio.gather(*(self._sync_safely(c) for c in pending))
+
+    async def _ensure_channel(self, calendar_id: str):
+        state = await repository.get_sync_state(calendar_id) or {}
+        expiration = state.get("channel_expiration")
+        now = datetime.datetime.now(datetime.timezone.utc)
+        if expiration and meetings.parse_timestamp(expiration) - now > CHANNEL_RENEW_BEFORE:
+            return
+        channel_id = str(uuid.uuid4())
+        body = {"id": channel_id, "type": "web_hook", "address": PUSH_URL}
+        if PUSH_TOKEN:
+            body["token"] = PUSH_TOKEN
+        try:
+            channel = await calendar_gateway.call(
+                lambda service: service.events().watch(calendarId=calendar_id, body=body).execute()
+            )
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось подписаться на изменения календаря {calendar_id}: {e}")
+            return
+        expires_at = datetime.datetime.fromtimestamp(int(channel["expiration"]) / 1000, tz=datetime.timezone.utc)
+        await repository.save_sync_state(calendar_id, {
+            "channel_id": channel_id,
+            "resource_id": channel["resourceId"],
+            "channel_expiration": expires_at.isoformat()
+        })
+
+    async def handle_notification(self, request: web.Request) -> web.Response:
+        if PUSH_TOKEN and request.headers.get("X-Goog-Channel-Token") != PUSH_TOKEN:
+            return web.Response(status=401)
+        # "sync" — служебное уведомление о создании канала
+        if request.headers.get("X-Goog-Resource-State") != "sync":
+            state = await repository.get_sync_state_by_channel(request.headers.get("X-Goog-Channel-ID", ""))
+            if state:
+                self.request(state["calendar_id"])
+        return web.Response()
+
+    async def run(self):
+        tasks = [asyncio.create_task(self._periodic()), asyncio.create_task(self._on_request())]
+        if PUSH_URL:
+            app = web.Application()
+            app.router.add_post("/calendar/notifications", self.handle_notification)
+            self._runner = web.AppRunner(app)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, PUSH_HOST, PUSH_PORT).start()
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            if self._runner:
+                await self._runner.cleanup()
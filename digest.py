@@ -0,0 +1,159 @@
+import asyncio
+import datetime
+import html
+import logging
+import os
+import time
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramForbiddenError
+
+import meetings
+import metrics
+import profiles
+import repository
+import throttling
+
+# === Утренний дайджест ===
+# Раз в DIGEST_INTERVAL секунд задача проходит по подписчикам (user_profiles.
+# digest_enabled) пачками по DIGEST_BATCH. Для пачки тремя-четырьмя запросами
+# читаются календари из settings и все встречи на сегодня, дальше они
+# группируются по пользователям в памяти. Дайджест уходит пользователю, у
+# которого местное время уже DIGEST_HOUR или позже; отметка digest_sent_on
+# ставится до отправки и защищает от повтора. Сообщения идут через очередь с
+# собственным ограничением DIGEST_RATE, чтобы рассылка не занимала весь лимит
+# Telegram и ответы на апдейты не ждали её окончания.
+
+DIGEST_INTERVAL = float(os.getenv("DIGEST_INTERVAL", "300"))  # 0 — дайджест выключен
+DIGEST_HOUR = int(os.getenv("DIGEST_HOUR", "8"))  # в часовом поясе пользователя
+DIGEST_BATCH = int(os.getenv("DIGEST_BATCH", "500"))
+DIGEST_RATE = float(os.getenv("DIGEST_RATE", "15"))  # сообщений в секунду
+DIGEST_CONCURRENCY = int(os.getenv("DIGEST_CONCURRENCY", "10"))
+APPOINTMENTS_CHUNK = 1000
+
+
+def render(profile: profiles.Profile, appointments: list, calendar_names: dict) -> str:
+    # appointments отсортированы по времени; группируем по календарям в порядке первой встречи
+    by_calendar = {}
+    for app in appointments:
+        by_calendar.setdefault(app["calendar_id"], []).append(app)
+    lines = [f"☀️ <b>Встречи на сегодня ({len(appointments)}):</b>"]
+    for calendar_id, calendar_appointments in by_calendar.items():
+        lines.append(f"\n📅 <b>{html.escape(calendar_names.get(calendar_id) or 'Другой календарь')}</b>")
+        for app in calendar_appointments:
+            line = f"{profile.to_local(app['meeting_date_time']).strftime('%H:%M')} — {html.escape(app.get('title') or 'Встреча')}"
+            if app.get("client_name"):
+                line += f", 👤 {html.escape(app['client_name'])}"
+            if app.get("phone_number"):
+                line += f", 📞 {html.escape(app['phone_number'])}"
+            lines.append(line)
+    return "\n".join(lines)
+
+
+class DigestSender:
+    def __init__(self, bot: Bot):
+        self.bot = bot
+        self._bucket = throttling.TokenBucket(DIGEST_RATE, max(1, int(DIGEST_RATE)))
+        self._sent = 0
+
+    async def _worker(self, queue: asyncio.Queue):
+        while True:
+            chat_id, text = await queue.get()
+            try:
+                while not self._bucket.try_acquire():
+                    await asyncio.sleep(self._bucket.delay())
+                await self.bot.send_message(chat_id, text, parse_mode="HTML")
+                self._sent += 1
+            except TelegramForbiddenError:
+                # Пользователь заблокировал бота — больше не пытаемся
+                try:
+                    await profiles.update_profile(chat_id, digest_enabled=False)
+                except Exception as e:
+                    logging.warning(f"⚠️ Не удалось отключить дайджест для {chat_id}: {e}")
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось отправить дайджест {chat_id}: {e}")
+            finally:
+                queue.task_done()
+
+    async def _load_appointments(self, user_ids: list, start: str, end: str) -> list:
+        appointments, cursor = [], None
+        while True:
+            rows = await repository.get_appointments_of_users(user_ids, start, end, cursor, APPOINTMENTS_CHUNK)
+            appointments.extend(rows)
+            if len(rows) < APPOINTMENTS_CHUNK:
+                return appointments
+            cursor = (rows[-1]["meeting_date_time"], rows[-1]["id"])
+
+    async def _process_batch(self, due: dict, queue: asyncio.Queue):
+        # due: telegram_id -> (профиль, местная дата, начало дня, конец дня)
+        user_ids = list(due)
+        start = min(day_start for _, _, day_start, _ in due.values())
+        end = max(day_end for _, _, _, day_end in due.values())
+        appointments, calendars = await asyncio.gather(
+            self._load_appointments(user_ids, start.isoformat(), end.isoformat()),
+            repository.get_calendars_of_users(user_ids)
+        )
+        by_user = {}
+        for app in appointments:
+            user_id = app["clients"]["telegram_id"]
+            _, _, day_start, day_end = due[user_id]
+            if day_start <= meetings.parse_timestamp(app["meeting_date_time"]) < day_end:
+                by_user.setdefault(user_id, []).append(app)
+        calendar_names = {}
+        for calendar in calendars:
+            calendar_names.setdefault(calendar["telegram_id"], {})[calendar["calendar_id"]] = calendar["calendar_name"]
+
+        # Отмечаем всех, в том числе без встреч, — иначе они проверялись бы весь день
+        by_day = {}
+        for user_id, (_, day, _, _) in due.items():
+            by_day.setdefault(day.isoformat(), []).append(user_id)
+        claimed = []
+        for day, day_user_ids in by_day.items():
+            claimed += await repository.claim_digests(day_user_ids, day)
+        for user_id in claimed:
+            if user_id in by_user:
+                profile = due[user_id][0]
+                await queue.put((user_id, render(profile, by_user[user_id], calendar_names.get(user_id, {}))))
+
+    async def run_once(self):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        queue = asyncio.Queue(maxsize=DIGEST_BATCH)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(DIGEST_CONCURRENCY)]
+        started, self._sent, after_id = time.monotonic(), 0, 0
+        try:
+            while True:
+                rows = await repository.get_digest_subscribers(after_id, DIGEST_BATCH)
+                if not rows:
+                    break
+                after_id = rows[-1]["telegram_id"]
+                due = {}
+                for row in rows:
+                    profile = profiles.Profile.from_row(row)
+                    local_now = now.astimezone(profile.tz)
+                    if local_now.hour < DIGEST_HOUR or row.get("digest_sent_on") == local_now.date().isoformat():
+                        continue
+                    day_start = profile.localize(datetime.datetime.combine(local_now.date(), datetime.time()))
+                    day_end = profile.localize(
+                        datetime.datetime.combine(local_now.date() + datetime.timedelta(days=1), datetime.time())
+                    )
+                    due[row["telegram_id"]] = (profile, local_now.date(), day_start, day_end)
+                if due:
+                    await self._process_batch(due, queue)
+                if len(rows) < DIGEST_BATCH:
+                    break
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+        if self._sent:
+            elapsed = time.monotonic() - started
+            metrics.set_gauge("bot_digest_last_run_seconds", elapsed)
+            logging.info(f"Дайджест: отправлено {self._sent} за {elapsed:.1f} с")
+
+    async def run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logging.warning(f"⚠️ Ошибка рассылки дайджеста: {e}")
+            await asyncio.sleep(DIGEST_INTERVAL)
@@ -0,0 +1,116 @@
+import csv
+import datetime
+import io
+import os
+
+import meetings
+import profiles
+import repository
+
+# === Экспорт встреч в CSV / iCalendar ===
+# Встречи читаются из базы порциями (repository.iter_appointments) и сразу
+# пишутся в буфер файла. Каждые EXPORT_FILE_ROWS строк буфер отдаётся как
+# отдельный документ, так что память не растёт с размером истории.
+# Формат совпадает с тем, что принимает /import.
+
+EXPORT_FILE_ROWS = int(os.getenv("EXPORT_FILE_ROWS", "10000"))
+CSV_HEADER = ["title", "name", "datetime", "phone"]
+ICS_LINE_LIMIT = 75  # октетов, RFC 5545
+
+
+def _client_name(appointment: dict) -> str:
+    # Пока migrations/007 не применена, имени у встречи нет — берём имя из clients
+    return appointment.get("client_name") or (appointment.get("clients") or {}).get("name")
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    # Перенос длинных строк по 75 октетов, не разрывая многобайтовые символы
+    parts, current, size = [], "", 0
+    for char in line:
+        width = len(char.encode("utf-8"))
+        if size + width > ICS_LINE_LIMIT:
+            parts.append(current)
+            current, size = " ", 1
+        current += char
+        size += width
+    parts.append(current)
+    return "\r\n".join(parts) + "\r\n"
+
+
+class _CsvFile:
+    extension = "csv"
+
+    def __init__(self, profile: profiles.Profile):
+        self._profile = profile
+        self.buffer = io.BytesIO()
+        self._text = io.TextIOWrapper(self.buffer, encoding="utf-8-sig", newline="", write_through=True)
+        self._writer = csv.writer(self._text)
+        self._writer.writerow(CSV_HEADER)
+
+    def write(self, appointment: dict):
+        self._writer.writerow([
+            appointment["title"],
+            _client_name(appointment) or "",
+            self._profile.format(appointment["meeting_date_time"]),
+            appointment.get("phone_number") or ""
+        ])
+
+    def close(self) -> bytes:
+        data = self.buffer.getvalue()
+        self._text.detach()
+        return data
+
+
+class _IcsFile:
+    extension = "ics"
+
+    def __init__(self, profile: profiles.Profile):
+        self._duration = profile.duration
+        self.buffer = io.BytesIO()
+        self._stamp = datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self._line("BEGIN:VCALENDAR")
+        self._line("VERSION:2.0")
+        self._line("PRODID:-//Don't Forget CRM Bot//RU")
+
+    def _line(self, line: str):
+        self.buffer.write(_fold(line).encode("utf-8"))
+
+    def write(self, appointment: dict):
+        start = meetings.parse_timestamp(appointment["meeting_date_time"]).astimezone(datetime.timezone.utc)
+        name = _client_name(appointment) or "—"
+        self._line("BEGIN:VEVENT")
+        self._line(f"UID:appointment-{appointment['id']}@dont-forget-crm-bot")
+        self._line(f"DTSTAMP:{self._stamp}")
+        self._line(f"DTSTART:{start.strftime('%Y%m%dT%H%M%SZ')}")
+        self._line(f"DTEND:{(start + self._duration).strftime('%Y%m%dT%H%M%SZ')}")
+        self._line(f"SUMMARY:{_escape(appointment['title'])}")
+        self._line("DESCRIPTION:" + _escape(
+            f"👤 Клиент: {name}\n📞 Телефон: {appointment.get('phone_number') or '—'}"
+        ))
+        self._line("END:VEVENT")
+
+    def close(self) -> bytes:
+        self._line("END:VCALENDAR")
+        return self.buffer.getvalue()
+
+
+async def export_files(user_id: int, kind: str):
+    # Асинхронный генератор (имя файла, содержимое); пустая история — ни одного файла
+    file_class = _CsvFile if kind == "csv" else _IcsFile
+    profile = await profiles.get_profile(user_id)
+    part, rows, current = 1, 0, None
+    async for chunk in repository.iter_appointments(user_id):
+        for appointment in chunk:
+            if current is None:
+                current = file_class(profile)
+            current.write(appointment)
+            rows += 1
+            if rows >= EXPORT_FILE_ROWS:
+                yield f"appointments_{part}.{current.extension}", current.close()
+                part, rows, current = part + 1, 0, None
+    if current is not None:
+        yield f"appointments_{part}.{current.extension}", current.close()
@@ -0,0 +1,214 @@
+import asyncio
+import csv
+import datetime
+import re
+
+import pytz
+
+import calendar_gateway
+import meetings
+import profiles
+import repository
+import slots
+
+# === Импорт встреч из CSV / iCalendar ===
+# Файл читается построчно генератором и обрабатывается пачками по IMPORT_CHUNK:
+# события Google создаются одновременно (gateway объединяет их в batch-запросы),
+# а встречи пачки записываются в базу одним вызовом import_meetings.
+
+IMPORT_CHUNK = 200
+MAX_REPORTED_ERRORS = 5
+
+CSV_COLUMNS = {
+    "title": "title", "название": "title",
+    "name": "name", "клиент": "name", "имя": "name",
+    "datetime": "datetime", "дата": "datetime",
+    "phone": "phone", "телефон": "phone",
+    "comment": "comment", "комментарий": "comment",
+}
+
+
+def read_csv(path: str):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(f, dialect=dialect)
+        for row in reader:
+            yield reader.line_num, {
+                CSV_COLUMNS.get(key.strip().lower(), key.strip().lower()): (value or "").strip()
+                for key, value in row.items() if key
+            }
+
+
+def _unfold(f):
+    # Строки iCalendar, перенесённые по RFC 5545 (продолжение начинается с пробела)
+    current, start = None, 0
+    for line_num, raw in enumerate(f, 1):
+        line = raw.rstrip("\r\n")
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            continue
+        if current is not None:
+            yield start, current
+        current, start = line, line_num
+    if current is not None:
+        yield start, current
+
+
+def _unescape(value: str) -> str:
+    return value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+def _parse_dtstart(params: dict, value: str, tz) -> datetime.datetime:
+    if params.get("VALUE") == "DATE":
+        raise ValueError("событие на весь день")
+    if value.endswith("Z"):
+        return pytz.utc.localize(datetime.datetime.strptime(value, "%Y%m%dT%H%M%SZ"))
+    naive = datetime.datetime.strptime(value, "%Y%m%dT%H%M%S")
+    return (profiles.get_tz(params["TZID"]) if "TZID" in params else tz).localize(naive)
+
+
+def read_ics(path: str, tz):
+    with open(path, encoding="utf-8-sig") as f:
+        event, start = None, 0
+        for line_num, line in _unfold(f):
+            if line == "BEGIN:VEVENT":
+                event, start = {}, line_num
+                continue
+            if line == "END:VEVENT" and event is not None:
+                yield start, event
+                event = None
+                continue
+            if event is None or ":" not in line:
+                continue
+            head, value = line.split(":", 1)
+            name, *raw_params = head.split(";")
+            params = dict(p.split("=", 1) for p in raw_params if "=" in p)
+            if name == "SUMMARY":
+                event["title"] = _unescape(value)
+            elif name == "DTSTART":
+                try:
+                    event["dt"] = _parse_dtstart(params, value, tz)
+                except (ValueError, pytz.UnknownTimeZoneError) as e:
+                    event["dt_error"] = str(e)
+            elif name == "DESCRIPTION":
+                # Описание в формате, который бот сам пишет в событие
+                description = _unescape(value)
+                for key, pattern in (("name", r"Клиент:\s*(.+)"), ("phone", r"Телефон:\s*(\S+)"),
+                                     ("comment", r"Комментарий:\s*(.+)")):
+                    match = re.search(pattern, description)
+                    if match:
+                        event[key] = match.group(1).strip()
+
+
+def validate(row: dict, profile: profiles.Profile) -> dict:
+    title = row.get("title", "").strip()
+    if not title:
+        raise ValueError("нет названия встречи")
+    if "dt" in row:
+        dt = row["dt"]
+    elif row.get("dt_error"):
+        raise ValueError(f"неверная дата: {row['dt_error']}")
+    else:
+        try:
+            dt = profile.localize(meetings.parse_datetime(row.get("datetime", "")))
+        except ValueError:
+            raise ValueError("дата должна быть в формате YYYY-MM-DD HH:MM")
+    phone = row.get("phone", "").strip()
+    if not meetings.is_valid_phone(phone):
+        raise ValueError("телефон должен быть в формате +7XXXXXXXXXX")
+    comment = row.get("comment", "")
+    return {
+        "title": title,
+        "name": row.get("name", "").strip() or "—",
+        "phone": phone,
+        "comment": "" if comment == "—" else comment,
+        "dt": dt
+    }
+
+
+class ImportStats:
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.invalid = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, text: str):
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(text)
+
+
+async def _import_chunk(chunk: list, user_id: int, calendar_id: str, profile: profiles.Profile,
+                        stats: ImportStats) -> list:
+    results = await asyncio.gather(*(
+        calendar_gateway.insert_event(calendar_id, meetings.build_event(
+            m["title"], m["name"], m["phone"], m["comment"], m["dt"], profile.duration, profile.timezone
+        ))
+        for _, m in chunk
+    ), return_exceptions=True)
+    created = []
+    for (line_num, meeting), result in zip(chunk, results):
+        if isinstance(result, Exception):
+            stats.failed += 1
+            stats.add_error(f"строка {line_num}: {result}")
+        else:
+            created.append((meeting, result["id"]))
+    if not created:
+        if not stats.imported:
+            # Ни одно событие не создалось с самого начала — скорее всего, нет доступа к календарю
+            raise results[0]
+        return []
+    try:
+        appointments = await repository.import_meetings(user_id, created[0][0]["name"], created[0][0]["phone"], [
+            {
+                "title": meeting["title"],
+                "client_name": meeting["name"],
+                "phone": meeting["phone"],
+                "meeting_date_time": meeting["dt"].isoformat(),
+                "calendar_id": calendar_id,
+                "event_id": event_id
+            }
+            for meeting, event_id in created
+        ])
+    except Exception:
+        # Пачка не записалась — убираем её события из календаря
+        await asyncio.gather(*(
+            calendar_gateway.delete_event(calendar_id, event_id) for _, event_id in created
+        ), return_exceptions=True)
+        raise
+    for meeting, _ in created:
+        slots.add_busy(calendar_id, meeting["dt"], profile.duration)
+    stats.imported += len(appointments)
+    return appointments
+
+
+async def import_file(path: str, kind: str, user_id: int, calendar_id: str, on_progress=None, on_imported=None):
+    stats = ImportStats()
+    profile = await profiles.get_profile(user_id)
+    rows = read_csv(path) if kind == "csv" else read_ics(path, profile.tz)
+    chunk = []
+    for line_num, row in rows:
+        stats.processed += 1
+        try:
+            chunk.append((line_num, validate(row, profile)))
+        except ValueError as e:
+            stats.invalid += 1
+            stats.add_error(f"строка {line_num}: {e}")
+        if len(chunk) >= IMPORT_CHUNK:
+            appointments = await _import_chunk(chunk, user_id, calendar_id, profile, stats)
+            chunk = []
+            if on_imported:
+                on_imported(appointments)
+            if on_progress:
+                await on_progress(stats)
+    if chunk:
+        appointments = await _import_chunk(chunk, user_id, calendar_id, profile, stats)
+        if on_imported:
+            on_imported(appointments)
+    return stats
@@ -0,0 +1,217 @@
+import asyncio
+import functools
+import logging
+import os
+import ssl
+from email.message import Message
+
+import metrics
+
+# === Отправка email ===
+# Письма ставятся в очередь и отправляются фоновыми воркерами через небольшой
+# пул уже авторизованных SMTP-соединений, с повторами и ограничением скорости.
+# aiosmtplib, certifi и MIME-классы импортируются при первом письме или в
+# warm_up, чтобы не задерживать запуск бота.
+
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+SMTP_START_TLS = os.getenv("SMTP_START_TLS", "1") == "1"  # 0 — только для локального SMTP (тесты)
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "2"))
+SMTP_RATE_LIMIT = float(os.getenv("SMTP_RATE_LIMIT", "2"))  # писем в секунду
+SMTP_RETRIES = int(os.getenv("SMTP_RETRIES", "3"))
+SMTP_RETRY_DELAY = float(os.getenv("SMTP_RETRY_DELAY", "1"))  # секунд перед первым повтором, дальше вдвое больше
+SMTP_TIMEOUT = float(os.getenv("SMTP_TIMEOUT", "30"))
+SMTP_MAX_RECIPIENTS = 50  # получателей в одном письме (лимит Gmail — 100)
+
+
+@functools.lru_cache(maxsize=None)
+def _tls_context() -> ssl.SSLContext:
+    import certifi
+    return ssl.create_default_context(cafile=certifi.where())
+
+
+async def warm_up():
+    await asyncio.get_running_loop().run_in_executor(None, _warm_up)
+
+
+def _warm_up():
+    import aiosmtplib  # noqa: F401
+    import email.mime.multipart  # noqa: F401
+    _tls_context()
+
+
+@functools.lru_cache(maxsize=8)
+def _image_part(image_path: str) -> Message:
+    # Картинка кодируется в base64 один раз; одну и ту же часть можно вкладывать в разные письма
+    from email.mime.image import MIMEImage
+    with open(image_path, "rb") as f:
+        img = MIMEImage(f.read())
+    img.add_header("Content-ID", "<image1>")
+    img.add_header("Content-Disposition", "inline", filename="invite.jpg")
+    return img
+
+
+def build_invite(to_email: str, subject: str, body_text: str, image_path: str) -> Message:
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    # Основной контейнер письма
+    msg = MIMEMultipart("related")
+    msg["From"] = os.getenv("SMTP_EMAIL")
+    msg["To"] = to_email
+    msg["Subject"] = subject
+    # HTML-версия письма
+    formatted_body = body_text.replace('\n', '<br>')
+    html = f"""<html><body><p>{formatted_body}</p><img src="cid:image1" width="400"/></body></html>"""
+    # Добавляем HTML как альтернативную часть
+    alternative = MIMEMultipart("alternative")
+    alternative.attach(MIMEText(html, "html"))
+    msg.attach(alternative)
+    # Встраиваем изображение
+    msg.attach(_image_part(image_path))
+    return msg
+
+
+class SMTPPool:
+    def __init__(self, size: int = SMTP_POOL_SIZE):
+        self._idle = []
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def _connect(self) -> "aiosmtplib.SMTP":
+        import aiosmtplib
+        smtp = aiosmtplib.SMTP(
+            hostname=SMTP_HOST,
+            port=SMTP_PORT,
+            start_tls=SMTP_START_TLS,
+            username=os.getenv("SMTP_EMAIL"),
+            password=os.getenv("SMTP_PASSWORD"),
+            tls_context=_tls_context(),
+            timeout=SMTP_TIMEOUT
+        )
+        await smtp.connect()
+        return smtp
+
+    async def acquire(self) -> "aiosmtplib.SMTP":
+        await self._semaphore.acquire()
+        try:
+            while self._idle:
+                smtp = self._idle.pop()
+                if smtp.is_connected:
+                    return smtp
+            return await self._connect()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def release(self, smtp: "aiosmtplib.SMTP", broken: bool = False):
+        if broken or not smtp.is_connected:
+            smtp.close()
+        else:
+            self._idle.append(smtp)
+        self._semaphore.release()
+
+    async def close(self):
+        while self._idle:
+            smtp = self._idle.pop()
+            try:
+                await smtp.quit()
+            except Exception:
+                smtp.close()
+
+
+class Mailer:
+    def __init__(self, pool_size: int = SMTP_POOL_SIZE, rate_limit: float = SMTP_RATE_LIMIT):
+        self.pool_size = pool_size
+        self.rate_limit = rate_limit
+        self._pool = None
+        self._queue = None
+        self._workers = []
+        self._next_slot = 0.0
+
+    def start(self):
+        if self._queue is not None:
+            return
+        self._pool = SMTPPool(self.pool_size)
+        self._queue = asyncio.Queue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.pool_size)]
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+        self._queue = None
+        if self._pool:
+            await self._pool.close()
+
+    def send(self, message: Message, recipients: list = None, retries: int = SMTP_RETRIES) -> asyncio.Future:
+        # Возвращает future, который завершится после фактической отправки.
+        # Результат — словарь {адрес: причина} для получателей, которых сервер не принял.
+        # retries=0 — без повторов внутри, если их делает вызывающий код (outbox)
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((message, recipients, retries, future))
+        return future
+
+    def send_many(self, message: Message, recipients: list, retries: int = SMTP_RETRIES) -> asyncio.Future:
+        # Одно письмо многим получателям: одна передача DATA на пачку адресов
+        futures = [
+            self.send(message, recipients[i:i + SMTP_MAX_RECIPIENTS], retries)
+            for i in range(0, len(recipients), SMTP_MAX_RECIPIENTS)
+        ]
+
+        async def merge() -> dict:
+            refused = {}
+            for result in await asyncio.gather(*futures):
+                refused.update(result)
+            return refused
+
+        return asyncio.ensure_future(merge())
+
+    async def _throttle(self):
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        wait = self._next_slot - now
+        self._next_slot = max(now, self._next_slot) + 1 / self.rate_limit
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def _deliver(self, message: Message, recipients: list = None, retries: int = SMTP_RETRIES) -> dict:
+        import aiosmtplib
+        for attempt in range(retries + 1):
+            await self._throttle()
+            smtp = None
+            try:
+                async with metrics.track("smtp"):
+                    smtp = await self._pool.acquire()
+                    errors, _ = await smtp.send_message(message, recipients=recipients)
+                self._pool.release(smtp)
+                return {address: response.message for address, response in errors.items()}
+            except aiosmtplib.SMTPRecipientsRefused as e:
+                # Ошибка в адресе не исправится повтором
+                self._pool.release(smtp)
+                return {r.recipient: r.message for r in e.recipients}
+            except aiosmtplib.SMTPSenderRefused:
+                self._pool.release(smtp)
+                raise
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError) as e:
+                if smtp:
+                    self._pool.release(smtp, broken=True)
+                if attempt == retries:
+                    raise
+                logging.warning(f"⚠️ SMTP: попытка {attempt + 1} не удалась ({e}), повторяем")
+                await asyncio.sleep(SMTP_RETRY_DELAY * 2 ** attempt)
+
+    async def _worker(self):
+        # Своя ссылка на очередь: stop() обнуляет self._queue раньше, чем отменённый воркер дойдёт до finally
+        queue = self._queue
+        while True:
+            message, recipients, retries, future = await queue.get()
+            try:
+                refused = await self._deliver(message, recipients, retries)
+                if not future.done():
+                    future.set_result(refused)
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось отправить письмо {message['To']}: {e}")
+                if not future.done():
+                    future.set_exception(e)
+            finally:
+                queue.task_done()
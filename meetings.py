@@ -0,0 +1,37 @@
+import datetime
+import re
+
+# === Правила для встреч ===
+# Общие для диалога "Добавить встречу" и импорта из файла. Часовой пояс и
+# длительность берутся из профиля пользователя (profiles.py).
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M"
+PHONE_PATTERN = re.compile(r"\+7\d{10}")
+
+
+def parse_datetime(text: str) -> datetime.datetime:
+    # ValueError, если строка не в формате YYYY-MM-DD HH:MM
+    return datetime.datetime.strptime(text.strip(), DATETIME_FORMAT)
+
+
+def parse_timestamp(value: str) -> datetime.datetime:
+    # Время из базы и Google API (ISO 8601, в том числе с "Z") с часовым поясом
+    return datetime.datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+def is_valid_phone(phone: str) -> bool:
+    return bool(PHONE_PATTERN.fullmatch(phone.strip()))
+
+
+def build_event(title: str, name: str, phone: str, comment: str, dt: datetime.datetime,
+                duration: datetime.timedelta, timezone: str) -> dict:
+    return {
+        "summary": title,
+        "description": (
+            f"👤 Клиент: {name}\n"
+            f"📞 Телефон: {phone}\n"
+            f"📝 Комментарий: {comment or '—'}"
+        ),
+        "start": {"dateTime": dt.isoformat(), "timeZone": timezone},
+        "end": {"dateTime": (dt + duration).isoformat(), "timeZone": timezone}
+    }
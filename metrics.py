@@ -0,0 +1,209 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject
+from aiohttp import web
+
+# === Метрики ===
+# Гистограммы времени обработчиков с разбивкой по внешним вызовам
+# (supabase, google, smtp, telegram), число апдейтов в работе и задержка
+# event loop. Отдаются в формате Prometheus на METRICS_HOST:METRICS_PORT/metrics.
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — endpoint выключен
+METRICS_LOG_INTERVAL = float(os.getenv("METRICS_LOG_INTERVAL", "0"))  # 0 — без сводки в лог
+LOOP_LAG_INTERVAL = 0.5
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        # Верхняя граница бакета, в который попадает квантиль
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return BUCKETS[-1]
+
+
+_histograms: Dict[tuple, Histogram] = {}
+_gauges: Dict[str, float] = {"bot_updates_in_flight": 0, "bot_event_loop_lag_seconds": 0}
+_collectors = []
+# Время внешних вызовов внутри текущего апдейта: компонент -> секунды
+_breakdown: contextvars.ContextVar = contextvars.ContextVar("metrics_breakdown", default=None)
+
+
+def observe(name: str, value: float, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        histogram = _histograms[key] = Histogram()
+    histogram.observe(value)
+
+
+def set_gauge(name: str, value: float):
+    _gauges[name] = value
+
+
+def register_collector(collector: Callable[[], Dict[str, float]]):
+    _collectors.append(collector)
+
+
+@contextlib.asynccontextmanager
+async def track(component: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        observe("bot_external_call_seconds", elapsed, component=component)
+        breakdown = _breakdown.get()
+        if breakdown is not None:
+            breakdown[component] = breakdown.get(component, 0.0) + elapsed
+
+
+class InFlightMiddleware(BaseMiddleware):
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        _gauges["bot_updates_in_flight"] += 1
+        try:
+            return await handler(event, data)
+        finally:
+            _gauges["bot_updates_in_flight"] -= 1
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        name = data["handler"].callback.__name__
+        breakdown = {}
+        token = _breakdown.set(breakdown)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            elapsed = time.perf_counter() - start
+            _breakdown.reset(token)
+            observe("bot_handler_seconds", elapsed, handler=name)
+            own = elapsed
+            for component, seconds in breakdown.items():
+                observe("bot_handler_component_seconds", seconds, handler=name, component=component)
+                own -= seconds
+            observe("bot_handler_component_seconds", max(own, 0.0), handler=name, component="bot")
+
+
+class TelegramTimingMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        async with track("telegram"):
+            return await make_request(bot, method)
+
+
+def setup(dp, bot):
+    dp.update.outer_middleware(InFlightMiddleware())
+    dp.message.middleware(HandlerTimingMiddleware())
+    dp.callback_query.middleware(HandlerTimingMiddleware())
+    bot.session.middleware(TelegramTimingMiddleware())
+
+
+def _format_labels(labels: tuple, extra: str = "") -> str:
+    parts = [f'{k}="{v}"' for k, v in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render() -> str:
+    lines = []
+    typed = set()
+    for (name, labels), histogram in sorted(_histograms.items()):
+        if name not in typed:
+            lines.append(f"# TYPE {name} histogram")
+            typed.add(name)
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            le_label = f'le="{le}"'
+            lines.append(f"{name}_bucket{_format_labels(labels, le_label)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+    gauges = dict(_gauges)
+    for collector in _collectors:
+        gauges.update(collector())
+    for name, value in sorted(gauges.items()):
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def summary() -> str:
+    lines = []
+    for (name, labels), histogram in sorted(_histograms.items()):
+        if name != "bot_handler_seconds" or not histogram.count:
+            continue
+        handler = dict(labels)["handler"]
+        lines.append(
+            f"{handler}: n={histogram.count} avg={histogram.sum / histogram.count:.3f}s "
+            f"p50<={histogram.quantile(0.5)}s p99<={histogram.quantile(0.99)}s"
+        )
+    return "\n".join(lines)
+
+
+async def monitor_loop_lag():
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lag = max(loop.time() - start - LOOP_LAG_INTERVAL, 0.0)
+        _gauges["bot_event_loop_lag_seconds"] = lag
+        observe("bot_event_loop_lag_seconds_hist", lag)
+
+
+async def log_summary():
+    while True:
+        await asyncio.sleep(METRICS_LOG_INTERVAL)
+        text = summary()
+        if text:
+            logging.info(f"Метрики обработчиков:\n{text}")
+
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain")
+
+
+async def start_server() -> web.AppRunner:
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, METRICS_HOST, METRICS_PORT).start()
+    return runner
+
+
+def start_background(tasks: set):
+    tasks.add(asyncio.create_task(monitor_loop_lag()))
+    if METRICS_LOG_INTERVAL:
+        tasks.add(asyncio.create_task(log_summary()))
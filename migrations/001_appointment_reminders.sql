@@ -0,0 +1,8 @@
+-- Напоминания о встречах: отметка об отправке, чтобы после перезапуска
+-- бот не присылал напоминание повторно
+alter table appointments add column if not exists reminder_sent_at timestamptz;
+
+-- Планировщик читает только ближайшие неотправленные напоминания
+create index if not exists appointments_pending_reminders_idx
+    on appointments (meeting_date_time, id)
+    where reminder_sent_at is null;
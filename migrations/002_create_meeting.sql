@@ -0,0 +1,41 @@
+-- Создание встречи одним вызовом: клиент (если его ещё нет), встреча и связь
+-- с событием Google Calendar записываются в одной транзакции
+create or replace function create_meeting(
+    p_telegram_id bigint,
+    p_name text,
+    p_phone text,
+    p_title text,
+    p_meeting_date_time timestamptz,
+    p_calendar_id text,
+    p_event_id text
+) returns json
+language plpgsql
+as $$
+declare
+    v_client clients%rowtype;
+    v_appointment appointments%rowtype;
+begin
+    -- Не даём двум параллельным вызовам одного пользователя создать двух клиентов
+    perform pg_advisory_xact_lock(p_telegram_id);
+
+    select * into v_client from clients where telegram_id = p_telegram_id order by id limit 1;
+    if not found then
+        insert into clients (name, telegram_id, phone_number)
+        values (p_name, p_telegram_id, p_phone)
+        returning * into v_client;
+    end if;
+
+    insert into appointments (client_id, meeting_date_time, phone_number, title, calendar_id)
+    values (v_client.id, p_meeting_date_time, p_phone, p_title, p_calendar_id)
+    returning * into v_appointment;
+
+    insert into calendar_events (appointment_id, event_id)
+    values (v_appointment.id, p_event_id);
+
+    return json_build_object(
+        'client', row_to_json(v_client),
+        'appointment', row_to_json(v_appointment),
+        'event_id', p_event_id
+    );
+end;
+$$;
@@ -0,0 +1,8 @@
+-- Связь с событием Google удаляется вместе со встречей, чтобы удаление
+-- встречи (и пачки встреч) было одним запросом
+alter table calendar_events drop constraint if exists calendar_events_appointment_id_fkey;
+alter table calendar_events
+    add constraint calendar_events_appointment_id_fkey
+    foreign key (appointment_id) references appointments (id) on delete cascade;
+
+create index if not exists calendar_events_appointment_id_idx on calendar_events (appointment_id);
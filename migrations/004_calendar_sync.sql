@@ -0,0 +1,13 @@
+-- Состояние инкрементальной синхронизации с Google Calendar:
+-- syncToken и push-канал (events.watch) на каждый календарь
+create table if not exists calendar_sync (
+    calendar_id text primary key,
+    sync_token text,
+    channel_id text unique,
+    resource_id text,
+    channel_expiration timestamptz,
+    updated_at timestamptz not null default now()
+);
+
+-- Изменения из Google сопоставляются со встречами по event_id
+create index if not exists calendar_events_event_id_idx on calendar_events (event_id);
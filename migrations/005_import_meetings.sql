@@ -0,0 +1,46 @@
+-- Массовая запись встреч при импорте из файла: пачка встреч вместе со
+-- связями calendar_events записывается одним вызовом и одной транзакцией.
+-- p_meetings — массив объектов {title, phone, meeting_date_time, calendar_id, event_id}
+create or replace function import_meetings(
+    p_telegram_id bigint,
+    p_name text,
+    p_phone text,
+    p_meetings jsonb
+) returns json
+language plpgsql
+as $$
+declare
+    v_client clients%rowtype;
+    v_meeting jsonb;
+    v_appointment appointments%rowtype;
+    v_result jsonb := '[]'::jsonb;
+begin
+    perform pg_advisory_xact_lock(p_telegram_id);
+
+    select * into v_client from clients where telegram_id = p_telegram_id order by id limit 1;
+    if not found then
+        insert into clients (name, telegram_id, phone_number)
+        values (p_name, p_telegram_id, p_phone)
+        returning * into v_client;
+    end if;
+
+    for v_meeting in select * from jsonb_array_elements(p_meetings) loop
+        insert into appointments (client_id, meeting_date_time, phone_number, title, calendar_id)
+        values (
+            v_client.id,
+            (v_meeting->>'meeting_date_time')::timestamptz,
+            v_meeting->>'phone',
+            v_meeting->>'title',
+            v_meeting->>'calendar_id'
+        )
+        returning * into v_appointment;
+
+        insert into calendar_events (appointment_id, event_id)
+        values (v_appointment.id, v_meeting->>'event_id');
+
+        v_result := v_result || jsonb_build_array(to_jsonb(v_appointment));
+    end loop;
+
+    return v_result;
+end;
+$$;
@@ -0,0 +1,10 @@
+-- Профиль пользователя: часовой пояс, длительность встречи по умолчанию и язык.
+-- Хранится рядом с settings (календари пользователя), по одной строке на telegram_id
+create table if not exists user_profiles (
+    telegram_id bigint primary key,
+    timezone text not null default 'Europe/Moscow',
+    meeting_duration_minutes integer not null default 60
+        check (meeting_duration_minutes between 5 and 480),
+    locale text not null default 'ru',
+    updated_at timestamptz not null default now()
+);
@@ -0,0 +1,174 @@
+-- Поиск встреч (/search): фильтры по имени клиента, телефону, названию,
+-- календарю и периоду выполняются в базе одним вызовом search_appointments
+create extension if not exists pg_trgm;
+
+-- Имя клиента хранится у каждой встречи: строка clients одна на пользователя
+-- бота и содержит только имя из первой встречи
+alter table appointments add column if not exists client_name text;
+
+update appointments a
+set client_name = c.name
+from clients c
+where c.id = a.client_id and a.client_name is null;
+
+-- Встречи пользователя по времени (keyset по (meeting_date_time, id))
+create index if not exists clients_telegram_id_idx on clients (telegram_id);
+create index if not exists appointments_client_time_idx on appointments (client_id, meeting_date_time, id);
+
+-- Триграммные индексы для ILIKE '%...%'; телефон ищется по одним цифрам
+create index if not exists appointments_title_trgm_idx
+    on appointments using gin (title gin_trgm_ops);
+create index if not exists appointments_client_name_trgm_idx
+    on appointments using gin (client_name gin_trgm_ops);
+create index if not exists appointments_phone_digits_trgm_idx
+    on appointments using gin ((regexp_replace(phone_number, '\D', '', 'g')) gin_trgm_ops);
+
+create or replace function search_like_pattern(p_value text) returns text
+language sql immutable
+as $$
+    select '%' || replace(replace(replace(p_value, '\', '\\'), '%', '\%'), '_', '\_') || '%'
+$$;
+
+-- Запрос собирается только из заданных фильтров, чтобы планировщик видел
+-- конкретные условия и мог взять подходящий индекс.
+-- p_words — слова, каждое из которых должно найтись в названии или имени клиента;
+-- p_after_time/p_after_id — последняя строка предыдущей страницы
+create or replace function search_appointments(
+    p_telegram_id bigint,
+    p_words text[] default '{}',
+    p_name text default null,
+    p_phone text default null,
+    p_title text default null,
+    p_calendar_id text default null,
+    p_from timestamptz default null,
+    p_to timestamptz default null,
+    p_after_time timestamptz default null,
+    p_after_id bigint default null,
+    p_limit integer default 11
+) returns setof appointments
+language plpgsql stable
+as $$
+declare
+    v_sql text := 'select a.* from appointments a join clients c on c.id = a.client_id where c.telegram_id = $1';
+    v_word text;
+begin
+    if p_name is not null then
+        v_sql := v_sql || ' and a.client_name ilike search_like_pattern($3)';
+    end if;
+    if p_phone is not null then
+        v_sql := v_sql || ' and regexp_replace(a.phone_number, ''\D'', '''', ''g'') like search_like_pattern($4)';
+    end if;
+    if p_title is not null then
+        v_sql := v_sql || ' and a.title ilike search_like_pattern($5)';
+    end if;
+    if p_calendar_id is not null then
+        v_sql := v_sql || ' and a.calendar_id = $6';
+    end if;
+    if p_from is not null then
+        v_sql := v_sql || ' and a.meeting_date_time >= $7';
+    end if;
+    if p_to is not null then
+        v_sql := v_sql || ' and a.meeting_date_time < $8';
+    end if;
+    if p_after_time is not null then
+        v_sql := v_sql || ' and (a.meeting_date_time, a.id) > ($9, $10)';
+    end if;
+    for v_word in select unnest(coalesce(p_words, '{}')) loop
+        v_sql := v_sql || format(
+            ' and (a.title ilike search_like_pattern(%1$L) or a.client_name ilike search_like_pattern(%1$L))',
+            v_word
+        );
+    end loop;
+    v_sql := v_sql || ' order by a.meeting_date_time, a.id limit $11';
+
+    return query execute v_sql
+        using p_telegram_id, p_words, p_name, p_phone, p_title, p_calendar_id,
+              p_from, p_to, p_after_time, p_after_id, p_limit;
+end;
+$$;
+
+-- Имя клиента записывается вместе со встречей
+create or replace function create_meeting(
+    p_telegram_id bigint,
+    p_name text,
+    p_phone text,
+    p_title text,
+    p_meeting_date_time timestamptz,
+    p_calendar_id text,
+    p_event_id text
+) returns json
+language plpgsql
+as $$
+declare
+    v_client clients%rowtype;
+    v_appointment appointments%rowtype;
+begin
+    perform pg_advisory_xact_lock(p_telegram_id);
+
+    select * into v_client from clients where telegram_id = p_telegram_id order by id limit 1;
+    if not found then
+        insert into clients (name, telegram_id, phone_number)
+        values (p_name, p_telegram_id, p_phone)
+        returning * into v_client;
+    end if;
+
+    insert into appointments (client_id, client_name, meeting_date_time, phone_number, title, calendar_id)
+    values (v_client.id, p_name, p_meeting_date_time, p_phone, p_title, p_calendar_id)
+    returning * into v_appointment;
+
+    insert into calendar_events (appointment_id, event_id)
+    values (v_appointment.id, p_event_id);
+
+    return json_build_object(
+        'client', row_to_json(v_client),
+        'appointment', row_to_json(v_appointment),
+        'event_id', p_event_id
+    );
+end;
+$$;
+
+-- p_meetings — массив объектов {title, client_name, phone, meeting_date_time, calendar_id, event_id}
+create or replace function import_meetings(
+    p_telegram_id bigint,
+    p_name text,
+    p_phone text,
+    p_meetings jsonb
+) returns json
+language plpgsql
+as $$
+declare
+    v_client clients%rowtype;
+    v_meeting jsonb;
+    v_appointment appointments%rowtype;
+    v_result jsonb := '[]'::jsonb;
+begin
+    perform pg_advisory_xact_lock(p_telegram_id);
+
+    select * into v_client from clients where telegram_id = p_telegram_id order by id limit 1;
+    if not found then
+        insert into clients (name, telegram_id, phone_number)
+        values (p_name, p_telegram_id, p_phone)
+        returning * into v_client;
+    end if;
+
+    for v_meeting in select * from jsonb_array_elements(p_meetings) loop
+        insert into appointments (client_id, client_name, meeting_date_time, phone_number, title, calendar_id)
+        values (
+            v_client.id,
+            coalesce(v_meeting->>'client_name', p_name),
+            (v_meeting->>'meeting_date_time')::timestamptz,
+            v_meeting->>'phone',
+            v_meeting->>'title',
+            v_meeting->>'calendar_id'
+        )
+        returning * into v_appointment;
+
+        insert into calendar_events (appointment_id, event_id)
+        values (v_appointment.id, v_meeting->>'event_id');
+
+        v_result := v_result || jsonb_build_array(to_jsonb(v_appointment));
+    end loop;
+
+    return v_result;
+end;
+$$;
@@ -0,0 +1,13 @@
+-- Утренний дайджест встреч: подписка в профиле пользователя и дата последней
+-- отправки, чтобы после перезапуска (или из второго процесса) дайджест
+-- за тот же день не ушёл повторно
+alter table user_profiles add column if not exists digest_enabled boolean not null default false;
+alter table user_profiles add column if not exists digest_sent_on date;
+
+-- Задача рассылки читает только подписчиков, постранично по telegram_id
+create index if not exists user_profiles_digest_idx
+    on user_profiles (telegram_id)
+    where digest_enabled;
+
+-- Календари пачки пользователей одним запросом (settings.telegram_id in (...))
+create index if not exists settings_telegram_id_idx on settings (telegram_id);
@@ -0,0 +1,91 @@
+-- Outbox внешних действий (создание события в Google, запись встречи, письма):
+-- обработчик бота записывает намерение и сразу отвечает пользователю, а
+-- фоновые воркеры (outbox.py) выполняют его с повторами. idempotency_key не
+-- даёт записать одно намерение дважды при повторной доставке апдейта
+create table if not exists outbox (
+    id bigserial primary key,
+    idempotency_key text not null unique,
+    kind text not null,
+    payload jsonb not null,
+    status text not null default 'pending' check (status in ('pending', 'done', 'dead')),
+    attempts integer not null default 0,
+    next_attempt_at timestamptz not null default now(),
+    locked_until timestamptz,
+    last_error text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists outbox_pending_idx
+    on outbox (next_attempt_at)
+    where status = 'pending';
+
+-- Воркер забирает готовые задачи в аренду на p_lease_seconds: несколько
+-- процессов не получат одну задачу, а задача упавшего процесса вернётся
+-- в работу после окончания аренды
+create or replace function claim_outbox(p_limit integer, p_lease_seconds integer)
+returns setof outbox
+language sql
+as $$
+    update outbox o
+    set attempts = o.attempts + 1,
+        locked_until = now() + make_interval(secs => p_lease_seconds),
+        updated_at = now()
+    where o.id in (
+        select id from outbox
+        where status = 'pending'
+          and next_attempt_at <= now()
+          and (locked_until is null or locked_until < now())
+        order by next_attempt_at
+        limit p_limit
+        for update skip locked
+    )
+    returning o.*;
+$$;
+
+-- Повтор create_meeting с тем же event_id возвращает уже созданную встречу,
+-- а не создаёт вторую (event_id детерминированный, см. calendar_gateway.event_id_for)
+create or replace function create_meeting(
+    p_telegram_id bigint,
+    p_name text,
+    p_phone text,
+    p_title text,
+    p_meeting_date_time timestamptz,
+    p_calendar_id text,
+    p_event_id text
+) returns json
+language plpgsql
+as $$
+declare
+    v_client clients%rowtype;
+    v_appointment appointments%rowtype;
+begin
+    perform pg_advisory_xact_lock(p_telegram_id);
+
+    select * into v_client from clients where telegram_id = p_telegram_id order by id limit 1;
+    if not found then
+        insert into clients (name, telegram_id, phone_number)
+        values (p_name, p_telegram_id, p_phone)
+        returning * into v_client;
+    end if;
+
+    select a.* into v_appointment
+    from appointments a
+    join calendar_events e on e.appointment_id = a.id
+    where e.event_id = p_event_id and a.client_id = v_client.id;
+    if not found then
+        insert into appointments (client_id, client_name, meeting_date_time, phone_number, title, calendar_id)
+        values (v_client.id, p_name, p_meeting_date_time, p_phone, p_title, p_calendar_id)
+        returning * into v_appointment;
+
+        insert into calendar_events (appointment_id, event_id)
+        values (v_appointment.id, p_event_id);
+    end if;
+
+    return json_build_object(
+        'client', row_to_json(v_client),
+        'appointment', row_to_json(v_appointment),
+        'event_id', p_event_id
+    );
+end;
+$$;
@@ -0,0 +1,139 @@
+import asyncio
+import contextvars
+import datetime
+import logging
+import os
+import random
+
+import repository
+
+# === Outbox внешних действий ===
+# Обработчик апдейта только записывает задачу (enqueue) с ключом
+# идемпотентности и сразу отвечает пользователю. Пул из OUTBOX_WORKERS задач
+# забирает готовые задачи из таблицы outbox в аренду и выполняет их. После
+# ошибки задача откладывается с экспоненциальной задержкой, после
+# OUTBOX_MAX_ATTEMPTS попыток или PermanentError попадает в dead letter
+# (status = 'dead') и вызывает on_dead. Аренда истекает через OUTBOX_LEASE,
+# так что задача упавшего процесса подхватится снова. Поэтому обработчики
+# должны быть идемпотентными: повтор не должен создавать второе событие или
+# вторую встречу. Долгий обработчик из нескольких шагов (рассылка пачками)
+# вызывает checkpoint после каждого шага: сделанное записывается в payload
+# задачи, аренда продлевается, и повтор продолжит с того же места.
+
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "8"))
+OUTBOX_POLL_INTERVAL = float(os.getenv("OUTBOX_POLL_INTERVAL", "5"))
+OUTBOX_LEASE = int(os.getenv("OUTBOX_LEASE", "120"))  # секунд
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "2"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "600"))
+
+
+class PermanentError(Exception):
+    # Повтор не поможет (нет доступа к календарю и т.п.) — сразу в dead letter
+    pass
+
+
+class LeaseLost(Exception):
+    # Аренда истекла, задачу выполняет другая попытка — эта останавливается
+    pass
+
+
+_current_job = contextvars.ContextVar("outbox_job")  # задача, которую выполняет текущая asyncio-задача
+
+
+async def checkpoint(payload: dict):
+    # Вызывается из обработчика: сохраняет payload с уже сделанной частью работы
+    job = _current_job.get()
+    job["payload"] = payload
+    if not await repository.checkpoint_outbox(job["id"], job["attempts"], payload, OUTBOX_LEASE):
+        raise LeaseLost(f"аренда задачи outbox {job['id']} истекла")
+
+
+def backoff(attempt: int) -> float:
+    # attempt — номер неудачной попытки, с 1; случайный разброс разводит повторы во времени
+    delay = min(OUTBOX_BACKOFF_BASE * 2 ** (attempt - 1), OUTBOX_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1)
+
+
+class Outbox:
+    def __init__(self, workers: int = OUTBOX_WORKERS):
+        self.workers = workers
+        self._handlers = {}
+        self._tasks = set()
+        self._wakeup = asyncio.Event()
+        self.stats = {"done": 0, "retried": 0, "dead": 0}
+
+    def register(self, kind: str, handler, on_dead=None):
+        # handler(payload) выполняет задачу; on_dead(payload, error) — после последней неудачи
+        self._handlers[kind] = (handler, on_dead)
+
+    async def enqueue(self, kind: str, idempotency_key: str, payload: dict) -> bool:
+        created = await repository.enqueue_outbox(kind, idempotency_key, payload)
+        self._wakeup.set()
+        return created
+
+    async def _dead(self, job: dict, error: Exception, on_dead):
+        self.stats["dead"] += 1
+        logging.warning(f"⚠️ Задача outbox {job['id']} ({job['kind']}) не выполнена после {job['attempts']} попыток: {error}")
+        await repository.dead_letter_outbox(job["id"], str(error))
+        if on_dead:
+            await on_dead(job["payload"], error)
+
+    async def _execute(self, job: dict):
+        handler, on_dead = self._handlers.get(job["kind"], (None, None))
+        try:
+            if handler is None:
+                raise PermanentError(f"неизвестный тип задачи {job['kind']}")
+            _current_job.set(job)
+            await handler(job["payload"])
+        except LeaseLost as e:
+            logging.warning(f"⚠️ {e}, попытка {job['attempts']} остановлена")
+        except PermanentError as e:
+            await self._dead(job, e, on_dead)
+        except Exception as e:
+            if job["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                return await self._dead(job, e, on_dead)
+            self.stats["retried"] += 1
+            delay = backoff(job["attempts"])
+            logging.warning(f"⚠️ Задача outbox {job['id']} ({job['kind']}), попытка {job['attempts']}: {e}; "
+                            f"повтор через {delay:.0f} с")
+            next_attempt_at = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(seconds=delay)
+            await repository.retry_outbox(job["id"], next_attempt_at.isoformat(), str(e))
+        else:
+            self.stats["done"] += 1
+            await repository.complete_outbox(job["id"])
+
+    async def _execute_safely(self, job: dict):
+        try:
+            await self._execute(job)
+        except Exception as e:
+            # Не удалось записать итог — задача вернётся в работу после окончания аренды
+            logging.warning(f"⚠️ Не удалось обновить задачу outbox {job['id']}: {e}")
+
+    def _start(self, job: dict):
+        task = asyncio.create_task(self._execute_safely(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        self._wakeup.set()
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            free = self.workers - len(self._tasks)
+            jobs = []
+            if free > 0:
+                try:
+                    jobs = await repository.claim_outbox(free, OUTBOX_LEASE)
+                except Exception as e:
+                    logging.warning(f"⚠️ Не удалось получить задачи outbox: {e}")
+                for job in jobs:
+                    self._start(job)
+            if jobs and len(jobs) == free:
+                continue  # в очереди может быть ещё
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), OUTBOX_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,78 @@
+import datetime
+import functools
+import os
+
+import pytz
+from cachetools import TTLCache
+
+import meetings
+import repository
+
+# === Профиль пользователя ===
+# Часовой пояс, длительность встречи по умолчанию, язык и подписка на
+# утренний дайджест (таблица user_profiles, migrations/006 и 008). Профиль
+# читается из базы один раз и дальше берётся из памяти; tzinfo создаётся
+# один раз на часовой пояс, а не на каждую строку. При нескольких процессах
+# webhook изменения профиля доходят до остальных процессов за
+# PROFILE_CACHE_TTL.
+
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "3600"))
+DEFAULT_TIMEZONE = "Europe/Moscow"
+DEFAULT_DURATION_MINUTES = 60
+DEFAULT_LOCALE = "ru"
+
+
+@functools.lru_cache(maxsize=None)
+def get_tz(name: str):
+    return pytz.timezone(name)
+
+
+def is_valid_timezone(name: str) -> bool:
+    return name in pytz.all_timezones_set
+
+
+class Profile:
+    def __init__(self, timezone: str = DEFAULT_TIMEZONE, duration_minutes: int = DEFAULT_DURATION_MINUTES,
+                 locale: str = DEFAULT_LOCALE, digest_enabled: bool = False):
+        self.timezone = timezone
+        self.tz = get_tz(timezone)
+        self.duration_minutes = duration_minutes
+        self.duration = datetime.timedelta(minutes=duration_minutes)
+        self.locale = locale
+        self.digest_enabled = digest_enabled
+
+    @classmethod
+    def from_row(cls, row: dict) -> "Profile":
+        return cls(row["timezone"], row["meeting_duration_minutes"], row["locale"], row.get("digest_enabled", False))
+
+    def localize(self, naive: datetime.datetime) -> datetime.datetime:
+        return self.tz.localize(naive)
+
+    def to_local(self, value: str) -> datetime.datetime:
+        # value — время из базы (ISO 8601)
+        return meetings.parse_timestamp(value).astimezone(self.tz)
+
+    def format(self, value: str, fmt: str = meetings.DATETIME_FORMAT) -> str:
+        return self.to_local(value).strftime(fmt)
+
+    def format_many(self, values: list, fmt: str = meetings.DATETIME_FORMAT) -> list:
+        # Форматирование всей выборки за один проход с одним tzinfo
+        tz = self.tz
+        return [meetings.parse_timestamp(value).astimezone(tz).strftime(fmt) for value in values]
+
+
+_cache = TTLCache(maxsize=100_000, ttl=PROFILE_CACHE_TTL)
+
+
+async def get_profile(user_id: int) -> Profile:
+    profile = _cache.get(user_id)
+    if profile is None:
+        row = await repository.get_profile(user_id)
+        profile = _cache[user_id] = Profile.from_row(row) if row else Profile()
+    return profile
+
+
+async def update_profile(user_id: int, **fields) -> Profile:
+    row = await repository.save_profile(user_id, fields)
+    profile = _cache[user_id] = Profile.from_row(row)
+    return profile
@@ -0,0 +1,127 @@
+import asyncio
+import datetime
+import heapq
+import logging
+import os
+
+from aiogram import Bot
+
+import meetings
+import profiles
+import repository
+
+# === Напоминания о встречах ===
+# В памяти держим min-heap напоминаний только на ближайшее окно (REMINDER_HORIZON).
+# Окно сдвигается инкрементально: каждый раз дочитываем из базы только новый
+# отрезок времени, а не всю таблицу. Отметка reminder_sent_at в appointments
+# защищает от повторной отправки после перезапуска.
+# При нескольких процессах webhook планировщик работает в каждом: окно
+# загружено в каждом, а новую встречу сразу ставит в кучу процесс, который
+# её создал. Отправит напоминание тот процесс, чей claim_reminder успел первым.
+# Перенос встречи не ищет старую запись в куче: _scheduled помнит текущее
+# время напоминания для каждой встречи, а устаревшие записи отбрасываются,
+# когда доходят до вершины кучи (ленивое удаление).
+
+REMINDER_MINUTES = int(os.getenv("REMINDER_MINUTES", "30"))
+REMINDER_HORIZON = datetime.timedelta(seconds=int(os.getenv("REMINDER_HORIZON", "3600")))
+REMINDER_CONCURRENCY = int(os.getenv("REMINDER_CONCURRENCY", "20"))
+
+
+class ReminderScheduler:
+    def __init__(self, bot: Bot, minutes: int = REMINDER_MINUTES, horizon: datetime.timedelta = REMINDER_HORIZON):
+        self.bot = bot
+        self.lead = datetime.timedelta(minutes=minutes)
+        self.horizon = horizon
+        self._heap = []
+        self._scheduled = {}  # id встречи -> время актуального напоминания
+        self._loaded_until = None
+        self._wakeup = asyncio.Event()
+        self._semaphore = asyncio.Semaphore(REMINDER_CONCURRENCY)
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._scheduled)
+
+    def schedule(self, appointment: dict, chat_id: int):
+        # Встречи за пределами загруженного окна подхватятся при следующей дозагрузке;
+        # запланированное раньше напоминание (встречу перенесли дальше) отменяем
+        meeting_at = meetings.parse_timestamp(appointment["meeting_date_time"])
+        if self._loaded_until is None or meeting_at >= self._loaded_until:
+            self._scheduled.pop(appointment["id"], None)
+            return
+        self._push(appointment, chat_id)
+        self._wakeup.set()
+
+    def _push(self, appointment: dict, chat_id: int):
+        meeting_at = meetings.parse_timestamp(appointment["meeting_date_time"])
+        # Прошедшие встречи (импорт истории, перенос в прошлое) не напоминаем,
+        # как и _load, окно которого начинается с текущего момента
+        if meeting_at <= datetime.datetime.now(datetime.timezone.utc):
+            self._scheduled.pop(appointment["id"], None)
+            return
+        remind_at = meeting_at - self.lead
+        if self._scheduled.get(appointment["id"]) == remind_at:
+            return
+        self._scheduled[appointment["id"]] = remind_at
+        heapq.heappush(self._heap, (
+            remind_at,
+            appointment["id"],
+            chat_id,
+            appointment["meeting_date_time"],
+            appointment.get("title") or "Встреча"
+        ))
+
+    async def _load(self, until: datetime.datetime):
+        start = self._loaded_until or datetime.datetime.now(datetime.timezone.utc)
+        cursor = None
+        while True:
+            rows = await repository.get_pending_reminders(start.isoformat(), until.isoformat(), cursor)
+            for row in rows:
+                self._push(row, row["clients"]["telegram_id"])
+            if len(rows) < 1000:
+                break
+            cursor = (rows[-1]["meeting_date_time"], rows[-1]["id"])
+        self._loaded_until = until
+
+    async def _send(self, appointment_id: int, chat_id: int, meeting_date_time: str, title: str):
+        async with self._semaphore:
+            try:
+                if not await repository.claim_reminder(appointment_id, meeting_date_time):
+                    return
+                profile = await profiles.get_profile(chat_id)
+                local_dt = profile.to_local(meeting_date_time)
+                await self.bot.send_message(
+                    chat_id,
+                    f"⏰ Напоминание: встреча «{title}» в {local_dt.strftime('%H:%M')} ({local_dt.strftime('%Y-%m-%d')})."
+                )
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось отправить напоминание о встрече {appointment_id}: {e}")
+
+    async def run(self):
+        while True:
+            self._wakeup.clear()
+            now = datetime.datetime.now(datetime.timezone.utc)
+            # Окно дочитываем заранее, когда до его конца осталось меньше половины
+            if self._loaded_until is None or self._loaded_until - now < self.horizon / 2:
+                try:
+                    await self._load(now + self.lead + self.horizon)
+                except Exception as e:
+                    logging.warning(f"⚠️ Не удалось загрузить напоминания: {e}")
+            while self._heap and self._heap[0][0] <= now:
+                remind_at, appointment_id, chat_id, meeting_date_time, title = heapq.heappop(self._heap)
+                if self._scheduled.get(appointment_id) != remind_at:
+                    continue  # встречу перенесли или напоминание отменено
+                del self._scheduled[appointment_id]
+                task = asyncio.create_task(self._send(appointment_id, chat_id, meeting_date_time, title))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+            if self._loaded_until is None:
+                await asyncio.sleep(10)
+                continue
+            next_load = self._loaded_until - self.horizon / 2
+            next_run = min(self._heap[0][0], next_load) if self._heap else next_load
+            timeout = max((next_run - datetime.datetime.now(datetime.timezone.utc)).total_seconds(), 1)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
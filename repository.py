@@ -0,0 +1,441 @@
+import asyncio
+import datetime
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from cachetools import TTLCache
+
+import metrics
+
+# === Асинхронный доступ к Supabase ===
+# Клиент supabase синхронный, поэтому каждый запрос выполняется в отдельном
+# ограниченном пуле потоков, а обработчики aiogram не блокируют event loop.
+# Сам клиент создаётся при первом запросе или заранее в warm_up.
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_TIMEOUT = float(os.getenv("DB_TIMEOUT", "10"))
+CALENDAR_CACHE_SIZE = int(os.getenv("CALENDAR_CACHE_SIZE", "10000"))
+# При нескольких процессах webhook кэш календарей у каждого процесса свой
+# и при записи обновляется только в том процессе, где она произошла: в
+# остальных изменение появится не позже чем через CALENDAR_CACHE_TTL,
+# поэтому по умолчанию TTL тогда короче
+WEBHOOK_PROCESSES = int(os.getenv("WEBHOOK_PROCESSES", "1"))
+CALENDAR_CACHE_TTL = float(os.getenv("CALENDAR_CACHE_TTL", "30" if WEBHOOK_PROCESSES > 1 else "300"))
+APPOINTMENTS_PAGE_SIZE = 10
+
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="supabase")
+_client = None
+_client_factory = None
+_client_lock = threading.Lock()
+
+# Календари пользователя: telegram_id -> список строк settings.
+# Меняются редко, поэтому держим их в памяти и обновляем при записи
+# (в пределах процесса, см. CALENDAR_CACHE_TTL).
+_calendar_cache = TTLCache(maxsize=CALENDAR_CACHE_SIZE, ttl=CALENDAR_CACHE_TTL)
+_calendar_cache_stats = {"hits": 0, "misses": 0}
+
+
+def setup(client_factory):
+    global _client_factory
+    _client_factory = client_factory
+
+
+def _get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = _client_factory()
+    return _client
+
+
+async def warm_up():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _get_client)
+
+
+def _table(name: str):
+    return _get_client().table(name)
+
+
+async def _run(query, timeout: float = DB_TIMEOUT):
+    loop = asyncio.get_running_loop()
+    async with metrics.track("supabase"):
+        result = await asyncio.wait_for(loop.run_in_executor(_executor, query.execute), timeout)
+    return result.data
+
+
+def _after(query, cursor: tuple = None, direction: str = "gt"):
+    # Keyset-условие по (meeting_date_time, id) относительно граничной строки cursor:
+    # "gt" — строки после неё, "ge" — начиная с неё, "lt" — строки перед ней
+    if not cursor:
+        return query
+    meeting_date_time, appointment_id = cursor
+    time_op = "lt" if direction == "lt" else "gt"
+    id_op = {"gt": "gt", "ge": "gte", "lt": "lt"}[direction]
+    return query.or_(
+        f'meeting_date_time.{time_op}."{meeting_date_time}",'
+        f'and(meeting_date_time.eq."{meeting_date_time}",id.{id_op}.{appointment_id})'
+    )
+
+
+# === settings ===
+async def get_calendars(user_id: int) -> list:
+    calendars = _calendar_cache.get(user_id)
+    if calendars is not None:
+        _calendar_cache_stats["hits"] += 1
+        return calendars
+    _calendar_cache_stats["misses"] += 1
+    calendars = await _run(_table("settings").select("*").eq("telegram_id", user_id))
+    _calendar_cache[user_id] = calendars
+    return calendars
+
+
+async def calendar_exists(user_id: int, calendar_id: str) -> bool:
+    calendars = await get_calendars(user_id)
+    return any(c["calendar_id"] == calendar_id for c in calendars)
+
+
+async def add_calendar(user_id: int, calendar_id: str, calendar_name: str) -> dict:
+    rows = await _run(_table("settings").insert({
+        "telegram_id": user_id,
+        "calendar_id": calendar_id,
+        "calendar_name": calendar_name
+    }))
+    calendars = _calendar_cache.get(user_id)
+    if calendars is not None:
+        _calendar_cache[user_id] = calendars + [rows[0]]
+    return rows[0]
+
+
+async def rename_calendar(user_id: int, calendar_id: str, calendar_name: str):
+    try:
+        await _run(_table("settings").update({"calendar_name": calendar_name}).match({
+            "telegram_id": user_id,
+            "calendar_id": calendar_id
+        }))
+    except Exception:
+        _calendar_cache.pop(user_id, None)
+        raise
+    calendars = _calendar_cache.get(user_id)
+    if calendars is not None:
+        _calendar_cache[user_id] = [
+            {**c, "calendar_name": calendar_name} if c["calendar_id"] == calendar_id else c
+            for c in calendars
+        ]
+
+
+async def delete_calendar(user_id: int, calendar_id: str):
+    try:
+        await _run(_table("settings").delete().match({
+            "telegram_id": user_id,
+            "calendar_id": calendar_id
+        }))
+    except Exception:
+        _calendar_cache.pop(user_id, None)
+        raise
+    calendars = _calendar_cache.get(user_id)
+    if calendars is not None:
+        _calendar_cache[user_id] = [c for c in calendars if c["calendar_id"] != calendar_id]
+
+
+async def get_calendars_of_users(user_ids: list) -> list:
+    # Календари сразу многих пользователей (для дайджеста), в обход кэша
+    return await _run(_table("settings").select("telegram_id, calendar_id, calendar_name").in_("telegram_id", user_ids))
+
+
+def calendar_cache_stats() -> dict:
+    return {**_calendar_cache_stats, "size": len(_calendar_cache)}
+
+
+# === appointments ===
+async def create_meeting(user_id: int, name: str, phone: str, title: str, meeting_date_time: str,
+                         calendar_id: str, event_id: str) -> dict:
+    # Клиент, встреча и связь с событием создаются одной транзакцией на сервере
+    # (migrations/002_create_meeting.sql); возвращает {"client", "appointment", "event_id"}
+    return await _run(_get_client().rpc("create_meeting", {
+        "p_telegram_id": user_id,
+        "p_name": name,
+        "p_phone": phone,
+        "p_title": title,
+        "p_meeting_date_time": meeting_date_time,
+        "p_calendar_id": calendar_id,
+        "p_event_id": event_id
+    }))
+
+
+async def import_meetings(user_id: int, name: str, phone: str, meetings: list) -> list:
+    # Пачка встреч и их связей с событиями одним вызовом (migrations/005_import_meetings.sql);
+    # возвращает созданные строки appointments
+    return await _run(_get_client().rpc("import_meetings", {
+        "p_telegram_id": user_id,
+        "p_name": name,
+        "p_phone": phone,
+        "p_meetings": meetings
+    }))
+
+
+async def get_appointment(appointment_id: int):
+    rows = await _run(_table("appointments").select("*").eq("id", appointment_id))
+    return rows[0] if rows else None
+
+
+async def get_upcoming_appointments_page(user_id: int, cursor: tuple = None, direction: str = "gt",
+                                         limit: int = APPOINTMENTS_PAGE_SIZE) -> tuple:
+    # Keyset-пагинация по (meeting_date_time, id): один запрос на страницу,
+    # только будущие встречи. cursor = (meeting_date_time, id) граничной строки,
+    # direction: "gt" — следующая страница, "ge" — с этой строки, "lt" — предыдущая.
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    query = (
+        _table("appointments")
+        .select("*, clients!inner(telegram_id)")
+        .eq("clients.telegram_id", user_id)
+        .gte("meeting_date_time", now)
+    )
+    query = _after(query, cursor, direction)
+    descending = direction == "lt"
+    rows = await _run(
+        query.order("meeting_date_time", desc=descending).order("id", desc=descending).limit(limit + 1)
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if descending:
+        rows.reverse()
+    return rows, has_more
+
+
+async def get_pending_reminders(start: str, end: str, cursor: tuple = None, limit: int = 1000) -> list:
+    # Встречи в окне [start, end) без отправленного напоминания, keyset по (meeting_date_time, id)
+    query = (
+        _table("appointments")
+        .select("id, title, meeting_date_time, clients!inner(telegram_id)")
+        .is_("reminder_sent_at", "null")
+        .gte("meeting_date_time", start)
+        .lt("meeting_date_time", end)
+    )
+    return await _run(_after(query, cursor).order("meeting_date_time").order("id").limit(limit))
+
+
+async def claim_reminder(appointment_id: int, meeting_date_time: str) -> bool:
+    # Помечаем напоминание отправленным до отправки: если встречу удалили,
+    # перенесли или напоминание уже забрал другой процесс, строка не обновится
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    rows = await _run(
+        _table("appointments")
+        .update({"reminder_sent_at": now})
+        .eq("id", appointment_id)
+        .eq("meeting_date_time", meeting_date_time)
+        .is_("reminder_sent_at", "null")
+    )
+    return bool(rows)
+
+
+async def get_appointments_of_users(user_ids: list, start: str, end: str, cursor: tuple = None,
+                                    limit: int = 1000) -> list:
+    # Встречи пачки пользователей в окне [start, end), keyset по (meeting_date_time, id)
+    query = (
+        _table("appointments")
+        .select("id, title, meeting_date_time, calendar_id, client_name, phone_number, clients!inner(telegram_id)")
+        .in_("clients.telegram_id", user_ids)
+        .gte("meeting_date_time", start)
+        .lt("meeting_date_time", end)
+    )
+    return await _run(_after(query, cursor).order("meeting_date_time").order("id").limit(limit))
+
+
+async def get_appointment_with_event(appointment_id: int, user_id: int):
+    # Встреча вместе с event_id одним запросом; чужие встречи не возвращаются
+    rows = await _run(
+        _table("appointments")
+        .select("id, calendar_id, meeting_date_time, calendar_events(event_id), clients!inner(telegram_id)")
+        .eq("id", appointment_id)
+        .eq("clients.telegram_id", user_id)
+    )
+    return rows[0] if rows else None
+
+
+async def get_past_appointments(user_id: int, after_id: int = 0, limit: int = 500) -> list:
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    return await _run(
+        _table("appointments")
+        .select("id, calendar_id, calendar_events(event_id), clients!inner(telegram_id)")
+        .eq("clients.telegram_id", user_id)
+        .lt("meeting_date_time", now)
+        .gt("id", after_id)
+        .order("id")
+        .limit(limit)
+    )
+
+
+async def iter_appointments(user_id: int, chunk: int = 1000):
+    # Все встречи пользователя порциями по chunk строк, keyset по (meeting_date_time, id):
+    # в памяти одновременно только одна порция
+    cursor = None
+    while True:
+        query = (
+            _table("appointments")
+            .select("id, title, meeting_date_time, phone_number, client_name, clients!inner(telegram_id, name)")
+            .eq("clients.telegram_id", user_id)
+        )
+        rows = await _run(_after(query, cursor).order("meeting_date_time").order("id").limit(chunk))
+        if not rows:
+            return
+        yield rows
+        if len(rows) < chunk:
+            return
+        cursor = (rows[-1]["meeting_date_time"], rows[-1]["id"])
+
+
+async def search_appointments(user_id: int, filters: dict, cursor: tuple = None,
+                              limit: int = APPOINTMENTS_PAGE_SIZE) -> tuple:
+    # Поиск целиком выполняется в базе (migrations/007_appointment_search.sql);
+    # filters — ключи words, name, phone, title, calendar_id, start, end.
+    # Keyset по (meeting_date_time, id): cursor — последняя строка предыдущей страницы
+    params = {
+        "p_telegram_id": user_id,
+        "p_words": filters.get("words") or [],
+        "p_name": filters.get("name"),
+        "p_phone": filters.get("phone"),
+        "p_title": filters.get("title"),
+        "p_calendar_id": filters.get("calendar_id"),
+        "p_from": filters.get("start"),
+        "p_to": filters.get("end"),
+        "p_limit": limit + 1
+    }
+    if cursor:
+        params["p_after_time"], params["p_after_id"] = cursor
+    rows = await _run(_get_client().rpc("search_appointments", params))
+    return rows[:limit], len(rows) > limit
+
+
+async def delete_appointments(appointment_ids: list):
+    # calendar_events удаляются каскадом (migrations/003_cascade_calendar_events.sql)
+    await _run(_table("appointments").delete().in_("id", appointment_ids))
+
+
+async def update_appointment(appointment_id: int, fields: dict):
+    if "meeting_date_time" in fields:
+        # О перенесённой встрече нужно напомнить заново
+        fields = {**fields, "reminder_sent_at": None}
+    await _run(_table("appointments").update(fields).eq("id", appointment_id))
+
+
+async def get_appointments_by_event_ids(event_ids: list) -> dict:
+    # event_id -> встреча (с telegram_id владельца) для изменений, пришедших из Google
+    rows = await _run(
+        _table("calendar_events")
+        .select("event_id, appointments(id, title, meeting_date_time, clients(telegram_id))")
+        .in_("event_id", event_ids)
+    )
+    return {row["event_id"]: row["appointments"] for row in rows if row["appointments"]}
+
+
+# === calendar_sync ===
+async def list_synced_calendar_ids() -> list:
+    calendar_ids = set()
+    start = 0
+    while True:
+        rows = await _run(_table("settings").select("calendar_id").order("calendar_id").range(start, start + 999))
+        calendar_ids.update(row["calendar_id"] for row in rows)
+        if len(rows) < 1000:
+            return sorted(calendar_ids)
+        start += 1000
+
+
+async def get_sync_state(calendar_id: str):
+    rows = await _run(_table("calendar_sync").select("*").eq("calendar_id", calendar_id))
+    return rows[0] if rows else None
+
+
+async def get_sync_state_by_channel(channel_id: str):
+    rows = await _run(_table("calendar_sync").select("*").eq("channel_id", channel_id))
+    return rows[0] if rows else None
+
+
+async def save_sync_state(calendar_id: str, fields: dict):
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    await _run(_table("calendar_sync").upsert({"calendar_id": calendar_id, **fields, "updated_at": now}))
+
+
+# === user_profiles ===
+async def get_profile(user_id: int):
+    rows = await _run(_table("user_profiles").select("*").eq("telegram_id", user_id))
+    return rows[0] if rows else None
+
+
+async def save_profile(user_id: int, fields: dict) -> dict:
+    # Поля, которых нет в fields, у новой строки получают значения по умолчанию
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    rows = await _run(_table("user_profiles").upsert({"telegram_id": user_id, **fields, "updated_at": now}))
+    return rows[0]
+
+
+async def get_digest_subscribers(after_id: int = 0, limit: int = 500) -> list:
+    return await _run(
+        _table("user_profiles")
+        .select("*")
+        .eq("digest_enabled", True)
+        .gt("telegram_id", after_id)
+        .order("telegram_id")
+        .limit(limit)
+    )
+
+
+async def claim_digests(user_ids: list, day: str) -> list:
+    # Отмечаем дайджест за day отправленным; возвращает telegram_id, которые
+    # ещё не получили его (остальных уже обработал другой процесс)
+    rows = await _run(
+        _table("user_profiles")
+        .update({"digest_sent_on": day})
+        .in_("telegram_id", user_ids)
+        .eq("digest_enabled", True)
+        .or_(f"digest_sent_on.is.null,digest_sent_on.lt.{day}")
+    )
+    return [row["telegram_id"] for row in rows]
+
+
+# === outbox ===
+async def enqueue_outbox(kind: str, idempotency_key: str, payload: dict) -> bool:
+    # False, если задача с таким ключом уже записана (повторная доставка апдейта)
+    rows = await _run(_table("outbox").upsert(
+        {"idempotency_key": idempotency_key, "kind": kind, "payload": payload},
+        on_conflict="idempotency_key", ignore_duplicates=True
+    ))
+    return bool(rows)
+
+
+async def claim_outbox(limit: int, lease_seconds: int) -> list:
+    # Готовые к выполнению задачи, взятые в аренду (migrations/009_outbox.sql)
+    return await _run(_get_client().rpc("claim_outbox", {"p_limit": limit, "p_lease_seconds": lease_seconds}))
+
+
+async def complete_outbox(job_id: int):
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    await _run(_table("outbox").update({"status": "done", "locked_until": None, "updated_at": now}).eq("id", job_id))
+
+
+async def checkpoint_outbox(job_id: int, attempts: int, payload: dict, lease_seconds: int) -> bool:
+    # Промежуточный результат задачи и продление аренды. False — аренда уже
+    # истекла и задачу забрала следующая попытка (attempts вырос)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    rows = await _run(_table("outbox").update({
+        "payload": payload,
+        "locked_until": (now + datetime.timedelta(seconds=lease_seconds)).isoformat(),
+        "updated_at": now.isoformat()
+    }).eq("id", job_id).eq("attempts", attempts).eq("status", "pending"))
+    return bool(rows)
+
+
+async def retry_outbox(job_id: int, next_attempt_at: str, error: str):
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    await _run(_table("outbox").update({
+        "next_attempt_at": next_attempt_at, "locked_until": None, "last_error": error, "updated_at": now
+    }).eq("id", job_id))
+
+
+async def dead_letter_outbox(job_id: int, error: str):
+    now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+    await _run(_table("outbox").update({
+        "status": "dead", "locked_until": None, "last_error": error, "updated_at": now
+    }).eq("id", job_id))
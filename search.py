@@ -0,0 +1,163 @@
+import datetime
+import hashlib
+import json
+import os
+import re
+import shlex
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from cachetools import TTLCache
+
+import profiles
+import repository
+
+# === Поиск встреч ===
+# /search разбирает запрос в фильтры, а отбор, сортировку и пагинацию делает
+# база (repository.search_appointments, migrations/007_appointment_search.sql).
+# Запрос запоминается под коротким токеном — он помещается в callback_data
+# кнопок листания. Сам запрос и курсоры страниц лежат в хранилище FSM (setup),
+# поэтому при FSM_STORAGE=redis листать можно в любом процессе webhook; живут
+# они FSM_TTL. Страницы результатов держатся в памяти процесса
+# SEARCH_CACHE_TTL секунд. Повторный поиск с теми же фильтрами получает тот же
+# токен и те же страницы. Изменения встреч пользователя сбрасывают его
+# страницы (invalidate) в этом процессе, в остальных они устареют не позже
+# чем через SEARCH_CACHE_TTL.
+
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+DATE_FORMAT = "%d.%m.%Y"
+FIELDS = {
+    "имя": "name", "клиент": "name",
+    "тел": "phone", "телефон": "phone",
+    "название": "title",
+    "календарь": "calendar",
+    "с": "start", "по": "end"
+}
+PERIODS = ("сегодня", "завтра", "неделя", "след.неделя", "месяц", "всё", "все")
+PHONE_WORD = re.compile(r"\+?[\d()\-]*\d{3}[\d()\-]*")
+PHONE_RUN = re.compile(r"\+?\d[\d\s()\-]{5,}\d")  # телефон, записанный с пробелами
+
+_storage: BaseStorage = MemoryStorage()  # запросы и курсоры страниц, см. setup
+_bot_id = 0
+_pages = TTLCache(maxsize=10_000, ttl=SEARCH_CACHE_TTL)  # (telegram_id, токен, страница) -> (строки, есть ли ещё)
+
+
+def setup(storage: BaseStorage, bot_id: int):
+    global _storage, _bot_id
+    _storage, _bot_id = storage, bot_id
+
+
+def _key(user_id: int, token: str) -> StorageKey:
+    return StorageKey(bot_id=_bot_id, chat_id=user_id, user_id=user_id, destiny=f"search:{token}")
+
+
+def _digits(value: str) -> str:
+    return re.sub(r"\D", "", value)
+
+
+def _parse_date(value: str, profile: profiles.Profile) -> datetime.datetime:
+    try:
+        day = datetime.datetime.strptime(value, DATE_FORMAT)
+    except ValueError:
+        raise ValueError(f"Дата «{value}» должна быть в формате ДД.ММ.ГГГГ.")
+    return profile.localize(day)
+
+
+def _period(name: str, today: datetime.datetime) -> tuple:
+    # Начало и конец периода в часовом поясе пользователя; today — полночь сегодня
+    day = datetime.timedelta(days=1)
+    if name == "сегодня":
+        return today, today + day
+    if name == "завтра":
+        return today + day, today + 2 * day
+    if name == "неделя":
+        return today, today + 7 * day
+    if name == "след.неделя":
+        monday = today + (7 - today.weekday()) * day
+        return monday, monday + 7 * day
+    if name == "месяц":
+        return today, today + 30 * day
+    return None, None
+
+
+def parse_query(text: str, profile: profiles.Profile, calendars: list) -> dict:
+    # ValueError с текстом для пользователя, если запрос не разобрать
+    try:
+        tokens = shlex.split(PHONE_RUN.sub(lambda m: re.sub(r"\s", "", m.group()), text))
+    except ValueError:
+        raise ValueError("Не закрыта кавычка в запросе.")
+    if not tokens:
+        raise ValueError("Пустой запрос.")
+    filters = {"words": []}
+    today = profile.localize(datetime.datetime.combine(datetime.datetime.now(profile.tz).date(), datetime.time()))
+    start, end = today, None
+    for token in tokens:
+        key, sep, value = token.partition(":")
+        field = FIELDS.get(key.lower()) if sep else None
+        if field and not value:
+            raise ValueError(f"Не указано значение для «{key}:».")
+        if field == "calendar":
+            calendar = next((c for c in calendars if c["calendar_name"].lower() == value.lower()), None)
+            if calendar is None:
+                raise ValueError(f"Календарь «{value}» не найден.")
+            filters["calendar_id"] = calendar["calendar_id"]
+        elif field == "start":
+            start = _parse_date(value, profile)
+        elif field == "end":
+            end = _parse_date(value, profile) + datetime.timedelta(days=1)
+        elif field == "phone":
+            if not _digits(value):
+                raise ValueError("В телефоне должны быть цифры.")
+            filters["phone"] = _digits(value)
+        elif field:
+            filters[field] = value
+        elif token.lower() in PERIODS:
+            start, end = _period(token.lower(), today)
+        elif PHONE_WORD.fullmatch(token):
+            filters["phone"] = _digits(token)
+        else:
+            filters["words"].append(token)
+    if start and end and start >= end:
+        raise ValueError("Начало периода позже его конца.")
+    # По умолчанию ищем с сегодняшнего дня; в ключе кэша только UTC-время
+    if start:
+        filters["start"] = start.astimezone(datetime.timezone.utc).isoformat()
+    if end:
+        filters["end"] = end.astimezone(datetime.timezone.utc).isoformat()
+    return filters
+
+
+async def create(user_id: int, text: str, filters: dict) -> str:
+    key = json.dumps([user_id, filters], sort_keys=True, ensure_ascii=False)
+    token = hashlib.blake2b(key.encode("utf-8"), digest_size=6).hexdigest()
+    if not await _storage.get_data(_key(user_id, token)):
+        await _storage.set_data(_key(user_id, token), {"text": text, "filters": filters, "cursors": [None]})
+    return token
+
+
+async def get_page(user_id: int, token: str, page: int):
+    # (текст запроса, строки, есть ли ещё) или None, если запрос уже забыт.
+    # Запрос хранится под ключом пользователя: чужой токен ничего не найдёт
+    query = await _storage.get_data(_key(user_id, token))
+    if not query or not 0 <= page < len(query["cursors"]):
+        return None
+    key = (user_id, token, page)
+    cached = _pages.get(key)
+    if cached is None:
+        cursor = query["cursors"][page]  # в хранилище — JSON, кортеж стал списком
+        rows, has_more = await repository.search_appointments(
+            user_id, query["filters"], tuple(cursor) if cursor else None
+        )
+        cached = _pages[key] = (rows, has_more)
+        # Границы следующих страниц могли сдвинуться — запоминаем заново
+        cursors = query["cursors"][:page + 1]
+        if has_more:
+            cursors.append([rows[-1]["meeting_date_time"], rows[-1]["id"]])
+        if cursors != query["cursors"]:
+            await _storage.set_data(_key(user_id, token), {**query, "cursors": cursors})
+    return query["text"], cached[0], cached[1]
+
+
+def invalidate(user_id: int):
+    for key in [key for key in _pages if key[0] == user_id]:
+        _pages.pop(key, None)
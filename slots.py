@@ -0,0 +1,156 @@
+import bisect
+import datetime
+import heapq
+import os
+
+from cachetools import TTLCache
+
+import calendar_gateway
+import meetings
+import profiles
+
+# === Свободное время в календаре ===
+# Занятые интервалы календаря один раз запрашиваются через freebusy().query
+# на SLOTS_HORIZON_DAYS вперёд и хранятся отсортированными. События, которые
+# создаёт или удаляет сам бот, сразу добавляются в кэш и убираются из него,
+# поэтому подбор слотов — локальный проход по списку с bisect.
+# Изменения, сделанные в Google вручную, подтягиваются по истечении SLOTS_CACHE_TTL.
+
+SLOTS_HORIZON_DAYS = int(os.getenv("SLOTS_HORIZON_DAYS", "7"))
+SLOTS_CACHE_TTL = float(os.getenv("SLOTS_CACHE_TTL", "300"))
+SLOTS_DAY_START = int(os.getenv("SLOTS_DAY_START", "9"))  # рабочие часы в часовом поясе пользователя
+SLOTS_DAY_END = int(os.getenv("SLOTS_DAY_END", "19"))
+SLOTS_COUNT = 6
+SLOT_STEP = datetime.timedelta(hours=1)
+
+
+class BusyIntervals:
+    def __init__(self, start: datetime.datetime, end: datetime.datetime):
+        # Период [start, end), за который известна занятость
+        self.start = start
+        self.end = end
+        self._intervals = []  # отсортированные (начало, конец), возможны пересечения
+        self._merged = None
+
+    def add(self, start: datetime.datetime, end: datetime.datetime):
+        bisect.insort(self._intervals, (start, end))
+        self._merged = None
+
+    def remove(self, start: datetime.datetime, end: datetime.datetime):
+        # Убирается только точно такой же интервал: если freebusy уже слил событие
+        # с соседними, время остаётся занятым до следующего запроса
+        i = bisect.bisect_left(self._intervals, (start, end))
+        if i < len(self._intervals) and self._intervals[i] == (start, end):
+            del self._intervals[i]
+            self._merged = None
+
+    def intervals(self) -> list:
+        return self._intervals
+
+    def merged(self) -> tuple:
+        if self._merged is None:
+            self._merged = _merge(self._intervals)
+        return self._merged
+
+
+def _merge(intervals) -> tuple:
+    # Отсортированные интервалы -> непересекающиеся (starts, ends) для bisect
+    starts, ends = [], []
+    for start, end in intervals:
+        if ends and start <= ends[-1]:
+            ends[-1] = max(ends[-1], end)
+        else:
+            starts.append(start)
+            ends.append(end)
+    return starts, ends
+
+
+_cache = TTLCache(maxsize=10_000, ttl=SLOTS_CACHE_TTL)
+
+
+async def _fetch(calendar_ids: list, start: datetime.datetime, end: datetime.datetime):
+    body = {
+        "timeMin": start.isoformat(),
+        "timeMax": end.isoformat(),
+        "items": [{"id": calendar_id} for calendar_id in calendar_ids]
+    }
+    response = await calendar_gateway.call(lambda service: service.freebusy().query(body=body).execute())
+    for calendar_id in calendar_ids:
+        info = response.get("calendars", {}).get(calendar_id, {})
+        if info.get("errors"):
+            raise RuntimeError(f"нет доступа к календарю {calendar_id}: {info['errors'][0].get('reason')}")
+        busy = BusyIntervals(start, end)
+        for interval in info.get("busy", []):
+            busy.add(*(
+                meetings.parse_timestamp(interval[key]).astimezone(datetime.timezone.utc) for key in ("start", "end")
+            ))
+        _cache[calendar_id] = busy
+
+
+async def get_busy(calendar_ids: list, start: datetime.datetime, end: datetime.datetime) -> list:
+    missing = [
+        calendar_id for calendar_id in calendar_ids
+        if calendar_id not in _cache or _cache[calendar_id].start > start or _cache[calendar_id].end < end
+    ]
+    if missing:
+        # Берём с запасом в сутки, чтобы кэш не устаревал из-за сдвига "сейчас"
+        await _fetch(missing, start, end + datetime.timedelta(days=1))
+    return [_cache[calendar_id] for calendar_id in calendar_ids]
+
+
+def add_busy(calendar_id: str, start: datetime.datetime, duration: datetime.timedelta):
+    busy = _cache.get(calendar_id)
+    if busy is not None:
+        start = start.astimezone(datetime.timezone.utc)
+        busy.add(start, start + duration)
+
+
+def remove_busy(calendar_id: str, start: datetime.datetime, duration: datetime.timedelta):
+    busy = _cache.get(calendar_id)
+    if busy is not None:
+        start = start.astimezone(datetime.timezone.utc)
+        busy.remove(start, start + duration)
+
+
+def _ceil_hour(dt: datetime.datetime) -> datetime.datetime:
+    floored = dt.replace(minute=0, second=0, microsecond=0)
+    return floored if floored == dt else floored + SLOT_STEP
+
+
+def find_free_slots(starts: list, ends: list, begin: datetime.datetime, end: datetime.datetime,
+                    tz, duration: datetime.timedelta, limit: int = SLOTS_COUNT) -> list:
+    # Начала свободных слотов по сетке в час, только в рабочие часы
+    slots = []
+    candidate = _ceil_hour(begin.astimezone(datetime.timezone.utc))
+    while candidate + duration <= end and len(slots) < limit:
+        local = candidate.astimezone(tz)
+        day = local.date()
+        if local.hour < SLOTS_DAY_START:
+            candidate = tz.localize(datetime.datetime.combine(day, datetime.time(SLOTS_DAY_START)))
+            continue
+        if local + duration > tz.localize(datetime.datetime.combine(day, datetime.time(SLOTS_DAY_END))):
+            next_day = day + datetime.timedelta(days=1)
+            candidate = tz.localize(datetime.datetime.combine(next_day, datetime.time(SLOTS_DAY_START)))
+            continue
+        candidate = candidate.astimezone(datetime.timezone.utc)
+        i = bisect.bisect_right(starts, candidate) - 1
+        if i >= 0 and ends[i] > candidate:
+            candidate = _ceil_hour(ends[i])
+            continue
+        if i + 1 < len(starts) and starts[i + 1] < candidate + duration:
+            candidate = _ceil_hour(ends[i + 1])
+            continue
+        slots.append(candidate.astimezone(tz))
+        candidate += SLOT_STEP
+    return slots
+
+
+async def get_free_slots(calendar_ids: list, profile: profiles.Profile, limit: int = SLOTS_COUNT) -> list:
+    now = datetime.datetime.now(datetime.timezone.utc)
+    end = now + datetime.timedelta(days=SLOTS_HORIZON_DAYS)
+    calendars = await get_busy(calendar_ids, now, end)
+    if len(calendars) == 1:
+        starts, ends = calendars[0].merged()
+    else:
+        starts, ends = _merge(heapq.merge(*(busy.intervals() for busy in calendars)))
+    return find_free_slots(starts, ends, now, end, profile.tz, profile.duration, limit)
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, DefaultKeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage, SimpleEventIsolation
+
+# === Хранилище FSM ===
+# FSM_STORAGE=sqlite (по умолчанию) переживает перезапуск одного процесса,
+# FSM_STORAGE=redis позволяет нескольким процессам обслуживать одного бота,
+# FSM_STORAGE=memory — прежнее поведение.
+
+FSM_STORAGE = os.getenv("FSM_STORAGE", "sqlite")
+FSM_TTL = int(os.getenv("FSM_TTL", "86400"))  # брошенные диалоги живут сутки
+FSM_SQLITE_PATH = os.getenv("FSM_SQLITE_PATH", "fsm.sqlite3")
+FSM_SWEEP_INTERVAL = float(os.getenv("FSM_SWEEP_INTERVAL", "600"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+
+class SQLiteStorage(BaseStorage):
+    # Все обращения к sqlite3 выполняются в отдельном потоке (по одному на
+    # процесс), чтобы диск не блокировал event loop; один поток заодно
+    # упорядочивает чтение-изменение-запись без блокировок
+    def __init__(self, path: str = FSM_SQLITE_PATH, ttl: int = FSM_TTL):
+        self.ttl = ttl
+        self.path = path
+        self._key_builder = DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self._connection = None
+        self._executor = None
+        self._pid = None
+
+    def _check_process(self):
+        # Соединение и поток создаются лениво и заново в каждом процессе (webhook-воркеры)
+        if self._pid != os.getpid():
+            self._connection = None
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fsm-sqlite")
+            self._pid = os.getpid()
+
+    @property
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            # В режиме WAL NORMAL не рискует целостностью базы, а fsync на каждую запись не нужен
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS fsm ("
+                "key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}', updated_at REAL NOT NULL)"
+            )
+        return self._connection
+
+    async def _call(self, fn, *args):
+        self._check_process()
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _row(self, key: StorageKey):
+        row = self._db.execute(
+            "SELECT state, data, updated_at FROM fsm WHERE key = ?", (self._key_builder.build(key),)
+        ).fetchone()
+        if row is None or row[2] < time.time() - self.ttl:
+            return None, "{}"
+        return row[0], row[1]
+
+    def _write(self, key: StorageKey, state: Optional[str], data: str):
+        db_key = self._key_builder.build(key)
+        if state is None and data == "{}":
+            self._db.execute("DELETE FROM fsm WHERE key = ?", (db_key,))
+            return
+        self._db.execute(
+            "INSERT INTO fsm (key, state, data, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, "
+            "updated_at = excluded.updated_at",
+            (db_key, state, data, time.time())
+        )
+
+    def _set_state(self, key: StorageKey, state: Optional[str]):
+        _, data = self._row(key)
+        self._write(key, state, data)
+
+    def _set_data(self, key: StorageKey, data: str):
+        state, _ = self._row(key)
+        self._write(key, state, data)
+
+    def _sweep(self) -> int:
+        return self._db.execute("DELETE FROM fsm WHERE updated_at < ?", (time.time() - self.ttl,)).rowcount
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._call(self._set_state, key, state.state if isinstance(state, State) else state)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _ = await self._call(self._row, key)
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        await self._call(self._set_data, key, json.dumps(dict(data), ensure_ascii=False))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data = await self._call(self._row, key)
+        return json.loads(data)
+
+    async def sweep(self) -> int:
+        return await self._call(self._sweep)
+
+    async def close(self) -> None:
+        if self._pid != os.getpid():
+            return
+        if self._connection is not None:
+            await self._call(self._connection.close)
+            self._connection = None
+        self._executor.shutdown(wait=False)
+        self._pid = None
+
+
+def create_redis_storage(redis) -> BaseStorage:
+    # destiny в ключе нужен не только диалогам: /search хранит запросы под
+    # destiny "search:<токен>" (search.py). Блокировка пользователя
+    # (create_isolation) берёт тот же построитель ключей
+    from aiogram.fsm.storage.redis import RedisStorage
+    return RedisStorage(
+        redis, key_builder=DefaultKeyBuilder(with_destiny=True), state_ttl=FSM_TTL, data_ttl=FSM_TTL
+    )
+
+
+def create_storage() -> BaseStorage:
+    if FSM_STORAGE == "redis":
+        from redis.asyncio import Redis
+        return create_redis_storage(Redis.from_url(REDIS_URL))
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    return SQLiteStorage()
+
+
+def create_events_isolation(storage: BaseStorage) -> BaseEventIsolation:
+    # Апдейты одного пользователя обрабатываются по очереди; в Redis блокировка
+    # общая для всех процессов бота
+    if FSM_STORAGE == "redis":
+        return storage.create_isolation()
+    return SimpleEventIsolation()
+
+
+async def run_sweeper(storage: BaseStorage):
+    # Redis удаляет просроченные ключи сам, MemoryStorage не умеет TTL
+    if not isinstance(storage, SQLiteStorage):
+        return
+    while True:
+        removed = await storage.sweep()
+        if removed:
+            logging.info(f"FSM: удалено брошенных диалогов: {removed}")
+        await asyncio.sleep(FSM_SWEEP_INTERVAL)
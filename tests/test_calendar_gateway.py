@@ -0,0 +1,31 @@
+import json
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+import calendar_gateway
+
+
+def _http_error(status: int, reason: str, message: str) -> HttpError:
+    content = {"error": {"code": status, "message": message, "errors": [{"reason": reason, "message": message}]}}
+    return HttpError(httplib2.Response({"status": status}), json.dumps(content).encode(), uri="https://www.googleapis.com")
+
+
+@pytest.mark.parametrize("status, reason, message, permission_denied", [
+    (403, "requiredAccessLevel", "You need to have writer access to this calendar.", True),
+    (403, "forbidden", "Forbidden", True),
+    (403, "rateLimitExceeded", "Rate Limit Exceeded", False),
+    (403, "userRateLimitExceeded", "User Rate Limit Exceeded", False),
+    (404, "notFound", "Not Found", False),
+])
+def test_wrap_error_keeps_reason(status, reason, message, permission_denied):
+    error = calendar_gateway._wrap_error(_http_error(status, reason, message))
+
+    assert isinstance(error, calendar_gateway.CalendarError)
+    assert (error.status, error.reason, error.permission_denied) == (status, reason, permission_denied)
+
+
+def test_wrap_error_passes_other_errors():
+    error = TimeoutError()
+    assert calendar_gateway._wrap_error(error) is error
@@ -0,0 +1,220 @@
+import asyncio
+import datetime
+
+import pytest
+
+import calendar_gateway
+import calendar_sync
+import meetings
+import repository
+
+
+class FakeHttpError(Exception):
+    # Как googleapiclient.errors.HttpError: статус в resp.status
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.resp = type("Resp", (), {"status": status})()
+
+
+class FakeRequest:
+    def __init__(self, fn):
+        self._fn = fn
+
+    def execute(self):
+        return self._fn()
+
+
+class FakeEvents:
+    def __init__(self, service):
+        self._service = service
+
+    def list(self, **params):
+        self._service.list_calls.append(params)
+
+        def execute():
+            token = params.get("syncToken")
+            if token in self._service.expired_tokens:
+                raise FakeHttpError(410)
+            pages = self._service.changes.get(token, [[]])
+            index = int(params["pageToken"]) if params.get("pageToken") else 0
+            response = {"items": pages[index]}
+            if index + 1 < len(pages):
+                response["nextPageToken"] = str(index + 1)
+            else:
+                response["nextSyncToken"] = self._service.next_token
+            return response
+
+        return FakeRequest(execute)
+
+    def watch(self, calendarId, body):
+        self._service.watch_calls.append((calendarId, body))
+        expiration = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(days=7)
+        return FakeRequest(lambda: {
+            "id": body["id"],
+            "resourceId": f"resource-{calendarId}",
+            "expiration": str(int(expiration.timestamp() * 1000))
+        })
+
+
+class FakeCalendarService:
+    # Изменения по syncToken (None — первичная синхронизация) списком страниц
+    def __init__(self):
+        self.changes = {}
+        self.expired_tokens = set()
+        self.next_token = "token-2"
+        self.list_calls = []
+        self.watch_calls = []
+
+    def events(self):
+        return FakeEvents(self)
+
+
+class FakeRepository:
+    def __init__(self):
+        self.sync_state = {}
+        self.appointments = {}  # event_id -> встреча
+        self.deleted = []
+        self.updated = []
+
+    async def get_sync_state(self, calendar_id):
+        state = self.sync_state.get(calendar_id)
+        return {"calendar_id": calendar_id, **state} if state else None
+
+    async def save_sync_state(self, calendar_id, fields):
+        self.sync_state.setdefault(calendar_id, {}).update(fields)
+
+    async def get_appointments_by_event_ids(self, event_ids):
+        return {event_id: self.appointments[event_id] for event_id in event_ids if event_id in self.appointments}
+
+    async def delete_appointments(self, appointment_ids):
+        self.deleted.extend(appointment_ids)
+
+    async def update_appointment(self, appointment_id, fields):
+        self.updated.append((appointment_id, fields))
+
+
+@pytest.fixture
+def service(mocker):
+    fake = FakeCalendarService()
+    mocker.patch("calendar_gateway._service", return_value=fake)
+    return fake
+
+
+@pytest.fixture
+def db(monkeypatch):
+    fake = FakeRepository()
+    for name in ("get_sync_state", "save_sync_state", "get_appointments_by_event_ids",
+                 "delete_appointments", "update_appointment"):
+        monkeypatch.setattr(repository, name, getattr(fake, name))
+    fake.appointments = {
+        "ev-moved": {"id": 1, "title": "Встреча", "meeting_date_time": "2030-01-10T10:00:00+00:00",
+                     "clients": {"telegram_id": 100}},
+        "ev-renamed": {"id": 2, "title": "Встреча", "meeting_date_time": "2030-01-11T10:00:00+00:00",
+                       "clients": {"telegram_id": 100}},
+        "ev-cancelled": {"id": 3, "title": "Встреча", "meeting_date_time": "2030-01-12T10:00:00+00:00",
+                         "clients": {"telegram_id": 200}},
+    }
+    return fake
+
+
+CHANGES = [
+    {"id": "ev-moved", "status": "confirmed", "summary": "Встреча", "start": {"dateTime": "2030-01-10T12:00:00Z"}},
+    {"id": "ev-renamed", "status": "confirmed", "summary": "Созвон", "start": {"dateTime": "2030-01-11T13:00:00+03:00"}},
+    {"id": "ev-cancelled", "status": "cancelled"},
+    {"id": "ev-foreign", "status": "confirmed", "summary": "Чужое событие", "start": {"dateTime": "2030-01-10T09:00:00Z"}},
+]
+
+
+def test_apply_changes(db):
+    moved = []
+    sync = calendar_sync.CalendarSync(on_moved=lambda appointment, telegram_id: moved.append((appointment, telegram_id)))
+
+    applied = asyncio.run(sync.apply_changes(CHANGES))
+
+    assert applied == 3
+    assert db.deleted == [3]
+    assert sorted(db.updated) == [
+        (1, {"meeting_date_time": "2030-01-10T12:00:00+00:00"}),
+        (2, {"title": "Созвон"}),
+    ]
+    # Напоминание переносится только для встречи, у которой изменилось время
+    assert [(appointment["id"], appointment["meeting_date_time"], telegram_id) for appointment, telegram_id in moved] == [
+        (1, "2030-01-10T12:00:00+00:00", 100)
+    ]
+
+
+def test_sync_with_token_applies_changes(db, service):
+    db.sync_state["cal"] = {"sync_token": "token-1"}
+    service.changes["token-1"] = [CHANGES[:2], CHANGES[2:]]
+
+    applied = asyncio.run(calendar_sync.CalendarSync().sync_calendar("cal"))
+
+    assert applied == 3
+    assert [call.get("pageToken") for call in service.list_calls] == [None, "1"]
+    assert all(call["syncToken"] == "token-1" and call["showDeleted"] for call in service.list_calls)
+    assert db.sync_state["cal"]["sync_token"] == "token-2"
+
+
+def test_first_sync_only_stores_token(db, service):
+    service.changes[None] = [CHANGES]
+
+    applied = asyncio.run(calendar_sync.CalendarSync().sync_calendar("cal"))
+
+    assert applied == 0
+    assert "syncToken" not in service.list_calls[0] and "timeMin" in service.list_calls[0]
+    assert db.deleted == [] and db.updated == []
+    assert db.sync_state["cal"]["sync_token"] == "token-2"
+
+
+def test_expired_token_triggers_full_resync(db, service):
+    db.sync_state["cal"] = {"sync_token": "token-1"}
+    service.expired_tokens.add("token-1")
+    service.changes[None] = [CHANGES[:1]]
+
+    applied = asyncio.run(calendar_sync.CalendarSync().sync_calendar("cal"))
+
+    # После 410 полный список будущих событий применяется как изменения
+    assert applied == 1
+    assert service.list_calls[0]["syncToken"] == "token-1"
+    assert "syncToken" not in service.list_calls[1] and "timeMin" in service.list_calls[1]
+    assert db.updated == [(1, {"meeting_date_time": "2030-01-10T12:00:00+00:00"})]
+    assert db.sync_state["cal"]["sync_token"] == "token-2"
+
+
+def test_other_errors_are_raised(db, service):
+    db.sync_state["cal"] = {"sync_token": "token-1"}
+    service.expired_tokens.add("token-1")
+
+    def forbidden(params):
+        raise FakeHttpError(403)
+
+    service.events = lambda: type("Events", (), {"list": lambda self, **params: FakeRequest(lambda: forbidden(params))})()
+
+    with pytest.raises(calendar_gateway.CalendarError) as error:
+        asyncio.run(calendar_sync.CalendarSync().sync_calendar("cal"))
+    assert error.value.status == 403
+    assert db.sync_state["cal"] == {"sync_token": "token-1"}
+
+
+def test_channel_renewed_before_expiration(db, service, monkeypatch):
+    monkeypatch.setattr(calendar_sync, "PUSH_URL", "https://bot.example.com/calendar/notifications")
+    monkeypatch.setattr(calendar_sync, "PUSH_TOKEN", "secret")
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db.sync_state["fresh"] = {"channel_id": "old-fresh", "channel_expiration": (now + datetime.timedelta(hours=5)).isoformat()}
+    db.sync_state["expiring"] = {"channel_id": "old-expiring", "channel_expiration": (now + datetime.timedelta(minutes=30)).isoformat()}
+
+    async def scenario():
+        sync = calendar_sync.CalendarSync()
+        for calendar_id in ("fresh", "expiring", "new"):
+            await sync._ensure_channel(calendar_id)
+
+    asyncio.run(scenario())
+
+    assert [calendar_id for calendar_id, _ in service.watch_calls] == ["expiring", "new"]
+    assert all(body["address"] == calendar_sync.PUSH_URL and body["token"] == "secret" for _, body in service.watch_calls)
+    assert db.sync_state["fresh"]["channel_id"] == "old-fresh"
+    for calendar_id, body in service.watch_calls:
+        state = db.sync_state[calendar_id]
+        assert state["channel_id"] == body["id"]
+        assert state["resource_id"] == f"resource-{calendar_id}"
+        assert meetings.parse_timestamp(state["channel_expiration"]) - now > datetime.timedelta(days=6)
@@ -0,0 +1,162 @@
+import asyncio
+import socket
+from email.message import EmailMessage
+
+import aiosmtplib
+import pytest
+from aiosmtpd.controller import Controller
+
+import mailer
+
+
+class Handler:
+    # Локальный SMTP-сервер: запоминает доставленные письма, отклоняет адреса на bad-
+    # и может оборвать соединение на следующих drop передачах DATA
+    def __init__(self):
+        self.envelopes = []
+        self.drop = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith("bad"):
+            return "550 No such user"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.drop:
+            self.drop -= 1
+            server.transport.close()
+            return "421 Closing"
+        self.envelopes.append(list(envelope.rcpt_tos))
+        return "250 Message accepted"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def server(monkeypatch):
+    handler = Handler()
+    controller = Controller(handler, hostname="127.0.0.1", port=_free_port())
+    controller.start()
+    monkeypatch.setattr(mailer, "SMTP_HOST", "127.0.0.1")
+    monkeypatch.setattr(mailer, "SMTP_PORT", controller.port)
+    monkeypatch.setattr(mailer, "SMTP_START_TLS", False)
+    monkeypatch.setattr(mailer, "SMTP_RETRY_DELAY", 0.05)
+    monkeypatch.delenv("SMTP_EMAIL", raising=False)
+    monkeypatch.delenv("SMTP_PASSWORD", raising=False)
+    yield handler
+    controller.stop()
+
+
+def _message() -> EmailMessage:
+    msg = EmailMessage()
+    msg["From"] = "bot@example.com"
+    msg["To"] = "guest@example.com"
+    msg["Subject"] = "Приглашение"
+    msg.set_content("Ждём вас")
+    return msg
+
+
+def test_connection_is_reused(server, mocker):
+    connect = mocker.spy(mailer.SMTPPool, "_connect")
+
+    async def scenario():
+        sender = mailer.Mailer(pool_size=1, rate_limit=1000)
+        try:
+            for address in ("a@example.com", "b@example.com", "c@example.com"):
+                assert await sender.send(_message(), [address]) == {}
+        finally:
+            await sender.stop()
+
+    asyncio.run(scenario())
+    assert server.envelopes == [["a@example.com"], ["b@example.com"], ["c@example.com"]]
+    assert connect.call_count == 1
+
+
+def test_dropped_connection_is_retried_with_backoff(server, mocker):
+    connect = mocker.spy(mailer.SMTPPool, "_connect")
+    server.drop = 2
+
+    async def scenario():
+        sender = mailer.Mailer(pool_size=1, rate_limit=1000)
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        try:
+            refused = await sender.send(_message(), ["a@example.com"])
+        finally:
+            await sender.stop()
+        return refused, loop.time() - started
+
+    refused, elapsed = asyncio.run(scenario())
+    assert refused == {}
+    assert server.envelopes == [["a@example.com"]]
+    # Каждый обрыв — новое соединение; пауза 0.05 + 0.1 перед повторами
+    assert connect.call_count == 3
+    assert elapsed >= 0.15
+
+
+def test_gives_up_after_retries(server):
+    server.drop = 2
+
+    async def scenario():
+        sender = mailer.Mailer(pool_size=1, rate_limit=1000)
+        try:
+            await sender.send(_message(), ["a@example.com"], retries=1)
+        finally:
+            await sender.stop()
+
+    with pytest.raises(aiosmtplib.SMTPException):
+        asyncio.run(scenario())
+    assert server.envelopes == []
+
+
+def test_refused_recipients_are_reported(server):
+    async def scenario():
+        sender = mailer.Mailer(pool_size=1, rate_limit=1000)
+        try:
+            partly = await sender.send(_message(), ["a@example.com", "bad@example.com"])
+            fully = await sender.send(_message(), ["bad1@example.com", "bad2@example.com"])
+        finally:
+            await sender.stop()
+        return partly, fully
+
+    partly, fully = asyncio.run(scenario())
+    assert partly == {"bad@example.com": "No such user"}
+    assert set(fully) == {"bad1@example.com", "bad2@example.com"}
+    assert server.envelopes == [["a@example.com"]]
+
+
+def test_send_many_splits_into_batches(server):
+    recipients = [f"guest{i}@example.com" for i in range(120)] + ["bad@example.com"]
+
+    async def scenario():
+        sender = mailer.Mailer(pool_size=2, rate_limit=1000)
+        try:
+            return await sender.send_many(_message(), recipients)
+        finally:
+            await sender.stop()
+
+    refused = asyncio.run(scenario())
+    assert refused == {"bad@example.com": "No such user"}
+    assert sorted(len(envelope) for envelope in server.envelopes) == [20, 50, 50]
+    assert sorted(sum(server.envelopes, [])) == sorted(recipients[:-1])
+
+
+def test_without_retries_fails_on_first_drop(server, mocker):
+    connect = mocker.spy(mailer.SMTPPool, "_connect")
+    server.drop = 1
+
+    async def scenario():
+        sender = mailer.Mailer(pool_size=1, rate_limit=1000)
+        try:
+            await sender.send(_message(), ["a@example.com"], retries=0)
+        finally:
+            await sender.stop()
+
+    with pytest.raises(aiosmtplib.SMTPException):
+        asyncio.run(scenario())
+    assert connect.call_count == 1
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+import outbox
+import repository
+
+
+class FakeOutboxTable:
+    def __init__(self):
+        self.jobs = {}
+        self.calls = []
+
+    async def checkpoint_outbox(self, job_id, attempts, payload, lease_seconds):
+        job = self.jobs[job_id]
+        if job["attempts"] != attempts:
+            return False
+        job["payload"] = payload
+        self.calls.append(("checkpoint", job_id))
+        return True
+
+    async def complete_outbox(self, job_id):
+        self.calls.append(("done", job_id))
+
+    async def retry_outbox(self, job_id, next_attempt_at, error):
+        self.calls.append(("retry", job_id))
+
+    async def dead_letter_outbox(self, job_id, error):
+        self.calls.append(("dead", job_id))
+
+
+@pytest.fixture
+def table(monkeypatch):
+    fake = FakeOutboxTable()
+    for name in ("checkpoint_outbox", "complete_outbox", "retry_outbox", "dead_letter_outbox"):
+        monkeypatch.setattr(repository, name, getattr(fake, name))
+    return fake
+
+
+def _claim(table, payload: dict) -> dict:
+    # Как claim_outbox: воркер получает копию строки с увеличенным attempts
+    row = table.jobs.setdefault(1, {"id": 1, "kind": "send", "attempts": 0, "payload": payload})
+    row["attempts"] += 1
+    return {**row, "payload": dict(row["payload"])}
+
+
+def test_retry_resumes_from_checkpoint(table):
+    sent = []
+
+    async def handler(payload):
+        for address in payload["emails"][len(payload.setdefault("sent", [])):]:
+            if address == "b@example.com" and "b@example.com" not in payload.get("failed_once", []):
+                payload["failed_once"] = ["b@example.com"]
+                raise OSError("connection dropped")
+            sent.append(address)
+            payload["sent"] = payload["sent"] + [address]
+            await outbox.checkpoint(payload)
+
+    worker = outbox.Outbox()
+    worker.register("send", handler)
+
+    async def scenario():
+        await worker._execute(_claim(table, {"emails": ["a@example.com", "b@example.com"]}))
+        await worker._execute(_claim(table, {}))
+
+    asyncio.run(scenario())
+    # Второй попытке достался payload из checkpoint: a@example.com второй раз не отправлен
+    assert sent == ["a@example.com", "b@example.com"]
+    assert table.calls == [("checkpoint", 1), ("retry", 1), ("checkpoint", 1), ("done", 1)]
+
+
+def test_stale_attempt_stops_after_lease_is_lost(table):
+    async def handler(payload):
+        table.jobs[1]["attempts"] += 1  # аренда истекла, задачу забрала следующая попытка
+        await outbox.checkpoint(payload)
+
+    worker = outbox.Outbox()
+    worker.register("send", handler)
+
+    asyncio.run(worker._execute(_claim(table, {"emails": ["a@example.com"]})))
+
+    assert table.calls == []
+    assert worker.stats == {"done": 0, "retried": 0, "dead": 0}
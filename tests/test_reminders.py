@@ -0,0 +1,58 @@
+import asyncio
+import datetime
+
+import profiles
+import reminders
+import repository
+
+
+class FakeBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append((chat_id, text))
+
+
+def _at(minutes: int) -> str:
+    return (datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(minutes=minutes)).isoformat()
+
+
+def test_moved_meeting_is_reminded_at_new_time(monkeypatch):
+    claimed = []
+
+    async def claim_reminder(appointment_id, meeting_date_time):
+        claimed.append((appointment_id, meeting_date_time))
+        return True
+
+    async def get_profile(user_id):
+        return profiles.Profile()
+
+    monkeypatch.setattr(repository, "claim_reminder", claim_reminder)
+    monkeypatch.setattr(profiles, "get_profile", get_profile)
+    bot = FakeBot()
+
+    async def scenario():
+        scheduler = reminders.ReminderScheduler(bot, minutes=30, horizon=datetime.timedelta(hours=2))
+        scheduler._loaded_until = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=2)
+        # Перенесли ближе: напоминание должно уйти сейчас и с новым временем
+        scheduler.schedule({"id": 1, "meeting_date_time": _at(90), "title": "Первая"}, 100)
+        moved_closer = {"id": 1, "meeting_date_time": _at(10), "title": "Первая"}
+        scheduler.schedule(moved_closer, 100)
+        # Перенесли дальше: старое срочное напоминание отменяется
+        scheduler.schedule({"id": 2, "meeting_date_time": _at(10), "title": "Вторая"}, 200)
+        scheduler.schedule({"id": 2, "meeting_date_time": _at(90), "title": "Вторая"}, 200)
+        # Перенесли за пределы окна: напоминание отменяется до следующей дозагрузки
+        scheduler.schedule({"id": 3, "meeting_date_time": _at(10), "title": "Третья"}, 300)
+        scheduler.schedule({"id": 3, "meeting_date_time": _at(600), "title": "Третья"}, 300)
+        assert len(scheduler) == 2
+
+        runner = asyncio.create_task(scheduler.run())
+        await asyncio.sleep(0.1)
+        runner.cancel()
+        return moved_closer["meeting_date_time"], len(scheduler)
+
+    moved_at, pending = asyncio.run(scenario())
+    assert claimed == [(1, moved_at)]
+    assert [chat_id for chat_id, _ in bot.sent] == [100]
+    assert pending == 1
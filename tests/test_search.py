@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import repository
+import search
+import storage
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def shared_storage(request, tmp_path, monkeypatch):
+    if request.param == "redis":
+        # Как при FSM_STORAGE=redis: хранилище собирает storage.create_storage
+        fakeredis = pytest.importorskip("fakeredis")
+        fsm = storage.create_redis_storage(fakeredis.FakeAsyncRedis())
+    else:
+        fsm = storage.SQLiteStorage(str(tmp_path / "fsm.sqlite3"))
+    monkeypatch.setattr(search, "_storage", fsm)
+    monkeypatch.setattr(search, "_pages", {})
+    yield fsm
+    if request.param == "sqlite":
+        asyncio.run(fsm.close())
+
+
+def _rows(start: int, count: int) -> list:
+    return [{"id": i, "meeting_date_time": f"2030-01-{i:02d}T10:00:00+00:00"} for i in range(start, start + count)]
+
+
+def test_query_and_cursors_live_in_shared_storage(shared_storage, monkeypatch):
+    calls = []
+
+    async def search_appointments(user_id, filters, cursor=None, limit=repository.APPOINTMENTS_PAGE_SIZE):
+        calls.append(cursor)
+        return (_rows(1, 10), True) if cursor is None else (_rows(11, 3), False)
+
+    monkeypatch.setattr(repository, "search_appointments", search_appointments)
+    filters = {"words": ["звонок"]}
+
+    async def scenario():
+        token = await search.create(100, "звонок", filters)
+        first = await search.get_page(100, token, 0)
+        # Другой процесс: своих страниц в памяти нет, запрос и курсор — из хранилища
+        search._pages.clear()
+        second = await search.get_page(100, token, 1)
+        foreign = await search.get_page(200, token, 0)
+        return token, first, second, foreign, await search.create(100, "звонок", filters)
+
+    token, first, second, foreign, again = asyncio.run(scenario())
+    assert first == ("звонок", _rows(1, 10), True)
+    assert second == ("звонок", _rows(11, 3), False)
+    assert calls == [None, ("2030-01-10T10:00:00+00:00", 10)]
+    assert foreign is None
+    assert again == token
+
+
+def test_unknown_token_or_page(shared_storage):
+    async def scenario():
+        token = await search.create(100, "звонок", {"words": ["звонок"]})
+        return await search.get_page(100, "missing", 0), await search.get_page(100, token, 1)
+
+    assert asyncio.run(scenario()) == (None, None)
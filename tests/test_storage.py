@@ -0,0 +1,106 @@
+import asyncio
+import time
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+import storage
+
+
+class Form(StatesGroup):
+    name = State()
+
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+OTHER_KEY = StorageKey(bot_id=1, chat_id=20, user_id=20)
+
+
+@pytest.fixture
+def sqlite_storage(tmp_path):
+    fsm = storage.SQLiteStorage(str(tmp_path / "fsm.sqlite3"), ttl=60)
+    yield fsm
+    asyncio.run(fsm.close())
+
+
+def test_sqlite_round_trip(sqlite_storage):
+    async def scenario():
+        await sqlite_storage.set_state(KEY, Form.name)
+        await sqlite_storage.set_data(KEY, {"title": "Встреча", "calendar_id": "c@group"})
+        return await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY)
+
+    assert asyncio.run(scenario()) == (Form.name.state, {"title": "Встреча", "calendar_id": "c@group"})
+
+
+def test_sqlite_state_and_data_are_independent(sqlite_storage):
+    async def scenario():
+        await sqlite_storage.set_data(KEY, {"a": 1})
+        await sqlite_storage.set_state(KEY, Form.name)
+        await sqlite_storage.set_state(KEY, None)
+        return await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY)
+
+    assert asyncio.run(scenario()) == (None, {"a": 1})
+
+
+def test_sqlite_survives_reopen(tmp_path):
+    path = str(tmp_path / "fsm.sqlite3")
+
+    async def write():
+        fsm = storage.SQLiteStorage(path)
+        await fsm.set_state(KEY, Form.name)
+        await fsm.close()
+
+    async def read():
+        fsm = storage.SQLiteStorage(path)
+        try:
+            return await fsm.get_state(KEY)
+        finally:
+            await fsm.close()
+
+    asyncio.run(write())
+    assert asyncio.run(read()) == Form.name.state
+
+
+def test_sqlite_expired_dialog_is_ignored(sqlite_storage, mocker):
+    now = time.time()
+    clock = mocker.patch("storage.time.time", return_value=now)
+
+    async def scenario():
+        await sqlite_storage.set_state(KEY, Form.name)
+        await sqlite_storage.set_data(KEY, {"a": 1})
+        clock.return_value = now + 61
+        return await sqlite_storage.get_state(KEY), await sqlite_storage.get_data(KEY)
+
+    assert asyncio.run(scenario()) == (None, {})
+
+
+def test_sqlite_sweep_removes_only_expired(sqlite_storage, mocker):
+    now = time.time()
+    clock = mocker.patch("storage.time.time", return_value=now)
+
+    async def scenario():
+        await sqlite_storage.set_state(KEY, Form.name)
+        clock.return_value = now + 30
+        await sqlite_storage.set_state(OTHER_KEY, Form.name)
+        clock.return_value = now + 61
+        removed = await sqlite_storage.sweep()
+        return removed, await sqlite_storage.get_state(KEY), await sqlite_storage.get_state(OTHER_KEY)
+
+    assert asyncio.run(scenario()) == (1, None, Form.name.state)
+
+
+def test_redis_round_trip_and_ttl():
+    fakeredis = pytest.importorskip("fakeredis")
+    from aiogram.fsm.storage.redis import RedisStorage
+
+    async def scenario():
+        redis = fakeredis.FakeAsyncRedis()
+        fsm = RedisStorage(redis, state_ttl=60, data_ttl=60)
+        await fsm.set_state(KEY, Form.name)
+        await fsm.set_data(KEY, {"a": 1})
+        state_ttl = await redis.ttl(fsm.key_builder.build(KEY, "state"))
+        result = await fsm.get_state(KEY), await fsm.get_data(KEY), 0 < state_ttl <= 60
+        await fsm.close()
+        return result
+
+    assert asyncio.run(scenario()) == (Form.name.state, {"a": 1}, True)
@@ -0,0 +1,144 @@
+import asyncio
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import GetUpdates
+from aiogram.types import TelegramObject, Update
+from cachetools import TTLCache
+
+# === Ограничение частоты запросов ===
+# Входящие: у каждого пользователя свой token bucket, а повторное нажатие той
+# же кнопки, пришедшее пока первое ещё обрабатывалось, отбрасывается. Проверка
+# стоит до FSM-middleware, то есть до блокировки пользователя (events isolation),
+# иначе лишние апдейты успевали бы встать в очередь.
+# Исходящие: общий token bucket на все вызовы Telegram API процесса; запросы
+# ждут своей очереди, а на 429 бот выдерживает retry_after и повторяет запрос.
+# Bucket у каждого процесса свой, поэтому при WEBHOOK_PROCESSES > 1 лимит по
+# умолчанию делится между процессами; заданный явно TELEGRAM_RATE — на процесс.
+
+USER_RATE = float(os.getenv("USER_RATE", "1"))  # апдейтов в секунду на пользователя
+USER_BURST = int(os.getenv("USER_BURST", "5"))
+USER_NOTICE_INTERVAL = 10.0
+WEBHOOK_PROCESSES = int(os.getenv("WEBHOOK_PROCESSES", "1"))
+# запросов в секунду на процесс (лимит Telegram — 30 на бота)
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", str(25 / WEBHOOK_PROCESSES)))
+TELEGRAM_BURST = int(os.getenv("TELEGRAM_BURST", str(max(1, 25 // WEBHOOK_PROCESSES))))
+TELEGRAM_RETRIES = int(os.getenv("TELEGRAM_RETRIES", "3"))
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    def delay(self) -> float:
+        # Через сколько секунд появится жетон
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class UserThrottlingMiddleware(BaseMiddleware):
+    def __init__(self):
+        self._buckets = TTLCache(maxsize=100_000, ttl=600)
+        self._noticed = TTLCache(maxsize=100_000, ttl=USER_NOTICE_INTERVAL)
+        # (telegram_id, запрос) -> [когда пришёл, когда обработан или None]
+        self._requests = TTLCache(maxsize=100_000, ttl=600)
+
+    @staticmethod
+    def _request_key(update: Update):
+        if update.message and update.message.text:
+            return "message", update.message.text
+        if update.callback_query:
+            return "callback", update.callback_query.data
+        return None
+
+    async def _reject(self, update: Update, user_id: int, bot, text: str):
+        if update.callback_query:
+            # На callback нужно ответить в любом случае, иначе кнопка «висит»
+            await update.callback_query.answer(text)
+        elif user_id not in self._noticed and update.message:
+            self._noticed[user_id] = True
+            await bot.send_message(update.message.chat.id, text)
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        user = data.get("event_from_user")
+        if user is None or not isinstance(event, Update):
+            return await handler(event, data)
+        # В режиме webhook апдейт мог постоять в очереди, поэтому время прихода
+        # передаёт webhook.py; при polling апдейт приходит прямо сюда
+        received_at = data.get("received_at") or time.monotonic()
+        request = self._request_key(event)
+        key = (user.id, request)
+        previous = self._requests.get(key) if request else None
+        if previous and previous[0] <= received_at and (previous[1] is None or received_at < previous[1]):
+            return await self._reject(event, user.id, data["bot"], "⏳ Запрос уже выполняется, подождите.")
+        bucket = self._buckets.get(user.id)
+        if bucket is None:
+            bucket = self._buckets[user.id] = TokenBucket(USER_RATE, USER_BURST)
+        if not bucket.try_acquire():
+            return await self._reject(event, user.id, data["bot"], "⏳ Слишком много запросов, подождите немного.")
+        if not request:
+            return await handler(event, data)
+        entry = self._requests[key] = [received_at, None]
+        try:
+            return await handler(event, data)
+        finally:
+            entry[1] = time.monotonic()
+
+
+class OutboundLimiter(BaseRequestMiddleware):
+    def __init__(self):
+        self._bucket = TokenBucket(TELEGRAM_RATE, TELEGRAM_BURST)
+        self._lock = asyncio.Lock()
+        self._paused_until = 0.0
+
+    async def _acquire(self):
+        # Под блокировкой запросы получают жетоны строго по очереди
+        async with self._lock:
+            while True:
+                wait = max(self._paused_until - time.monotonic(), self._bucket.delay())
+                if wait <= 0 and self._bucket.try_acquire():
+                    return
+                await asyncio.sleep(wait)
+
+    async def __call__(self, make_request, bot, method):
+        if isinstance(method, GetUpdates):
+            return await make_request(bot, method)
+        for attempt in range(TELEGRAM_RETRIES + 1):
+            await self._acquire()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == TELEGRAM_RETRIES:
+                    raise
+                logging.warning(f"⚠️ Telegram просит подождать {e.retry_after} с ({type(method).__name__})")
+                # Пауза общая: остальные запросы тоже ждут, чтобы не получить 429 снова
+                self._paused_until = max(self._paused_until, time.monotonic() + e.retry_after)
+
+
+def setup(dp, bot):
+    # Middleware должна стоять перед FSM: переставляем FSM в конец цепочки
+    dp.update.outer_middleware.unregister(dp.fsm)
+    dp.update.outer_middleware(UserThrottlingMiddleware())
+    dp.update.outer_middleware(dp.fsm)
+    bot.session.middleware(OutboundLimiter())
@@ -0,0 +1,176 @@
+import asyncio
+import collections
+import logging
+import multiprocessing
+import os
+import time
+
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+from aiohttp import web
+
+import storage
+
+
+# === Режим webhook ===
+# Апдейт принимается, ставится в очередь своего пользователя и сразу
+# подтверждается. Очередь пользователя создаётся с первым апдейтом и
+# исчезает, как только опустеет; апдейты одного пользователя обрабатываются
+# строго по порядку (FSM), а разные пользователи — параллельно, без общего
+# лимита, как при polling. Долгий обработчик (/import, /export) задерживает
+# только своего пользователя.
+# Порядок гарантируется только внутри процесса: при нескольких процессах
+# блокировка пользователя в Redis (events isolation) не даёт обрабатывать
+# два его апдейта одновременно, но не сохраняет порядок их прихода.
+
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # публичный https-адрес, например https://bot.example.com/webhook
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Несколько процессов слушают один порт (SO_REUSEPORT); для них нужен общий
+# FSM_STORAGE=redis, тогда состояние диалогов и блокировка пользователя общие.
+# Кэши в памяти (календари, профили, страницы результатов /search) у каждого
+# процесса свои, запросы /search для листания хранятся в том же Redis
+WEBHOOK_PROCESSES = int(os.getenv("WEBHOOK_PROCESSES", "1"))
+DRAIN_TIMEOUT = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
+
+def update_user_id(update: Update) -> int:
+    try:
+        event = update.event
+    except Exception:
+        return 0
+    user = getattr(event, "from_user", None)
+    if user:
+        return user.id
+    chat = getattr(event, "chat", None)
+    return chat.id if chat else 0
+
+
+class UserUpdateQueue:
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.accepting = False
+        self._queues = {}  # telegram_id -> deque апдейтов, ждущих своей очереди
+        self._tasks = set()
+
+    def __len__(self):
+        return sum(len(queue) for queue in self._queues.values()) + len(self._tasks)
+
+    def start(self):
+        self.accepting = True
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def submit(self, update: Update):
+        item = (update, time.monotonic())
+        user_id = update_user_id(update)
+        if not user_id:
+            # Апдейт без пользователя ни с чем не упорядочиваем
+            return self._spawn(self._process(*item))
+        queue = self._queues.get(user_id)
+        if queue is None:
+            queue = self._queues[user_id] = collections.deque()
+            self._spawn(self._run_user(user_id, queue))
+        queue.append(item)
+
+    async def _process(self, update: Update, received_at: float):
+        try:
+            # received_at нужен throttling: повтор, пришедший во время обработки, отбрасывается
+            await self.dp.feed_update(self.bot, update, received_at=received_at)
+        except Exception:
+            logging.exception(f"Ошибка при обработке апдейта {update.update_id}")
+
+    async def _run_user(self, user_id: int, queue: collections.deque):
+        try:
+            # Между проверкой пустой очереди и её удалением нет await, поэтому
+            # новый апдейт либо попадёт в эту очередь, либо создаст новую
+            while queue:
+                await self._process(*queue.popleft())
+        finally:
+            del self._queues[user_id]
+
+    async def drain(self, timeout: float = DRAIN_TIMEOUT):
+        # Новые апдейты больше не принимаем (Telegram повторит их позже),
+        # а уже принятые дорабатываем
+        self.accepting = False
+        if self._tasks:
+            logging.info(f"Webhook: дорабатываем {len(self)} апдейтов перед остановкой")
+            _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                logging.warning("Webhook: не все апдейты обработаны до остановки")
+                for task in pending:
+                    task.cancel()
+
+
+def create_app(dp: Dispatcher, bot: Bot, primary: bool = True) -> web.Application:
+    queue = UserUpdateQueue(dp, bot)
+    app = web.Application()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        if not queue.accepting:
+            return web.Response(status=503)
+        update = Update.model_validate(await request.json(), context={"bot": bot})
+        queue.submit(update)
+        return web.Response()
+
+    async def on_startup(app: web.Application):
+        await dp.emit_startup(bot=bot, dispatcher=dp, primary=primary)
+        queue.start()
+        if primary:
+            await bot.set_webhook(
+                WEBHOOK_URL,
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+                drop_pending_updates=False
+            )
+
+    async def on_shutdown(app: web.Application):
+        # Webhook не удаляем: пока бот перезапускается, Telegram копит апдейты у себя
+        await queue.drain()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await dp.storage.close()
+        await bot.session.close()
+
+    app.router.add_post(WEBHOOK_PATH, handle_update)
+    app.on_startup.append(on_startup)
+    app.on_shutdown.append(on_shutdown)
+    return app
+
+
+def _serve(dp: Dispatcher, bot: Bot, primary: bool):
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(
+        create_app(dp, bot, primary),
+        host=WEBHOOK_HOST,
+        port=WEBHOOK_PORT,
+        reuse_port=WEBHOOK_PROCESSES > 1,
+        print=None
+    )
+
+
+def run(dp: Dispatcher, bot: Bot):
+    if not WEBHOOK_URL:
+        raise ValueError("Для режима webhook укажите WEBHOOK_URL в .env!")
+    if WEBHOOK_PROCESSES > 1 and storage.FSM_STORAGE != "redis":
+        # Иначе у каждого процесса своя блокировка пользователя и своё состояние диалогов
+        raise ValueError("WEBHOOK_PROCESSES > 1 работает только с FSM_STORAGE=redis!")
+    processes = [
+        multiprocessing.Process(target=_serve, args=(dp, bot, False), daemon=False)
+        for _ in range(WEBHOOK_PROCESSES - 1)
+    ]
+    for process in processes:
+        process.start()
+    try:
+        _serve(dp, bot, primary=True)
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()